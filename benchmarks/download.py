@@ -0,0 +1,135 @@
+"""Benchmark the segment probing and the download against a local mock origin, without network.
+
+Author: Mikeprod
+Usage: python -m benchmarks.download --segments 100,1000 --workers 1,8,32 --latency 0.02 --output bench.json
+"""
+
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+from urllib.error import URLError
+
+import click
+
+from benchmarks.harness import report
+from src.download import download_dashed_vtt
+from src.metrics import METRICS
+from src.origin import MockOrigin
+
+
+def download_benchmarks(
+    segment_counts: list[int],
+    worker_counts: list[int],
+    repeat: int,
+    latency: float,
+    jitter: float,
+    error_rate: float,
+) -> list[dict[str, Any]]:
+    """Download streams of several sizes from a mock origin, with several numbers of download threads.
+
+    Each run starts from an empty folder, so that nothing is resumed. The probe request count, the probe time,
+    the download throughput and the wall time are reported for the best run. Failed segment downloads are retried,
+    so the error rate measures the cost of the recovery. Runs aborted by a download failing after its retries are
+    only counted, their best and mean times being None if every run failed.
+
+    :param segment_counts: numbers of segments of the streams
+    :type segment_counts: list[int]
+    :param worker_counts: numbers of segments downloaded in parallel
+    :type worker_counts: list[int]
+    :param repeat: number of runs of each benchmark, the fastest one is kept
+    :type repeat: int
+    :param latency: seconds waited by the origin before each answer
+    :type latency: float
+    :param jitter: maximum random seconds added to the latency
+    :type jitter: float
+    :param error_rate: share of the segment downloads failing
+    :type error_rate: float
+    :return: the benchmark results
+    :rtype: list[dict[str, Any]]
+    """
+    results = []
+    for segments in segment_counts:
+        with MockOrigin(segments, latency=latency, jitter=jitter, error_rate=error_rate) as origin:
+            for workers in worker_counts:
+                runs = []
+                for _ in range(repeat):
+                    origin.reset_counters()
+                    METRICS.reset()
+                    error = None
+                    with tempfile.TemporaryDirectory() as folder:
+                        started = time.perf_counter()
+                        try:
+                            download_dashed_vtt(origin.url, Path(folder), workers=workers)
+                        except (URLError, OSError) as failure:
+                            error = str(failure)
+                        wall = time.perf_counter() - started
+                        downloaded = len(list(Path(folder).glob("*.mp4")))
+                    stages = METRICS.report()["stages"]
+                    runs.append(
+                        {
+                            "wall": wall,
+                            "probe_requests": origin.counters["head"] + origin.counters["range"],
+                            "probe_seconds": stages.get("probe", {}).get("seconds", 0.0),
+                            "segments_found": stages.get("probe", {}).get("segments", 0),
+                            "downloaded": downloaded,
+                            "segments_per_second": downloaded / wall if wall else 0.0,
+                            "failed_requests": origin.counters["errors"],
+                            "retries": stages.get("download", {}).get("retries", 0),
+                            "error": error,
+                        }
+                    )
+                # An aborted run downloads fewer segments, its time is not comparable to a complete one
+                completed = [run for run in runs if run["error"] is None]
+                failures = [run["error"] for run in runs if run["error"] is not None]
+                best = min(completed, key=lambda run: run["wall"]) if completed else None
+                results.append(
+                    {
+                        "name": "download_dashed_vtt",
+                        "parameters": {"segments": segments, "workers": workers, "latency": latency},
+                        "best": best["wall"] if best else None,
+                        "mean": sum(run["wall"] for run in completed) / len(completed) if completed else None,
+                        "calls": len(completed),
+                        "failed_runs": len(failures),
+                        "failures": sorted(set(failures)),
+                        **{key: value for key, value in (best or {}).items() if key not in ("wall", "error")},
+                    }
+                )
+    return results
+
+
+@click.command()
+@click.option("--segments", default="100,1000", help="Numbers of segments of the streams, comma separated.")
+@click.option("--workers", default="1,8,32", help="Numbers of parallel downloads, comma separated.")
+@click.option("--repeat", default=3, help="Number of runs of each benchmark, the fastest one is kept.")
+@click.option("--latency", default=0.02, help="Seconds waited by the origin before each answer. Defaults to 0.02.")
+@click.option("--jitter", default=0.01, help="Maximum random seconds added to the latency. Defaults to 0.01.")
+@click.option("--error-rate", default=0.0, help="Share of the segment downloads failing with 503. Defaults to 0.")
+@click.option("--output", "-o", default=None, metavar="FILE", help="JSON report file. Defaults to the standard output.")
+@click.option("--baseline", default=None, metavar="FILE", help="JSON report of a previous run to compare with.")
+@click.option("--tolerance", default=0.1, help="Slowdown accepted before failing, 0.1 for 10%. Defaults to 0.1.")
+@click.help_option("--help", "-h")
+def benchmark(
+    segments: str,
+    workers: str,
+    repeat: int,
+    latency: float,
+    jitter: float,
+    error_rate: float,
+    output: Optional[str],
+    baseline: Optional[str],
+    tolerance: float,
+):
+    results = download_benchmarks(
+        [int(count) for count in segments.split(",")],
+        [int(count) for count in workers.split(",")],
+        repeat,
+        latency,
+        jitter,
+        error_rate,
+    )
+    report(results, output and Path(output), baseline and Path(baseline), tolerance)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,102 @@
+"""Timing, reporting and baseline comparison shared by the benchmarks.
+
+Author: Mikeprod
+"""
+
+import json
+import platform
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import click
+
+
+def measure(name: str, function: Callable[[], Any], repeat: int = 5, **parameters: Any) -> dict[str, Any]:
+    """Time a function, repeating it until each measure lasts long enough to be reliable.
+
+    :param name: benchmark name
+    :type name: str
+    :param function: function to time, called without argument
+    :type function: Callable[[], Any]
+    :param repeat: number of measures, the best one is kept, defaults to 5
+    :type repeat: int, optional
+    :param parameters: parameters of the benchmark, such as the input size
+    :return: the benchmark result, times in seconds per call
+    :rtype: dict[str, Any]
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    timings = [timing / number for timing in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "name": name,
+        "parameters": parameters,
+        "best": min(timings),
+        "mean": sum(timings) / len(timings),
+        "calls": number * repeat,
+    }
+
+
+def result_key(result: dict[str, Any]) -> str:
+    """Identify a result by its benchmark name and parameters, to match it against a baseline.
+
+    :param result: benchmark result
+    :type result: dict[str, Any]
+    :return: the result identifier
+    :rtype: str
+    """
+    parameters = ",".join(f"{key}={value}" for key, value in sorted(result["parameters"].items()))
+    return f"{result['name']}[{parameters}]"
+
+
+def compare(results: list[dict[str, Any]], baseline: list[dict[str, Any]], tolerance: float) -> list[str]:
+    """Compare results against a baseline.
+
+    :param results: current benchmark results
+    :type results: list[dict[str, Any]]
+    :param baseline: previous benchmark results
+    :type baseline: list[dict[str, Any]]
+    :param tolerance: relative slowdown accepted before reporting a regression, e.g. 0.1 for 10%
+    :type tolerance: float
+    :return: a description of each regression
+    :rtype: list[str]
+    """
+    reference = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in reference or result["best"] is None or reference[key]["best"] is None:
+            continue
+        ratio = result["best"] / reference[key]["best"]
+        result["baseline_ratio"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(f"{key} is {ratio:.2f}x slower than the baseline")
+    return regressions
+
+
+def report(results: list[dict[str, Any]], output: Optional[Path], baseline: Optional[Path], tolerance: float) -> None:
+    """Write the results as JSON and fail on regressions against a baseline.
+
+    :param results: benchmark results
+    :type results: list[dict[str, Any]]
+    :param output: file receiving the JSON report, the standard output if None
+    :type output: Optional[Path]
+    :param baseline: JSON report of a previous run to compare with, defaults to None
+    :type baseline: Optional[Path]
+    :param tolerance: relative slowdown accepted before reporting a regression
+    :type tolerance: float
+    :raises click.ClickException: if a benchmark regressed
+    :return: None
+    """
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, json.loads(baseline.read_text("utf-8"))["results"], tolerance)
+    content = json.dumps(
+        {"python": platform.python_version(), "machine": platform.machine(), "results": results}, indent=2
+    )
+    if output is None:
+        click.echo(content)
+    else:
+        output.write_text(content, "utf-8")
+    if regressions:
+        raise click.ClickException("\n".join(regressions))
@@ -0,0 +1,75 @@
+"""Benchmark the segment parsing and the vtt conversion on synthetic segments.
+
+Author: Mikeprod
+Usage: python -m benchmarks.parsing --output bench.json [--baseline previous.json]
+"""
+
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Any, Optional
+
+import click
+
+from benchmarks.harness import measure, report
+from src.create_vtt_subs import extract_vtt_from_dash
+from src.mp4 import Mp4
+from src.synthetic import SAMPLE_DURATION, generate_segment, write_dash_folder
+from src.vtt import VTT_HEADER, deduplicate_subtitles, generate_timeline, vtt_from_mp4
+
+
+def parsing_benchmarks(cue_counts: list[int], segment_counts: list[int], repeat: int) -> list[dict[str, Any]]:
+    """Run every parsing benchmark.
+
+    :param cue_counts: numbers of cues per segment
+    :type cue_counts: list[int]
+    :param segment_counts: numbers of segments of the converted folders
+    :type segment_counts: list[int]
+    :param repeat: number of measures of each benchmark
+    :type repeat: int
+    :return: the benchmark results
+    :rtype: list[dict[str, Any]]
+    """
+    results = []
+    for cues in cue_counts:
+        for fragments in (1, 4):
+            segment = generate_segment(1, cue_count=cues, fragment_count=fragments)
+            results.append(
+                measure("mp4_parse", lambda: Mp4.from_bytes(segment), repeat, cues=cues, fragments=fragments)
+            )
+        mp4 = Mp4.from_bytes(generate_segment(1, cue_count=cues))
+        results.append(measure("vtt_from_mp4", lambda: vtt_from_mp4(mp4), repeat, cues=cues))
+        durations = array("I", [SAMPLE_DURATION]) * cues
+        results.append(measure("generate_timeline", lambda: generate_timeline(durations, 0, 90000), repeat, cues=cues))
+
+    for segments in segment_counts:
+        subtitles = VTT_HEADER + "".join(vtt_from_mp4(Mp4.from_bytes(generate_segment(i))) for i in range(segments))
+        results.append(
+            measure("deduplicate_subtitles", lambda: deduplicate_subtitles(subtitles), repeat, segments=segments)
+        )
+        with tempfile.TemporaryDirectory() as folder:
+            dash, output = Path(folder) / "dash", Path(folder) / "output.vtt"
+            write_dash_folder(dash, segments)
+            results.append(
+                measure("extract_vtt_from_dash", lambda: extract_vtt_from_dash(dash, output), repeat, segments=segments)
+            )
+    return results
+
+
+@click.command()
+@click.option("--cues", default="10,100,1000", help="Numbers of cues per segment, comma separated.")
+@click.option("--segments", default="10,100,1000", help="Numbers of segments of the converted folders.")
+@click.option("--repeat", default=5, help="Number of measures of each benchmark, the best one is kept.")
+@click.option("--output", "-o", default=None, metavar="FILE", help="JSON report file. Defaults to the standard output.")
+@click.option("--baseline", default=None, metavar="FILE", help="JSON report of a previous run to compare with.")
+@click.option("--tolerance", default=0.1, help="Slowdown accepted before failing, 0.1 for 10%. Defaults to 0.1.")
+@click.help_option("--help", "-h")
+def benchmark(cues: str, segments: str, repeat: int, output: Optional[str], baseline: Optional[str], tolerance: float):
+    results = parsing_benchmarks(
+        [int(count) for count in cues.split(",")], [int(count) for count in segments.split(",")], repeat
+    )
+    report(results, output and Path(output), baseline and Path(baseline), tolerance)
+
+
+if __name__ == "__main__":
+    benchmark()
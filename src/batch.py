@@ -0,0 +1,232 @@
+"""Run many downloads and conversions in one process, sharing the connections and the worker pools.
+
+Author: Mikeprod
+Usage: python src/batch.py jobs.txt
+"""
+
+import multiprocessing
+import os
+import shlex
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from functools import partial
+from logging import getLogger
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import click
+
+from src.cache import open_cache
+from src.create_vtt_subs import convert_segment_bytes, extract_vtt_from_dash, vtt_output_path
+from src.download import stream_segments
+from src.http_pool import ConnectionPool
+from src.metrics import METRICS, run_measured
+from src.mpd import is_mpd
+from src.pack import SegmentPack
+from src.pipeline import iter_ordered
+from src.writers import VttWriter
+
+LOGGER = getLogger(__name__)
+
+
+class Job(NamedTuple):
+    """Stream url or dash folder, and the vtt file it is converted to."""
+
+    source: str
+    output: Path
+
+    @property
+    def is_url(self) -> bool:
+        return self.source.startswith(("http://", "https://")) or is_mpd(self.source)
+
+
+class JobResult(NamedTuple):
+    """Outcome of a job."""
+
+    job: Job
+    cues: int
+    seconds: float
+    error: Optional[str] = None
+
+
+@click.command()
+@click.argument("jobfile", type=click.Path(exists=True, dir_okay=False))
+@click.option("--parallel", "-p", help="Number of jobs run at the same time. Defaults to 4.", default=4)
+@click.option("--workers", "-w", help="Number of segments downloaded at the same time, all jobs included.", default=8)
+@click.option("--jobs", "-j", help="Number of processes parsing the segments, all jobs included.", default=1)
+@click.option("--step", help="Segment step for each Dash file? Defaults to 10000.", default=10000)
+@click.option("--no-cache", is_flag=True, help="Parse every segment again instead of using the folder parse cache.")
+@click.help_option("--help", "-h")
+def batch(jobfile: str, parallel: int, workers: int, jobs: int, step: int, no_cache: bool):
+    """Convert every job of JOBFILE: one job per line, a stream url or a dash folder followed by the output file."""
+    try:
+        job_list = read_job_file(Path(jobfile))
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Running {len(job_list)} jobs")
+    results = run_jobs(job_list, parallel, workers, jobs, step, use_cache=not no_cache)
+    for result in results:
+        if result.error is None:
+            click.echo(f"[ok] {result.job.source} -> {result.job.output} ({result.cues} cues, {result.seconds:.1f}s)")
+        else:
+            click.echo(f"[failed] {result.job.source}: {result.error}", err=True)
+    failed = [result for result in results if result.error is not None]
+    click.echo(f"{len(results) - len(failed)} jobs succeeded, {len(failed)} failed")
+    if failed:
+        raise SystemExit(1)
+
+
+def read_job_file(path: Path) -> list[Job]:
+    """Read a job file.
+
+    Each line holds a stream url, ending with -0.dash, a MPD manifest or a dash folder, then the output vtt file,
+    separated by spaces. Paths with spaces are quoted. Empty lines and lines starting with # are ignored.
+
+    :param path: job file
+    :type path: Path
+    :raises ValueError: if a line does not hold exactly a source and an output
+    :return: the jobs, in the file order
+    :rtype: list[Job]
+    """
+    job_list = []
+    for number, line in enumerate(path.read_text("utf-8").splitlines(), start=1):
+        fields = shlex.split(line, comments=True)
+        if not fields:
+            continue
+        if len(fields) != 2:
+            raise ValueError(f"{path}:{number}: expected a source and an output, got {line!r}")
+        job_list.append(Job(source=fields[0], output=vtt_output_path(fields[1])))
+    return job_list
+
+
+def convert_stream(
+    job: Job, pool: ConnectionPool, downloads: Executor, conversions: Optional[Executor], step: int, queue_size: int
+) -> int:
+    """Convert a stream url job, the segments are downloaded and parsed in the shared pools.
+
+    :param job: job to run
+    :type job: Job
+    :param pool: keep-alive connections shared by the jobs
+    :type pool: ConnectionPool
+    :param downloads: thread pool downloading the segments of every job
+    :type downloads: Executor
+    :param conversions: process pool parsing the segments of every job, the job thread parses them if None
+    :type conversions: Optional[Executor]
+    :param step: segment step of the stream
+    :type step: int
+    :param queue_size: maximum number of segments of the job in flight
+    :type queue_size: int
+    :return: the number of cues written
+    :rtype: int
+    """
+    segments = stream_segments(job.source, step)
+    LOGGER.info(f"{job.source}: {len(segments)} segments")
+    contents = iter_ordered(downloads, pool.get, (url for _, url in segments), queue_size)
+    with VttWriter(job.output) as writer:
+        convert = partial(run_measured, convert_segment_bytes, os.getpid())
+        for cues, stages in iter_ordered(conversions, convert, contents, queue_size):
+            METRICS.merge(stages)
+            writer.write_all(cues)
+    return writer.cue_count
+
+
+def run_job(
+    job: Job,
+    pool: ConnectionPool,
+    downloads: Executor,
+    conversions: Optional[Executor],
+    step: int,
+    queue_size: int,
+    use_cache: bool,
+) -> JobResult:
+    """Run a job, any error is reported in its result instead of being raised.
+
+    :param job: job to run
+    :type job: Job
+    :param pool: keep-alive connections shared by the jobs
+    :type pool: ConnectionPool
+    :param downloads: thread pool downloading the segments of every job
+    :type downloads: Executor
+    :param conversions: process pool parsing the segments of every job, the job thread parses them if None
+    :type conversions: Optional[Executor]
+    :param step: segment step of the streams
+    :type step: int
+    :param queue_size: maximum number of segments of the job in flight
+    :type queue_size: int
+    :param use_cache: whether to use the parse cache of the dash folders
+    :type use_cache: bool
+    :return: the job result
+    :rtype: JobResult
+    """
+    start = time.perf_counter()
+    try:
+        job.output.parent.mkdir(parents=True, exist_ok=True)
+        if job.is_url:
+            cues = convert_stream(job, pool, downloads, conversions, step, queue_size)
+        else:
+            folder = Path(job.source)
+            if not folder.exists():
+                raise FileNotFoundError(f"{folder} not found")
+            with ExitStack() as stack:
+                packed = SegmentPack.exists(folder)
+                cache = open_cache(folder) if use_cache and folder.is_dir() and not packed else None
+                if cache is not None:
+                    stack.enter_context(cache)
+                cues = extract_vtt_from_dash(folder, job.output, cache=cache, executor=conversions)
+    except Exception as error:
+        LOGGER.debug(f"{job.source} failed", exc_info=True)
+        return JobResult(job, 0, time.perf_counter() - start, f"{type(error).__name__}: {error}")
+    return JobResult(job, cues, time.perf_counter() - start)
+
+
+def run_jobs(
+    job_list: list[Job], parallel: int = 4, workers: int = 8, jobs: int = 1, step: int = 10000, use_cache: bool = True
+) -> list[JobResult]:
+    """Run jobs concurrently, with global limits on the downloads and the parsing processes.
+
+    The status of each job is logged as soon as it ends, a failing job does not stop the others.
+
+    :param job_list: jobs to run
+    :type job_list: list[Job]
+    :param parallel: number of jobs run at the same time, defaults to 4
+    :type parallel: int, optional
+    :param workers: number of segments downloaded at the same time, all jobs included, defaults to 8
+    :type workers: int, optional
+    :param jobs: number of processes parsing the segments, all jobs included, defaults to 1
+    :type jobs: int, optional
+    :param step: segment step of the streams, defaults to 10000
+    :type step: int, optional
+    :param use_cache: whether to use the parse cache of the dash folders, defaults to True
+    :type use_cache: bool, optional
+    :return: the result of each job, in the job list order
+    :rtype: list[JobResult]
+    """
+    with ExitStack() as stack:
+        pool = stack.enter_context(ConnectionPool())
+        downloads = stack.enter_context(ThreadPoolExecutor(max_workers=workers))
+        conversions = None
+        if jobs > 1:
+            # Job threads are running when the workers start, so they are spawned rather than forked
+            conversions = stack.enter_context(
+                ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"))
+            )
+        runner = stack.enter_context(ThreadPoolExecutor(max_workers=parallel))
+        queue_size = max(32, workers)
+        futures = {
+            runner.submit(run_job, job, pool, downloads, conversions, step, queue_size, use_cache): position
+            for position, job in enumerate(job_list)
+        }
+        results: list[Optional[JobResult]] = [None] * len(job_list)
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if result.error is None:
+                LOGGER.info(f"{result.job.source} -> {result.job.output} ({result.cues} cues, {result.seconds:.1f}s)")
+            else:
+                LOGGER.info(f"{result.job.source} failed: {result.error}")
+    return results
+
+
+if __name__ == "__main__":
+    batch()
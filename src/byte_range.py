@@ -0,0 +1,205 @@
+"""Read a subtitle track published as a single fragmented mp4 file through HTTP byte range requests.
+
+The sidx box of the file indexes its subsegments, so each subsegment can be fetched on its own.
+
+Author: Mikeprod
+"""
+
+import re
+from logging import getLogger
+from typing import NamedTuple, Optional
+from urllib.error import HTTPError
+
+from src.http_pool import ConnectionPool
+from src.mp4 import SegmentSpan, decode_sidx, iter_file_boxes
+
+LOGGER = getLogger(__name__)
+# Bytes read by a single request when the headers of the file are walked
+READ_AHEAD = 65536
+CONTENT_RANGE = re.compile(r"bytes (?:\d+-\d+|\*)/(\d+)")
+
+
+class Subsegment(NamedTuple):
+    """Subsegment of a file, located by the sidx box indexing it."""
+
+    offset: int
+    size: int
+    span: SegmentSpan
+
+
+def fetch_range(pool: ConnectionPool, url: str, start: int, end: int) -> tuple[bytes, Optional[int], bool]:
+    """Download a byte range of a file, or the whole file from a server ignoring byte range requests.
+
+    :param pool: keep-alive connections used for the request
+    :type pool: ConnectionPool
+    :param url: file url
+    :type url: str
+    :param start: offset of the first byte
+    :type start: int
+    :param end: offset following the last byte
+    :type end: int
+    :raises HTTPError: if the server answers with an error status
+    :return: the bytes, fewer at the end of the file, the file size if the server gives it, and whether the bytes
+        are the whole file instead of the range
+    :rtype: tuple[bytes, Optional[int], bool]
+    """
+    response = pool.request(url, headers={"Range": f"bytes={start}-{end - 1}"})
+    match = CONTENT_RANGE.fullmatch(response.headers.get("content-range", ""))
+    size = int(match.group(1)) if match else None
+    if response.status == 416:
+        return b"", size, False
+    if response.status >= 400:
+        raise HTTPError(url, response.status, response.reason, None, None)
+    if response.status == 206:
+        return response.body, size, False
+    LOGGER.warning(f"{url} does not support byte range requests, the whole file was downloaded")
+    return response.body, len(response.body), True
+
+
+class RemoteFile:
+    """Read-only binary file over HTTP, read by byte range requests.
+
+    Each request reads ahead, so walking the box headers of the file takes few requests. When the server ignores
+    byte range requests, the whole file it sends is kept and every later read is served from memory.
+    """
+
+    def __init__(self, pool: ConnectionPool, url: str, read_ahead: int = READ_AHEAD) -> None:
+        """Open a remote file, without any request.
+
+        :param pool: keep-alive connections used for the requests
+        :type pool: ConnectionPool
+        :param url: file url
+        :type url: str
+        :param read_ahead: minimum number of bytes read by each request, defaults to READ_AHEAD
+        :type read_ahead: int, optional
+        :return: None
+        """
+        self.pool = pool
+        self.url = url
+        self.read_ahead = read_ahead
+        self.requests = 0
+        # Whole file, once the server ignored a byte range request
+        self.content: Optional[bytes] = None
+        self._size: Optional[int] = None
+        self._position = 0
+        self._buffer_start = 0
+        self._buffer = b""
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 2:
+            offset += self.size()
+        elif whence == 1:
+            offset += self._position
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._position
+
+    def size(self) -> int:
+        """Get the file size, given by the first response.
+
+        :return: the file size
+        :rtype: int
+        """
+        if self._size is None:
+            # The first request reads ahead from the current position, which is where the caller reads next
+            self._fetch(self._position, self._position + self.read_ahead)
+        return self._size
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size() if size < 0 else self._position + size
+        if self._size is not None:
+            end = min(end, self._size)
+        buffer_end = self._buffer_start + len(self._buffer)
+        if end > self._position and not self._buffer_start <= self._position <= end <= buffer_end:
+            self._fetch(self._position, max(end, self._position + self.read_ahead))
+        data = self._buffer[self._position - self._buffer_start : end - self._buffer_start]
+        self._position += len(data)
+        return data
+
+    def read_range(self, start: int, end: int) -> bytes:
+        """Download a byte range without moving the position, possibly in a download thread.
+
+        :param start: offset of the first byte
+        :type start: int
+        :param end: offset following the last byte
+        :type end: int
+        :return: the bytes, fewer at the end of the file
+        :rtype: bytes
+        """
+        if self.content is None:
+            data, _, whole = fetch_range(self.pool, self.url, start, end)
+            if not whole:
+                return data
+            self.content = data
+        return self.content[start:end]
+
+    def _fetch(self, start: int, end: int) -> None:
+        if self._size is not None:
+            end = min(end, self._size)
+        self.requests += 1
+        self._buffer, size, whole = fetch_range(self.pool, self.url, start, end)
+        self._buffer_start = start
+        if whole:
+            self.content = self._buffer
+            self._buffer_start = 0
+        if self._size is None:
+            self._size = size if size is not None else start + len(self._buffer)
+
+
+def read_index(file: RemoteFile, start: int = 0, stop: Optional[int] = None) -> list[Subsegment]:
+    """List the subsegments of a file from its sidx box.
+
+    The top-level boxes preceding the sidx box are skipped by reading their headers only. A reference to another
+    sidx box, as found in a hierarchical index, is replaced by the subsegments it indexes.
+
+    :param file: remote file
+    :type file: RemoteFile
+    :param start: offset of the first box to walk, such as the start of the SegmentBase index range, defaults to 0
+    :type start: int, optional
+    :param stop: offset of the end of the walked boxes, defaults to the end of the file
+    :type stop: int, optional
+    :raises ValueError: if the file has no sidx box before its first fragment
+    :return: the subsegments, in the file order
+    :rtype: list[Subsegment]
+    """
+    for box in iter_file_boxes(file, start, stop):
+        if box.name == "sidx":
+            break
+        if box.name in ("moof", "mdat"):
+            raise ValueError("The file has no sidx box before its first fragment, it cannot be read by byte ranges")
+    else:
+        raise ValueError("The file has no sidx box, it cannot be read by byte ranges")
+
+    file.seek(box.start)
+    sidx = decode_sidx(file.read(box.end - box.start))
+    subsegments = []
+    offset = box.end + sidx["first_offset"]
+    time = sidx["earliest_presentation_time"]
+    for reference in sidx["references"]:
+        if reference.reference_type == 1:
+            subsegments += read_index(file, offset, offset + reference.referenced_size)
+        else:
+            span = SegmentSpan(start=time, duration=reference.subsegment_duration, timescale=sidx["timescale"])
+            subsegments.append(Subsegment(offset=offset, size=reference.referenced_size, span=span))
+        offset += reference.referenced_size
+        time += reference.subsegment_duration
+    return subsegments
+
+
+def fetch_subsegment(file: RemoteFile, subsegment: Subsegment) -> bytes:
+    """Download a subsegment, possibly in a download thread.
+
+    :param file: remote file
+    :type file: RemoteFile
+    :param subsegment: subsegment to download
+    :type subsegment: Subsegment
+    :raises ValueError: if the file ends before the end of the subsegment
+    :return: the moof and mdat boxes of the subsegment
+    :rtype: bytes
+    """
+    data = file.read_range(subsegment.offset, subsegment.offset + subsegment.size)
+    if len(data) != subsegment.size:
+        raise ValueError(f"Truncated subsegment at offset {subsegment.offset}: {len(data)} of {subsegment.size} bytes")
+    return data
@@ -0,0 +1,192 @@
+"""Cache of the cues extracted from each segment of a dash folder.
+
+Author: Mikeprod
+"""
+
+import sqlite3
+import struct
+import threading
+from logging import getLogger
+from pathlib import Path
+from typing import Optional
+
+from src.vtt import Cue
+
+LOGGER = getLogger(__name__)
+CACHE_NAME = ".dashvtt-cache.sqlite"
+# To be increased whenever the cues extracted from a segment change, the previous entries are then dropped
+CACHE_VERSION = 2
+# Number of new entries between two commits of the cache
+COMMIT_INTERVAL = 500
+# Seconds waited for another connection to release the database, such as a batch job converting the same folder
+LOCK_TIMEOUT = 60.0
+CUE_HEADER = struct.Struct(">qqII")
+
+
+def pack_cues(cues: list[Cue]) -> bytes:
+    """Serialize cues in a compact binary form.
+
+    :param cues: cues to serialize
+    :type cues: list[Cue]
+    :return: the serialized cues
+    :rtype: bytes
+    """
+    parts = []
+    for cue in cues:
+        style, text = cue.style.encode("utf-8"), cue.text.encode("utf-8")
+        parts += (CUE_HEADER.pack(cue.start_ms, cue.end_ms, len(style), len(text)), style, text)
+    return b"".join(parts)
+
+
+def unpack_cues(data: bytes) -> list[Cue]:
+    """Deserialize cues serialized by pack_cues.
+
+    :param data: the serialized cues
+    :type data: bytes
+    :return: the cues
+    :rtype: list[Cue]
+    """
+    cues = []
+    cursor = 0
+    while cursor < len(data):
+        start_ms, end_ms, style_size, text_size = CUE_HEADER.unpack_from(data, cursor)
+        cursor += CUE_HEADER.size
+        style = data[cursor : cursor + style_size].decode("utf-8")
+        cursor += style_size
+        text = data[cursor : cursor + text_size].decode("utf-8")
+        cursor += text_size
+        cues.append(Cue(start_ms=start_ms, end_ms=end_ms, style=style, text=text))
+    return cues
+
+
+class ParseCache:
+    """Cues of each segment, stored in a sqlite database and keyed by the segment name, size and modification time.
+
+    Each thread using the cache has its own connection. New entries are kept in memory and written in a single short
+    transaction, so that a thread never holds the database locked while others wait for it.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Open the cache, creating it if needed.
+
+        :param path: sqlite database file
+        :type path: Path
+        :return: None
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: list[sqlite3.Connection] = []
+        # Entries not written yet, by segment name
+        self._pending: dict[str, tuple[int, int, bytes]] = {}
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS segments")
+            self._connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS segments "
+            "(name TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, cues BLOB NOT NULL)"
+        )
+
+    def __enter__(self) -> "ParseCache":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Closed by the thread calling close, which is not always the one that opened it
+            connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def get(self, path: Path) -> Optional[list[Cue]]:
+        """Get the cues of a segment, if it did not change since they were cached.
+
+        :param path: segment file
+        :type path: Path
+        :return: the cached cues, None if the segment is not cached or changed
+        :rtype: Optional[list[Cue]]
+        """
+        stat = path.stat()
+        with self._lock:
+            pending = self._pending.get(path.name)
+        if pending is not None:
+            row = (pending[2],) if pending[:2] == (stat.st_size, stat.st_mtime_ns) else None
+        else:
+            row = self._connection.execute(
+                "SELECT cues FROM segments WHERE name = ? AND size = ? AND mtime_ns = ?",
+                (path.name, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return unpack_cues(row[0])
+
+    def put(self, path: Path, cues: list[Cue]) -> None:
+        """Cache the cues of a segment.
+
+        :param path: segment file
+        :type path: Path
+        :param cues: cues extracted from the segment
+        :type cues: list[Cue]
+        :return: None
+        """
+        stat = path.stat()
+        with self._lock:
+            self._pending[path.name] = (stat.st_size, stat.st_mtime_ns, pack_cues(cues))
+            full = len(self._pending) >= COMMIT_INTERVAL
+        if full:
+            self.commit()
+
+    def commit(self) -> None:
+        """Write the new entries to the database."""
+        with self._lock:
+            rows = [(name, *entry) for name, entry in self._pending.items()]
+            self._pending = {}
+        if rows:
+            with self._connection as connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO segments (name, size, mtime_ns, cues) VALUES (?, ?, ?, ?)", rows
+                )
+
+    def stats(self) -> dict[str, int]:
+        """Get the cache statistics.
+
+        :return: number of hits and misses, and number of cached segments
+        :rtype: dict[str, int]
+        """
+        self.commit()
+        entries = self._connection.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self) -> None:
+        """Write the new entries and close the cache."""
+        self.commit()
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+def open_cache(folder: Path) -> Optional[ParseCache]:
+    """Open the parse cache of a dash folder.
+
+    :param folder: dash folder
+    :type folder: Path
+    :return: the cache, None if it cannot be opened, e.g. in a read-only folder
+    :rtype: Optional[ParseCache]
+    """
+    try:
+        return ParseCache(folder / CACHE_NAME)
+    except sqlite3.Error as error:
+        LOGGER.warning(f"The parse cache of {folder} cannot be used: {error}")
+        return None
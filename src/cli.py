@@ -1,26 +1,61 @@
+import cProfile
 import logging
 from logging import basicConfig
+from pathlib import Path
+from typing import Optional
 
 import click
 
+from src.batch import batch
 from src.download import download
+from src.follow import follow
+from src.inspection import inspect
 from src.create_vtt_subs import create_vtt
+from src.metrics import METRICS, write_report
+from src.pipeline import convert_url
 
 
 @click.group()
 @click.option("-v", is_flag=True, help="Verbose")
 @click.option("-vv", is_flag=True, help="Extra verbose")
-def commands(v: bool, vv: bool) -> None:
+@click.option(
+    "--profile", is_flag=True, help="Profile the run with cProfile and add the slowest functions to the metrics."
+)
+@click.option(
+    "--metrics", help="Write the per-stage timings and counters of the run to this JSON file.", metavar="FILE"
+)
+@click.pass_context
+def commands(ctx: click.Context, v: bool, vv: bool, profile: bool, metrics: Optional[str]) -> None:
     if v:
         basicConfig(level=logging.INFO)
     elif vv:
         basicConfig(level=logging.DEBUG)
+    if not profile and metrics is None:
+        return
+
+    METRICS.reset()
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    def report() -> None:
+        if profiler is not None:
+            profiler.disable()
+        content = write_report(ctx.invoked_subcommand, Path(metrics) if metrics else None, profiler)
+        if content is not None:
+            click.echo(content, err=True)
+
+    ctx.call_on_close(report)
 
 
 def main() -> None:
     """CLI entrypoint."""
     commands.add_command(download)
     commands.add_command(create_vtt)
+    commands.add_command(convert_url)
+    commands.add_command(batch)
+    commands.add_command(follow)
+    commands.add_command(inspect)
     commands()
 
 
@@ -4,62 +4,340 @@ Author: Mikeprod
 Usage: python src/create_vtt_subs.py -i "dash/folder" -o "subs/subtitle.vtt"
 """
 
+import os
 import warnings
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from logging import getLogger
 from pathlib import Path
+from typing import Optional, Sequence, Union
 
 import click
 
-from src.mp4 import Mp4
-from src.vtt import vtt_from_mp4
-from src.utils import order_alphabetically
-from src.vtt import VTT_HEADER, deduplicate_subtitles
+from src.cache import ParseCache, open_cache
+from src.metrics import METRICS, run_measured
+from src.mp4 import Mp4, read_sidx_span
+from src.pack import SegmentPack, read_packed_segment
+from src.utils import list_segments, parse_timestamp
+from src.vtt import Cue, clip_cues, cues_from_mp4, iter_cues
+from src.window import read_file_span, select_window
+from src.writers import WRITERS, SubtitleWriter, create_writer
 
 LOGGER = getLogger(__name__)
+# Below this number of segments, starting the worker processes costs more than it saves
+PARALLEL_MIN_SEGMENTS = 64
 
 
 @click.command()
 @click.option(
-    "--input", "-i", help="Input MP4 Dash folder. Defaults to 'dash' folder.", default="dash", metavar="FOLDER"
+    "--input",
+    "-i",
+    help="Input MP4 Dash folder, or a single fragmented MP4 file. Defaults to 'dash' folder.",
+    default="dash",
+    metavar="FOLDER",
 )
 @click.option(
     "--output",
     "-o",
-    prompt="Output name",
-    help="Output vtt file",
+    multiple=True,
+    help="Output file, repeated to write several files from a single parse. Prompted for if missing.",
     metavar="FILE",
 )
+@click.option(
+    "--format",
+    "-f",
+    "formats",
+    multiple=True,
+    type=click.Choice(list(WRITERS)),
+    help="Format of each output, in the order of the outputs. Defaults to the output extension, or vtt.",
+)
+@click.option("--jobs", "-j", help="Number of processes parsing the segments. Defaults to 1.", default=1, metavar="N")
+@click.option("--no-cache", is_flag=True, help="Parse every segment again instead of using the folder parse cache.")
+@click.option("--start", help="Start of the extracted window, as seconds or HH:MM:SS.mmm.", default=None)
+@click.option("--end", help="End of the extracted window, as seconds or HH:MM:SS.mmm.", default=None)
 @click.help_option("--help", "-h")
-def create_vtt(input: str, output: str):
+def create_vtt(
+    input: str,
+    output: tuple[str, ...],
+    formats: tuple[str, ...],
+    jobs: int,
+    no_cache: bool,
+    start: Optional[str],
+    end: Optional[str],
+):
+    if not output:
+        # A prompt cannot fill an option given several times, the single output name is asked for here
+        output = (click.prompt("Output name"),)
+    try:
+        outputs = pair_outputs(output, formats)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    input_path = Path(input)
+    window = None
+    if start is not None or end is not None:
+        try:
+            window = (parse_timestamp(start) if start else 0, parse_timestamp(end) if end else None)
+        except ValueError as error:
+            raise click.BadParameter(str(error))
+    names = ", ".join(str(path.absolute()) for _, path in outputs)
+    click.echo(f"Extracting {names} from the '{input_path.absolute()}' folder")
+    use_cache = not no_cache and input_path.is_dir() and not SegmentPack.exists(input_path)
+    cache = open_cache(input_path) if use_cache else None
+    if cache is None:
+        extract_vtt_from_dash(input_path, outputs, jobs=jobs, window=window)
+        return
+    with cache:
+        extract_vtt_from_dash(input_path, outputs, jobs=jobs, cache=cache, window=window)
+        stats = cache.stats()
+    click.echo(f"Parse cache: {stats['hits']} segments reused, {stats['misses']} parsed")
+
+
+def vtt_output_path(output: str) -> Path:
+    """Build the path of the output vtt file, adding the extension if missing.
+
+    :param output: output name given by the user
+    :type output: str
+    :return: path of the vtt file
+    :rtype: Path
+    """
     output_path = Path(output)
     if not output_path.suffix:
         output_path = Path(f"{output}.vtt")
     if output_path.suffix != ".vtt":
         warnings.warn("The extension is not vtt, the created file might not be properly read.")
+    return output_path
+
+
+def pair_outputs(outputs: Sequence[str], formats: Sequence[str]) -> list[tuple[str, Path]]:
+    """Pair the output files with their formats.
+
+    Without formats, the format of each file is given by its extension. A single output name given with several
+    formats is written in each of them, with the extension of the format.
+
+    :param outputs: output names given by the user
+    :type outputs: Sequence[str]
+    :param formats: formats given by the user, possibly none
+    :type formats: Sequence[str]
+    :raises ValueError: if the outputs and formats cannot be paired
+    :return: the format and path of each output
+    :rtype: list[tuple[str, Path]]
+    """
+    if not formats:
+        formats = [Path(output).suffix.lstrip(".").lower() or "vtt" for output in outputs]
+        unknown = [output for output, output_format in zip(outputs, formats) if output_format not in WRITERS]
+        if unknown:
+            raise ValueError(f"Unknown format of {', '.join(unknown)}, give it with --format")
+    elif len(outputs) == 1 and len(formats) > 1:
+        base = Path(outputs[0])
+        if base.suffix.lstrip(".").lower() in WRITERS:
+            base = base.with_suffix("")
+        outputs = [str(base.with_name(f"{base.name}.{output_format}")) for output_format in formats]
+    elif len(outputs) != len(formats):
+        raise ValueError(f"{len(outputs)} outputs given for {len(formats)} formats")
+    paired = []
+    for output, output_format in zip(outputs, formats):
+        path = Path(output)
+        if not path.suffix:
+            path = Path(f"{output}.{output_format}")
+        elif path.suffix.lstrip(".").lower() != output_format:
+            warnings.warn(f"The extension of {path} is not {output_format}, the file might not be properly read.")
+        paired.append((output_format, path))
+    return paired
+
+
+def convert_segment(path: Path) -> list[Cue]:
+    """Convert a single mp4 dash segment, possibly in a worker process.
+
+    :param path: The mp4 dash segment
+    :type path: Path
+    :return: The subtitle cues of the segment
+    :rtype: list[Cue]
+    """
+    LOGGER.info(path.name)
+    with METRICS.stage("read"):
+        data = path.read_bytes()
+    METRICS.count("read", bytes=len(data), segments=1)
+    return convert_segment_bytes(data)
 
-    input_path = Path(input)
-    click.echo(f"Extracting {output_path.absolute()} from the '{input_path.absolute()}' folder")
-    extract_vtt_from_dash(input_path, output_path)
 
+def convert_packed_segment(location: tuple[Path, int, int]) -> list[Cue]:
+    """Convert a segment of a pack in a worker process.
 
-def extract_vtt_from_dash(_input: Path, output: Path) -> None:
-    """Create a vtt file from a mp4 dash folder.
+    :param location: The data file, offset and size of the segment
+    :type location: tuple[Path, int, int]
+    :return: The subtitle cues of the segment
+    :rtype: list[Cue]
+    """
+    return convert_segment_bytes(read_packed_segment(location))
+
+
+def convert_segment_bytes(data: bytes) -> list[Cue]:
+    """Convert a mp4 dash segment already in memory, possibly in a worker process.
+
+    :param data: The content of the segment
+    :type data: bytes
+    :return: The subtitle cues of the segment
+    :rtype: list[Cue]
+    """
+    with METRICS.stage("parse"):
+        mp4 = Mp4.from_bytes(data)
+    with mp4, METRICS.stage("decode"):
+        cues = cues_from_mp4(mp4)
+    METRICS.count("decode", cues=len(cues))
+    return cues
 
-    :param _input: The mp4 dash folder.
+
+def extract_vtt_from_dash(
+    _input: Path,
+    output: Union[Path, Sequence[tuple[str, Path]]],
+    jobs: int = 1,
+    cache: Optional[ParseCache] = None,
+    executor: Optional[Executor] = None,
+    window: Optional[tuple[int, Optional[int]]] = None,
+) -> int:
+    """Create a vtt file, or several subtitle files, from a mp4 dash folder.
+
+    Each segment is parsed once, its cues being streamed to every output. The input can also be a single file made
+    of many fragments, which is then mapped in memory and parsed as a stream. A folder holding a segment pack is read
+    from the pack. With a time window, only the segments overlapping it are parsed, found from their sidx boxes, and
+    the cues are clipped to it.
+
+    :param _input: The mp4 dash folder, or a fragmented mp4 file.
     :type _input: Path
-    :param output: The output VTT file
-    :type output: Path
+    :param output: The output VTT file, or the format and path of each output
+    :type output: Union[Path, Sequence[tuple[str, Path]]]
+    :param jobs: Number of processes parsing the segments, folders of less than PARALLEL_MIN_SEGMENTS segments are
+        parsed in the current process, defaults to 1
+    :type jobs: int, optional
+    :param cache: Cues of the segments already parsed, only new or changed segments are parsed, defaults to None
+    :type cache: ParseCache, optional
+    :param executor: Running pool parsing the segments instead of new worker processes, shared with other
+        conversions, defaults to None
+    :type executor: Executor, optional
+    :param window: Start and end of the extracted window in milliseconds, the end being None for the end of the
+        stream, defaults to the whole stream
+    :type window: tuple[int, Optional[int]], optional
+    :return: The number of cues written
+    :rtype: int
+    """
+    outputs = [("vtt", output)] if isinstance(output, Path) else output
+    with create_writer(outputs) as writer:
+        if _input.is_file():
+            with METRICS.stage("stream", bytes=_input.stat().st_size, segments=1):
+                with Mp4(_input, load=False, use_mmap=True) as mp4:
+                    cues = iter_cues(mp4)
+                    writer.write_all(cues if window is None else clip_cues(cues, *window))
+        elif SegmentPack.exists(_input):
+            with SegmentPack(_input) as pack:
+                write_packed_segments(pack, writer, jobs, executor, window)
+        else:
+            write_folder_segments(_input, writer, jobs, cache, executor, window)
+    METRICS.count("write", cues_written=writer.cue_count)
+    return writer.cue_count
+
+
+def write_packed_segments(
+    pack: SegmentPack,
+    writer: SubtitleWriter,
+    jobs: int,
+    executor: Optional[Executor],
+    window: Optional[tuple[int, Optional[int]]] = None,
+) -> None:
+    """Write the cues of the segments of a pack, in the order of the pack index.
+
+    :param pack: The segment pack
+    :type pack: SegmentPack
+    :param writer: The output writer
+    :type writer: SubtitleWriter
+    :param jobs: Number of processes parsing the segments
+    :type jobs: int
+    :param executor: Running pool parsing the segments, defaults to new worker processes if jobs > 1
+    :type executor: Optional[Executor]
+    :param window: Start and end of the extracted window in milliseconds, defaults to the whole stream
+    :type window: tuple[int, Optional[int]], optional
     :return: None
     """
-    vtt_content = VTT_HEADER
-    for _, file in enumerate(order_alphabetically(map(lambda x: x.name, _input.iterdir()))):
-        LOGGER.info(file)
-        vtt_content += vtt_from_mp4(Mp4(_input / file, load=True))
+    entries = pack.ordered()
+    METRICS.count("list", segments=len(entries))
+    if window is not None:
+        with METRICS.stage("window"), pack.data_path.open("rb") as data:
+            entries = select_window(
+                entries, lambda entry: read_sidx_span(data, entry.offset, entry.offset + entry.size), *window
+            )
+        METRICS.count("window", segments=len(entries))
+    with ExitStack() as stack:
+        if executor is None and jobs > 1 and len(entries) >= PARALLEL_MIN_SEGMENTS:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+        if executor is not None:
+            locations = [(pack.data_path, entry.offset, entry.size) for entry in entries]
+            convert = partial(run_measured, convert_packed_segment, os.getpid())
+            parsed = executor.map(convert, locations, chunksize=max(1, len(entries) // (jobs * 16)))
+        else:
+            parsed = ((convert_segment_bytes(pack.read(entry)), {}) for entry in entries)
+
+        for entry in entries:
+            with METRICS.stage("convert", segments=1, bytes=entry.size):
+                segment_cues, stages = next(parsed)
+            METRICS.merge(stages)
+            with METRICS.stage("write", cues=len(segment_cues)):
+                writer.write_all(segment_cues if window is None else clip_cues(segment_cues, *window))
 
-    txt = deduplicate_subtitles(vtt_content)
 
-    with output.open("wb") as writer:
-        writer.write(txt.encode("utf-8"))
+def write_folder_segments(
+    folder: Path,
+    writer: SubtitleWriter,
+    jobs: int,
+    cache: Optional[ParseCache],
+    executor: Optional[Executor],
+    window: Optional[tuple[int, Optional[int]]] = None,
+) -> None:
+    """Write the cues of the segment files of a folder, in the order of their names.
+
+    :param folder: The mp4 dash folder
+    :type folder: Path
+    :param writer: The output writer
+    :type writer: SubtitleWriter
+    :param jobs: Number of processes parsing the segments
+    :type jobs: int
+    :param cache: Cues of the segments already parsed
+    :type cache: Optional[ParseCache]
+    :param executor: Running pool parsing the segments, defaults to new worker processes if jobs > 1
+    :type executor: Optional[Executor]
+    :param window: Start and end of the extracted window in milliseconds, defaults to the whole stream
+    :type window: tuple[int, Optional[int]], optional
+    :return: None
+    """
+    with METRICS.stage("list"):
+        paths = [folder / file for file in list_segments(folder)]
+    METRICS.count("list", segments=len(paths))
+    if window is not None:
+        with METRICS.stage("window"):
+            paths = select_window(paths, read_file_span, *window)
+        METRICS.count("window", segments=len(paths))
+    with METRICS.stage("cache"):
+        cached = [cache.get(path) for path in paths] if cache is not None else [None] * len(paths)
+    missing = [path for path, segment_cues in zip(paths, cached) if segment_cues is None]
+    with ExitStack() as stack:
+        if executor is None and jobs > 1 and len(missing) >= PARALLEL_MIN_SEGMENTS:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+        # The stages recorded by worker processes are returned with the cues
+        convert = partial(run_measured, convert_segment, os.getpid())
+        if executor is not None:
+            parsed = executor.map(convert, missing, chunksize=max(1, len(missing) // (jobs * 16)))
+        else:
+            parsed = map(convert, missing)
+
+        for path, segment_cues in zip(paths, cached):
+            if segment_cues is None:
+                with METRICS.stage("convert", segments=1):
+                    segment_cues, stages = next(parsed)
+                METRICS.merge(stages)
+                if cache is not None:
+                    with METRICS.stage("cache"):
+                        cache.put(path, segment_cues)
+            with METRICS.stage("write", cues=len(segment_cues)):
+                writer.write_all(segment_cues if window is None else clip_cues(segment_cues, *window))
 
 
 if __name__ == "__main__":
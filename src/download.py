@@ -1,21 +1,43 @@
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from logging import getLogger
 from pathlib import Path
-from urllib.error import URLError
-from urllib.request import urlopen
+from typing import Iterable, Optional
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
 
 import click
 
 from tqdm import tqdm
 
+from src.http_pool import ConnectionPool
+from src.manifest import SegmentManifest, checksum
+from src.metrics import METRICS
+from src.mpd import is_mpd, manifest_segments
+from src.pack import SegmentPack
+from src.utils import write_atomic
+
 LOGGER = getLogger(__name__)
 # Paste your dash stream url here
 STREAM = ""
+# Upper bound of the segment index search, kept from the former linear scan
+MAX_SEGMENT_INDEX = 1000000000
+# Number of downloaded segments between two saves of the manifest
+MANIFEST_SAVE_INTERVAL = 100
+# Retries of a segment download failing with a server error or a connection error
+DOWNLOAD_RETRIES = 3
+# Seconds waited before the first retry, doubled before each following one
+RETRY_BACKOFF = 0.5
 
 
 @click.command()
 @click.option(
-    "--url", "-u", prompt="Dash URL", help="URL of the first dash file. It should finish with -0.dash", metavar="URL"
+    "--url",
+    "-u",
+    prompt="Dash URL",
+    help="URL of the first dash file, ending with -0.dash, or URL or path of the MPD manifest.",
+    metavar="URL",
 )
 @click.option(
     "--output",
@@ -26,48 +48,286 @@ STREAM = ""
     default="dash",
 )
 @click.option("--step", help="Segment step for each Dash file? Defaults to 10000.", default=10000)
+@click.option("--workers", "-w", help="Number of segments downloaded in parallel. Defaults to 8.", default=8)
+@click.option("--lang", help="Language of the subtitle track of a MPD manifest, e.g. en.", default=None)
+@click.option("--track", help="Representation id of the subtitle track of a MPD manifest.", default=None)
+@click.option("--pack", is_flag=True, help="Append the segments to a single pack file instead of one file each.")
 @click.help_option("--help", "-h")
-def download(url: str, output: str, step: int):
+def download(url: str, output: str, step: int, workers: int, lang: Optional[str], track: Optional[str], pack: bool):
     global STREAM
     output_path = Path(output)
     click.echo(f"Downloading in {output_path.absolute()}")
-    download_dashed_vtt(url, output_path, step)
+    try:
+        download_dashed_vtt(url, output_path, step, workers=workers, language=lang, track_id=track, pack=pack)
+    except ValueError as error:
+        raise click.ClickException(str(error))
 
 
 def is_url_available(url: str) -> bool:
     """Check if the url is available.
 
+    A HEAD request is sent so that the segment body is never transferred. Origins that refuse HEAD are probed
+    again with a single byte range request.
+
     :param url: url to check
     :type url: str
     :return: True if the url is available, False otherwise
     :rtype: bool
     """
     try:
-        urlopen(url)
-        return True
+        with urlopen(Request(url, method="HEAD")):
+            return True
+    except HTTPError as error:
+        if error.code not in (405, 501):
+            return False
+    except URLError:
+        return False
+
+    try:
+        with urlopen(Request(url, headers={"Range": "bytes=0-0"})):
+            return True
     except URLError:
         return False
 
 
-def define_segment_range(url: str, segment_step: int) -> tuple[int, int]:
+def define_segment_range(url: str, segment_step: int, probe_cache: Optional[dict[str, bool]] = None) -> tuple[int, int]:
     """Define the range of the segments.
 
+    The segment count is found with a galloping search: the probed index doubles until a segment is missing, then
+    the last available segment is bisected between the last hit and the first miss. Only O(log n) urls are probed.
+
     :param url: url of the dash file
     :type url: str
     :param segment_step: step between each segment
     :type segment_step: int
+    :param probe_cache: cache of the probed urls and their availability, shared between calls, defaults to None
+    :type probe_cache: dict[str, bool], optional
     :return: tuple of the range of the segments
     :rtype: tuple
     """
-    for i in range(0, 1000000000, segment_step):
-        if not is_url_available(url.replace("-0.dash", f"-{i}.dash")):
-            return 0, i
+    cache = probe_cache if probe_cache is not None else {}
+
+    def is_segment_available(step_count: int) -> bool:
+        segment_url = url.replace("-0.dash", f"-{step_count * segment_step}.dash")
+        if segment_url not in cache:
+            cache[segment_url] = is_url_available(segment_url)
+        return cache[segment_url]
+
+    max_step_count = MAX_SEGMENT_INDEX // segment_step
+    if not is_segment_available(0):
+        return 0, 0
+
+    # Gallop until a missing segment is found, `low` is always available and `high` is always missing
+    low, high = 0, 1
+    while is_segment_available(high):
+        if high >= max_step_count:
+            return 0, max_step_count * segment_step
+        low, high = high, min(high * 2, max_step_count)
+
+    while high - low > 1:
+        middle = (low + high) // 2
+        if is_segment_available(middle):
+            low = middle
+        else:
+            high = middle
+    return 0, high * segment_step
+
+
+def get_with_retries(pool: ConnectionPool, url: str, retries: int, backoff: float) -> bytes:
+    """Download an url, retrying server errors and connection errors with an exponential backoff.
+
+    :param pool: keep-alive connections used for the requests
+    :type pool: ConnectionPool
+    :param url: url to download
+    :type url: str
+    :param retries: maximum number of retries
+    :type retries: int
+    :param backoff: seconds waited before the first retry, doubled before each following one
+    :type backoff: float
+    :raises HTTPError: if the server answers with a client error, or a server error after the last retry
+    :raises URLError: if the connection fails after the last retry
+    :return: the response body
+    :rtype: bytes
+    """
+    for attempt in range(retries + 1):
+        try:
+            return pool.get(url)
+        except HTTPError as error:
+            if error.code < 500 or attempt == retries:
+                raise
+            failure = error
+        except (URLError, OSError) as error:
+            if attempt == retries:
+                raise
+            failure = error
+        METRICS.count("download", retries=1)
+        LOGGER.debug(f"Retrying {url} after {failure}")
+        time.sleep(backoff * 2**attempt)
+
+
+def download_segments(
+    segments: Iterable[tuple[int, str]],
+    destination: Path,
+    workers: int = 8,
+    pool: Optional[ConnectionPool] = None,
+    manifest: Optional[SegmentManifest] = None,
+    pack: Optional[SegmentPack] = None,
+    retries: int = DOWNLOAD_RETRIES,
+    backoff: float = RETRY_BACKOFF,
+) -> None:
+    """Download segments in parallel, each one into a `{index:08d}.mp4` file or into a segment pack.
+
+    Files are written atomically. When a manifest is given, the segments it records as complete are skipped and
+    every newly downloaded segment is recorded in it. Segments already in the pack are skipped as well. A download
+    failing with a server error or a connection error is retried, the other errors abort the download.
+
+    :param segments: index and url of each segment
+    :type segments: Iterable[tuple[int, str]]
+    :param destination: directory to download the segments
+    :type destination: Path
+    :param workers: number of segments downloaded at the same time, defaults to 8
+    :type workers: int, optional
+    :param pool: keep-alive connections to reuse, a new pool is used if not given, defaults to None
+    :type pool: ConnectionPool, optional
+    :param manifest: manifest of the segments already downloaded in the destination, defaults to None
+    :type manifest: SegmentManifest, optional
+    :param pack: pack the segments are appended to instead of being written to files, defaults to None
+    :type pack: SegmentPack, optional
+    :param retries: number of retries of a failing segment download, defaults to DOWNLOAD_RETRIES
+    :type retries: int, optional
+    :param backoff: seconds waited before the first retry, doubled before each following one, defaults to
+        RETRY_BACKOFF
+    :type backoff: float, optional
+    :return: None
+    """
+    segments = list(segments)
+    if pack is not None:
+        pending = [(i, url) for i, url in segments if i not in pack.entries]
+        LOGGER.info(f"{len(segments) - len(pending)} segments already packed, {len(pending)} remaining")
+        segments = pending
+    if manifest is not None:
+        with METRICS.stage("manifest", segments=len(segments)):
+            pending = [(i, url) for i, url in segments if not manifest.is_complete(i, destination / f"{i:08d}.mp4")]
+        LOGGER.info(f"{len(segments) - len(pending)} segments already downloaded, {len(pending)} remaining")
+        segments = pending
+    connection_pool = pool or ConnectionPool()
+
+    def download_segment(index: int, segment_url: str) -> tuple[int, str, int, str]:
+        data = get_with_retries(connection_pool, segment_url, retries, backoff)
+        sha256 = checksum(data)
+        if pack is not None:
+            pack.append(index, data, bytes.fromhex(sha256))
+        else:
+            write_atomic(destination / f"{index:08d}.mp4", data)
+        return index, segment_url, len(data), sha256
+
+    try:
+        with METRICS.stage("download"), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(download_segment, index, segment_url) for index, segment_url in segments]
+            try:
+                for completed, future in enumerate(tqdm(as_completed(futures), total=len(futures)), start=1):
+                    index, segment_url, size, sha256 = future.result()
+                    METRICS.count("download", segments=1, bytes=size)
+                    if manifest is not None:
+                        manifest.record(index, segment_url, size, sha256)
+                        if completed % MANIFEST_SAVE_INTERVAL == 0:
+                            manifest.save()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        if manifest is not None:
+            manifest.save()
+        if pool is None:
+            connection_pool.close()
+
 
+def stream_url(url: str, segment_size: int = 1000) -> str:
+    """Set the segment size of the url of the first dash file.
 
-def download_dashed_vtt(url: str, destination: Path, segment_step: int = 10000, segment_size: int = 1000) -> None:
+    :param url: url of the first dash file, ending with -0.dash
+    :type url: str
+    :param segment_size: size of the segment, defaults to 1000
+    :type segment_size: int, optional
+    :return: the url of the first segment, for the given segment size
+    :rtype: str
+    """
+    return re.sub(r"qsm=\d+-", f"qsm={segment_size}-", url)
+
+
+def segment_urls(
+    url: str, segment_step: int = 10000, segment_size: int = 1000, probe_cache: Optional[dict[str, bool]] = None
+) -> list[tuple[int, str]]:
+    """List the index and url of every segment of the stream.
+
+    :param url: url of the first dash file, ending with -0.dash
+    :type url: str
+    :param segment_step: step between each segment, defaults to 10000
+    :type segment_step: int, optional
+    :param segment_size: size of the segment, defaults to 1000
+    :type segment_size: int, optional
+    :param probe_cache: cache of the probed urls and their availability, defaults to None
+    :type probe_cache: dict[str, bool], optional
+    :return: index and url of each segment
+    :rtype: list[tuple[int, str]]
+    """
+    segment_url = stream_url(url, segment_size)
+    segments = range(*define_segment_range(segment_url, segment_step, probe_cache), segment_step)
+    return [(i, segment_url.replace("-0.dash", f"-{i}.dash")) for i in segments]
+
+
+def stream_segments(
+    url: str,
+    segment_step: int = 10000,
+    segment_size: int = 1000,
+    probe_cache: Optional[dict[str, bool]] = None,
+    language: Optional[str] = None,
+    track_id: Optional[str] = None,
+) -> list[tuple[int, str]]:
+    """List the index and url of every segment of a stream, given by its first dash file or its MPD manifest.
+
+    The segments of a MPD manifest are computed from the manifest, without any probe request.
+
+    :param url: url of the first dash file, ending with -0.dash, or url or path of the MPD manifest
+    :type url: str
+    :param segment_step: step between each segment, defaults to 10000
+    :type segment_step: int, optional
+    :param segment_size: size of the segment, defaults to 1000
+    :type segment_size: int, optional
+    :param probe_cache: cache of the probed urls and their availability, defaults to None
+    :type probe_cache: dict[str, bool], optional
+    :param language: language of the subtitle track of a MPD manifest, defaults to None
+    :type language: str, optional
+    :param track_id: representation id of the subtitle track of a MPD manifest, defaults to None
+    :type track_id: str, optional
+    :raises ValueError: if the manifest has no matching subtitle track
+    :return: index and url of each segment
+    :rtype: list[tuple[int, str]]
+    """
+    if not is_mpd(url):
+        return segment_urls(url, segment_step, segment_size, probe_cache)
+    track, segments = manifest_segments(url, language, track_id)
+    LOGGER.info(f"Subtitle track {track.describe()}: {len(segments)} segments")
+    return segments
+
+
+def download_dashed_vtt(
+    url: str,
+    destination: Path,
+    segment_step: int = 10000,
+    segment_size: int = 1000,
+    workers: int = 8,
+    language: Optional[str] = None,
+    track_id: Optional[str] = None,
+    pack: bool = False,
+) -> None:
     """Download dash files that represent the vtt subtitles.
 
-    :param url: url of the dash file
+    The download resumes from the manifest, or the pack, of the destination folder: complete segments are not
+    downloaded again.
+
+    :param url: url of the dash file, or url or path of the MPD manifest
     :type url: str
     :param destination: directory to download the dash files
     :type destination: Path
@@ -75,18 +335,32 @@ def download_dashed_vtt(url: str, destination: Path, segment_step: int = 10000,
     :type segment_step: int, optional
     :param segment_size: size of the segment, defaults to 1000
     :type segment_size: int, optional
+    :param workers: number of segments downloaded at the same time, defaults to 8
+    :type workers: int, optional
+    :param language: language of the subtitle track of a MPD manifest, defaults to None
+    :type language: str, optional
+    :param track_id: representation id of the subtitle track of a MPD manifest, defaults to None
+    :type track_id: str, optional
+    :param pack: whether to append the segments to a single pack file of the destination, defaults to False
+    :type pack: bool, optional
     :return: None
     :rtype: None
     """
-    segment_url = re.sub(r"qsm=\d+-", f"qsm={segment_size}-", url)
     destination.mkdir(parents=True, exist_ok=True)
+    manifest = None if pack else SegmentManifest(destination)
+    probe_cache = {entry.url: True for entry in manifest.segments.values()} if manifest is not None else {}
 
     LOGGER.info(f"Downloading segments to {destination.absolute()}")
     LOGGER.info("After evaluating the number of segments, the download will start.")
-    for i in tqdm(range(*define_segment_range(segment_url, segment_step), segment_step)):
-        with urlopen(segment_url.replace("-0.dash", f"-{i}.dash")) as data:
-            with open(f"{destination}/{i:08d}.mp4", "wb") as writer:
-                writer.write(data.read())
+    known_urls = len(probe_cache)
+    with METRICS.stage("probe"):
+        segments = stream_segments(url, segment_step, segment_size, probe_cache, language, track_id)
+    METRICS.count("probe", requests=len(probe_cache) - known_urls, segments=len(segments))
+    if not pack:
+        download_segments(segments, destination, workers=workers, manifest=manifest)
+        return
+    with SegmentPack(destination, writable=True) as segment_pack:
+        download_segments(segments, destination, workers=workers, pack=segment_pack)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+"""Follow a live dash stream, or a dash folder being filled, and append the new cues to a vtt file.
+
+Author: Mikeprod
+Usage: python src/follow.py -u "https://.../qsm=1000-0.dash" -o "subs/subtitle.vtt"
+"""
+
+import json
+import time
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+from urllib.error import HTTPError, URLError
+
+import click
+
+from src.create_vtt_subs import convert_segment_bytes, vtt_output_path
+from src.download import stream_url
+from src.http_pool import ConnectionPool
+from src.utils import list_segments, segment_number, write_atomic
+from src.writers import AppendingVttWriter
+
+LOGGER = getLogger(__name__)
+# A poll yields the content of each new segment with the state to save once it is written
+Poll = Callable[[dict[str, Any]], Iterator[tuple[bytes, dict[str, Any]]]]
+
+
+@click.command()
+@click.option("--url", "-u", help="URL of the first dash file. It should finish with -0.dash", metavar="URL")
+@click.option("--input", "-i", help="Dash folder to watch instead of a stream url.", metavar="FOLDER")
+@click.option(
+    "--output", "-o", prompt="Output name", help="Output vtt file, new cues are appended to it", metavar="FILE"
+)
+@click.option("--step", help="Segment step for each Dash file? Defaults to 10000.", default=10000)
+@click.option("--interval", help="Seconds between two checks for new segments. Defaults to 2.", default=2.0)
+@click.option(
+    "--idle-timeout", help="Stop after this many seconds without a new segment. Defaults to never.", default=0.0
+)
+@click.help_option("--help", "-h")
+def follow(url: Optional[str], input: Optional[str], output: str, step: int, interval: float, idle_timeout: float):
+    if (url is None) == (input is None):
+        raise click.UsageError("Give either a stream url or a dash folder to follow.")
+    output_path = vtt_output_path(output)
+    click.echo(f"Appending the new cues of {url or Path(input).absolute()} to {output_path.absolute()}")
+    try:
+        if url is not None:
+            cues = follow_stream(url, output_path, step, interval=interval, idle_timeout=idle_timeout)
+        else:
+            cues = follow_folder(Path(input), output_path, interval=interval, idle_timeout=idle_timeout)
+    except KeyboardInterrupt:
+        click.echo("Stopped")
+        return
+    click.echo(f"No new segment for {idle_timeout}s, {cues} cues appended")
+
+
+def state_path(output: Path) -> Path:
+    """Get the file recording which segments were already appended to an output file.
+
+    :param output: output vtt file
+    :type output: Path
+    :return: hidden file next to the output
+    :rtype: Path
+    """
+    return output.with_name(f".{output.name}.follow.json")
+
+
+def follow_segments(source: str, poll: Poll, output: Path, interval: float = 2.0, idle_timeout: float = 0.0) -> int:
+    """Append the cues of the new segments to the output file until no segment comes for a while.
+
+    The progress given by the poll is recorded next to the output, so that following the same source again resumes
+    after the appended segments.
+
+    :param source: stream url or folder, a recorded state of another source is ignored
+    :type source: str
+    :param poll: function yielding the new segments
+    :type poll: Poll
+    :param output: output vtt file
+    :type output: Path
+    :param interval: seconds between two polls, defaults to 2.0
+    :type interval: float, optional
+    :param idle_timeout: seconds without a new segment before stopping, 0 to never stop, defaults to 0.0
+    :type idle_timeout: float, optional
+    :return: the number of cues appended
+    :rtype: int
+    """
+    state = {"source": source}
+    if state_path(output).is_file() and output.is_file():
+        saved = json.loads(state_path(output).read_text("utf-8"))
+        if saved.get("source") == source:
+            state = saved
+
+    with AppendingVttWriter(output) as writer:
+        last_segment_time = time.monotonic()
+        while True:
+            for data, update in poll(state):
+                writer.write_all(convert_segment_bytes(data))
+                writer.flush()
+                state.update(update)
+                write_atomic(state_path(output), json.dumps(state).encode("utf-8"))
+                last_segment_time = time.monotonic()
+            if idle_timeout and time.monotonic() - last_segment_time >= idle_timeout:
+                return writer.cue_count
+            time.sleep(interval)
+
+
+def follow_stream(
+    url: str,
+    output: Path,
+    segment_step: int = 10000,
+    segment_size: int = 1000,
+    interval: float = 2.0,
+    idle_timeout: float = 0.0,
+) -> int:
+    """Append the cues of the segments of a live stream as they are published.
+
+    Each poll requests the next segment index until it is not published yet, so only the new segments are
+    downloaded.
+
+    :param url: url of the first dash file, ending with -0.dash
+    :type url: str
+    :param output: output vtt file
+    :type output: Path
+    :param segment_step: step between each segment, defaults to 10000
+    :type segment_step: int, optional
+    :param segment_size: size of the segment, defaults to 1000
+    :type segment_size: int, optional
+    :param interval: seconds between two polls, defaults to 2.0
+    :type interval: float, optional
+    :param idle_timeout: seconds without a new segment before stopping, 0 to never stop, defaults to 0.0
+    :type idle_timeout: float, optional
+    :return: the number of cues appended
+    :rtype: int
+    """
+    first_url = stream_url(url, segment_size)
+
+    with ConnectionPool() as pool:
+
+        def poll(state: dict[str, Any]) -> Iterator[tuple[bytes, dict[str, Any]]]:
+            index = state.get("next_index", 0)
+            while True:
+                try:
+                    data = pool.get(first_url.replace("-0.dash", f"-{index}.dash"))
+                except HTTPError as error:
+                    if error.code != 404:
+                        LOGGER.warning(f"Segment {index} is not available yet: {error}")
+                    return
+                except (URLError, OSError) as error:
+                    LOGGER.warning(f"Segment {index} is not available yet: {error}")
+                    return
+                index += segment_step
+                yield data, {"next_index": index}
+
+        return follow_segments(first_url, poll, output, interval, idle_timeout)
+
+
+def follow_folder(folder: Path, output: Path, interval: float = 2.0, idle_timeout: float = 0.0) -> int:
+    """Append the cues of the segments written in a dash folder, such as one being downloaded.
+
+    Segments downloaded in parallel land out of order, so the appended segments are recorded by name: a segment
+    written after a later one is still appended, once it lands.
+
+    :param folder: dash folder
+    :type folder: Path
+    :param output: output vtt file
+    :type output: Path
+    :param interval: seconds between two polls, defaults to 2.0
+    :type interval: float, optional
+    :param idle_timeout: seconds without a new segment before stopping, 0 to never stop, defaults to 0.0
+    :type idle_timeout: float, optional
+    :return: the number of cues appended
+    :rtype: int
+    """
+
+    def poll(state: dict[str, Any]) -> Iterator[tuple[bytes, dict[str, Any]]]:
+        appended = state.get("appended", [])
+        known = set(appended)
+        # States saved before the appended names were recorded only hold the last appended segment
+        last_segment = state.get("last_segment")
+        for name in list_segments(folder):
+            if name in known or (last_segment is not None and segment_number(name) <= last_segment):
+                continue
+            known.add(name)
+            appended.append(name)
+            yield (folder / name).read_bytes(), {"appended": appended}
+
+    return follow_segments(str(folder.absolute()), poll, output, interval, idle_timeout)
+
+
+if __name__ == "__main__":
+    follow()
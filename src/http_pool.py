@@ -0,0 +1,141 @@
+"""Persistent HTTP connections shared by the download threads.
+
+Author: Mikeprod
+"""
+
+import threading
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from typing import NamedTuple, Optional
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class Response(NamedTuple):
+    """Fully read HTTP response."""
+
+    status: int
+    reason: str
+    headers: dict[str, str]
+    body: bytes
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections, one per host and per thread.
+
+    Connections are reused between requests so that each segment does not pay a new TCP and TLS handshake.
+    """
+
+    def __init__(self, timeout: float = 30.0) -> None:
+        """Create a connection pool.
+
+        :param timeout: socket timeout in seconds, defaults to 30.0
+        :type timeout: float, optional
+        :return: None
+        """
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened: set[HTTPConnection] = set()
+        # Incremented by close, so that the threads drop the connections it closed
+        self._generation = 0
+
+    def __enter__(self) -> "ConnectionPool":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _connections(self) -> dict[tuple[str, str], HTTPConnection]:
+        if getattr(self._local, "generation", None) != self._generation:
+            self._local.connections = {}
+            self._local.generation = self._generation
+        return self._local.connections
+
+    def _connection(self, scheme: str, host: str) -> HTTPConnection:
+        connections = self._connections()
+        if (scheme, host) not in connections:
+            connection_class = HTTPSConnection if scheme == "https" else HTTPConnection
+            connections[scheme, host] = connection_class(host, timeout=self.timeout)
+            with self._lock:
+                self._opened.add(connections[scheme, host])
+        return connections[scheme, host]
+
+    def _discard(self, scheme: str, host: str) -> None:
+        connection = self._connections().pop((scheme, host), None)
+        if connection is not None:
+            with self._lock:
+                self._opened.discard(connection)
+            connection.close()
+
+    def _send(self, method: str, url: str, headers: dict[str, str]) -> Response:
+        parts = urlsplit(url)
+        path = f"{parts.path or '/'}?{parts.query}" if parts.query else parts.path or "/"
+        # A kept-alive connection may have been closed by the server in the meantime, it is retried once
+        for attempt in range(2):
+            connection = self._connection(parts.scheme, parts.netloc)
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (HTTPException, OSError):
+                self._discard(parts.scheme, parts.netloc)
+                if attempt:
+                    raise
+                continue
+            if response.will_close:
+                self._discard(parts.scheme, parts.netloc)
+            return Response(
+                status=response.status,
+                reason=response.reason,
+                headers={key.lower(): value for key, value in response.getheaders()},
+                body=body,
+            )
+
+    def request(
+        self, url: str, method: str = "GET", headers: Optional[dict[str, str]] = None, max_redirects: int = 5
+    ) -> Response:
+        """Send a request and read the whole response, following redirections.
+
+        :param url: requested url
+        :type url: str
+        :param method: HTTP method, defaults to "GET"
+        :type method: str, optional
+        :param headers: request headers, defaults to None
+        :type headers: dict[str, str], optional
+        :param max_redirects: maximum number of redirections followed, defaults to 5
+        :type max_redirects: int, optional
+        :return: the response
+        :rtype: Response
+        """
+        for _ in range(max_redirects + 1):
+            response = self._send(method, url, headers or {})
+            if response.status not in REDIRECT_STATUSES or "location" not in response.headers:
+                return response
+            url = urljoin(url, response.headers["location"])
+        raise HTTPError(url, response.status, "Too many redirections", None, None)
+
+    def get(self, url: str, headers: Optional[dict[str, str]] = None) -> bytes:
+        """Download the content of an url.
+
+        :param url: url to download
+        :type url: str
+        :param headers: request headers, defaults to None
+        :type headers: dict[str, str], optional
+        :raises HTTPError: if the server answers with an error status
+        :return: the response body
+        :rtype: bytes
+        """
+        response = self.request(url, headers=headers)
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, None, None)
+        return response.body
+
+    def close(self) -> None:
+        """Close every connection opened by the pool, the pool can still be used afterwards."""
+        with self._lock:
+            for connection in self._opened:
+                connection.close()
+            self._opened.clear()
+            self._generation += 1
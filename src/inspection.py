@@ -0,0 +1,225 @@
+"""Check the timeline of a dash folder from the segment headers, without reading the samples.
+
+Author: Mikeprod
+Usage: python src/inspection.py dash/folder
+"""
+
+import json
+from pathlib import Path
+from typing import IO, Any, NamedTuple, Optional
+
+import click
+
+from src.mp4 import DEFAULT_TIMESCALE, iter_file_boxes, read_headers
+from src.pack import SegmentPack
+from src.utils import format_timestamp, list_segments, to_milliseconds
+
+# Number of issues of each kind listed in the text report
+MAX_LISTED_ISSUES = 20
+
+
+class SegmentReport(NamedTuple):
+    """Timing and numbering of a segment, read from its headers."""
+
+    name: str
+    start_ms: int
+    end_ms: int
+    fragments: int
+    samples: int
+    sequence_numbers: list[int]
+
+
+@click.command()
+@click.argument("folder", type=click.Path(exists=True))
+@click.option("--json", "as_json", is_flag=True, help="Print the full report as JSON.")
+@click.help_option("--help", "-h")
+def inspect(folder: str, as_json: bool):
+    report = inspect_folder(Path(folder))
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    click.echo(render_report(report))
+
+
+def inspect_segment(name: str, file: IO[bytes], start: int = 0, stop: Optional[int] = None) -> SegmentReport:
+    """Read the timing and numbering of a segment from its sidx and moof boxes.
+
+    :param name: segment name
+    :type name: str
+    :param file: file holding the segment, opened in binary mode
+    :type file: IO[bytes]
+    :param start: offset of the segment in the file, defaults to 0
+    :type start: int, optional
+    :param stop: offset of the end of the segment, defaults to the end of the file
+    :type stop: int, optional
+    :raises ValueError: if the segment boxes are inconsistent
+    :return: the segment report
+    :rtype: SegmentReport
+    """
+    headers = read_headers(file, start, stop)
+    trafs = [traf for moof in headers.moofs for traf in moof["trafs"]]
+    samples = sum(traf["trun"]["samples_count"] for traf in trafs)
+    sequence_numbers = [moof["mfhd"]["sequence_number"] for moof in headers.moofs]
+    if headers.sidx is not None:
+        start_ms, end_ms = headers.sidx.start_ms, headers.sidx.end_ms
+    elif trafs:
+        decode_time = trafs[0]["tfdt"]["base_media_decode_time"]
+        duration = sum(sum(traf["trun"]["sample_durations"]) for traf in trafs)
+        start_ms = to_milliseconds(decode_time, DEFAULT_TIMESCALE)
+        end_ms = to_milliseconds(decode_time + duration, DEFAULT_TIMESCALE)
+    else:
+        raise ValueError("No sidx nor moof box")
+    return SegmentReport(name, start_ms, end_ms, len(headers.moofs), samples, sequence_numbers)
+
+
+def split_segments(file: IO[bytes]) -> list[tuple[int, int]]:
+    """Locate the segments concatenated in a single fragmented file, reading only the box headers.
+
+    A segment starts at a styp box, or at a sidx box following the fragments or the sidx box of the previous one.
+
+    :param file: fragmented file, opened in binary mode
+    :type file: IO[bytes]
+    :raises ValueError: if a box size is inconsistent
+    :return: the start and end offsets of each segment
+    :rtype: list[tuple[int, int]]
+    """
+    starts = []
+    current: set[str] = set()
+    end = 0
+    for box in iter_file_boxes(file):
+        if not starts or box.name == "styp" or (box.name == "sidx" and current & {"sidx", "moof"}):
+            starts.append(box.offset)
+            current = set()
+        current.add(box.name)
+        end = box.end
+    return list(zip(starts, starts[1:] + [end]))
+
+
+def inspect_folder(folder: Path) -> dict[str, Any]:
+    """Check the segments of a dash folder, or a single fragmented file, for timeline and numbering issues.
+
+    Only the box headers, the sidx and the moof boxes are read. The segments concatenated in a single file are
+    checked one by one, and the segments of a pack are checked against their recorded digest.
+
+    :param folder: dash folder, possibly holding a segment pack, or fragmented mp4 file
+    :type folder: Path
+    :return: the segment reports, totals, gaps, overlaps, sequence discontinuities and unreadable segments
+    :rtype: dict[str, Any]
+    """
+    segments: list[SegmentReport] = []
+    errors = []
+    if folder.is_file():
+        with folder.open("rb") as f:
+            try:
+                spans = split_segments(f)
+            except ValueError as error:
+                # A truncated file cannot be split, its segments are not located
+                spans = []
+                errors.append({"segment": folder.name, "error": str(error)})
+            for position, (start, stop) in enumerate(spans):
+                name = folder.name if len(spans) == 1 else f"{folder.name}#{position}"
+                try:
+                    segments.append(inspect_segment(name, f, start, stop))
+                except ValueError as error:
+                    errors.append({"segment": name, "error": str(error)})
+    elif SegmentPack.exists(folder):
+        with SegmentPack(folder) as pack, pack.data_path.open("rb") as data:
+            for entry in pack.ordered():
+                try:
+                    pack.verify(entry)
+                    segments.append(inspect_segment(str(entry.index), data, entry.offset, entry.offset + entry.size))
+                except ValueError as error:
+                    errors.append({"segment": str(entry.index), "error": str(error)})
+    else:
+        for name in list_segments(folder):
+            try:
+                with (folder / name).open("rb") as f:
+                    segments.append(inspect_segment(name, f))
+            except ValueError as error:
+                errors.append({"segment": name, "error": str(error)})
+
+    gaps, overlaps, discontinuities = [], [], []
+    previous = None
+    for segment in segments:
+        numbers = segment.sequence_numbers
+        for before, after in zip(numbers, numbers[1:]):
+            if after != before + 1:
+                discontinuities.append({"segment": segment.name, "previous": segment.name, "from": before, "to": after})
+        if previous is not None:
+            if segment.start_ms > previous.end_ms:
+                gaps.append(
+                    {"segment": segment.name, "previous": previous.name, "ms": segment.start_ms - previous.end_ms}
+                )
+            elif segment.start_ms < previous.end_ms:
+                overlaps.append(
+                    {"segment": segment.name, "previous": previous.name, "ms": previous.end_ms - segment.start_ms}
+                )
+            if previous.sequence_numbers and numbers and numbers[0] != previous.sequence_numbers[-1] + 1:
+                discontinuities.append(
+                    {
+                        "segment": segment.name,
+                        "previous": previous.name,
+                        "from": previous.sequence_numbers[-1],
+                        "to": numbers[0],
+                    }
+                )
+        previous = segment
+
+    durations = [segment.end_ms - segment.start_ms for segment in segments]
+    return {
+        "segments": len(segments),
+        "fragments": sum(segment.fragments for segment in segments),
+        "samples": sum(segment.samples for segment in segments),
+        "start_ms": segments[0].start_ms if segments else None,
+        "end_ms": segments[-1].end_ms if segments else None,
+        "covered_ms": sum(durations),
+        "segment_duration_ms": {
+            "min": min(durations, default=None),
+            "mean": sum(durations) / len(durations) if durations else None,
+            "max": max(durations, default=None),
+        },
+        "gaps": gaps,
+        "overlaps": overlaps,
+        "sequence_discontinuities": discontinuities,
+        "errors": errors,
+        "details": [segment._asdict() for segment in segments],
+    }
+
+
+def render_report(report: dict[str, Any]) -> str:
+    """Render an inspection report as text.
+
+    :param report: report built by inspect_folder
+    :type report: dict[str, Any]
+    :return: the text report, listing at most MAX_LISTED_ISSUES issues of each kind
+    :rtype: str
+    """
+    lines = [f"Segments: {report['segments']}, fragments: {report['fragments']}, samples: {report['samples']}"]
+    if report["segments"]:
+        durations = report["segment_duration_ms"]
+        lines += [
+            f"Timeline: {format_timestamp(report['start_ms'])} --> {format_timestamp(report['end_ms'])}, "
+            f"{format_timestamp(report['covered_ms'])} covered",
+            f"Segment durations: min {durations['min'] / 1000:.3f}s, mean {durations['mean'] / 1000:.3f}s, "
+            f"max {durations['max'] / 1000:.3f}s",
+        ]
+    for key, title, describe in (
+        ("gaps", "Gaps", lambda issue: f"{issue['ms']} ms missing before {issue['segment']}"),
+        ("overlaps", "Overlaps", lambda issue: f"{issue['segment']} overlaps {issue['previous']} by {issue['ms']} ms"),
+        (
+            "sequence_discontinuities",
+            "Sequence discontinuities",
+            lambda issue: f"{issue['segment']}: fragment {issue['from']} followed by {issue['to']}",
+        ),
+        ("errors", "Unreadable segments", lambda issue: f"{issue['segment']}: {issue['error']}"),
+    ):
+        issues = report[key]
+        lines.append(f"{title}: {len(issues)}")
+        lines += [f"  {describe(issue)}" for issue in issues[:MAX_LISTED_ISSUES]]
+        if len(issues) > MAX_LISTED_ISSUES:
+            lines.append(f"  ... and {len(issues) - MAX_LISTED_ISSUES} more")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    inspect()
@@ -0,0 +1,89 @@
+"""Sidecar manifest of the segments downloaded in a folder.
+
+Author: Mikeprod
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import NamedTuple
+
+from src.utils import write_atomic
+
+MANIFEST_NAME = ".dashvtt-manifest.json"
+MANIFEST_VERSION = 1
+
+
+class SegmentEntry(NamedTuple):
+    """Downloaded segment as recorded in the manifest."""
+
+    url: str
+    size: int
+    sha256: str
+
+
+def checksum(data: bytes) -> str:
+    """Compute the checksum stored in the manifest.
+
+    :param data: segment content
+    :type data: bytes
+    :return: hexadecimal sha256 digest
+    :rtype: str
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class SegmentManifest:
+    """Index, size and checksum of every segment completely written in a folder."""
+
+    def __init__(self, folder: Path) -> None:
+        """Create a manifest, loading the existing one from the folder if any.
+
+        :param folder: folder holding the segments and the manifest
+        :type folder: Path
+        :return: None
+        """
+        self.path = folder / MANIFEST_NAME
+        self.segments: dict[int, SegmentEntry] = {}
+        if self.path.is_file():
+            content = json.loads(self.path.read_text("utf-8"))
+            if content.get("version") == MANIFEST_VERSION:
+                self.segments = {int(index): SegmentEntry(**entry) for index, entry in content["segments"].items()}
+
+    def is_complete(self, index: int, path: Path) -> bool:
+        """Check that a segment file is recorded and that its content matches the recorded size and checksum.
+
+        :param index: segment index
+        :type index: int
+        :param path: segment file
+        :type path: Path
+        :return: True if the segment does not need to be downloaded again
+        :rtype: bool
+        """
+        entry = self.segments.get(index)
+        if entry is None or not path.is_file() or path.stat().st_size != entry.size:
+            return False
+        return checksum(path.read_bytes()) == entry.sha256
+
+    def record(self, index: int, url: str, size: int, sha256: str) -> None:
+        """Record a completely written segment.
+
+        :param index: segment index
+        :type index: int
+        :param url: url the segment was downloaded from
+        :type url: str
+        :param size: size of the segment in bytes
+        :type size: int
+        :param sha256: checksum of the segment
+        :type sha256: str
+        :return: None
+        """
+        self.segments[index] = SegmentEntry(url=url, size=size, sha256=sha256)
+
+    def save(self) -> None:
+        """Write the manifest atomically next to the segments."""
+        content = {
+            "version": MANIFEST_VERSION,
+            "segments": {str(index): entry._asdict() for index, entry in sorted(self.segments.items())},
+        }
+        write_atomic(self.path, json.dumps(content, indent=1).encode("utf-8"))
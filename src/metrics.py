@@ -0,0 +1,175 @@
+"""Per-stage wall time and counters of a run, reported as JSON.
+
+Author: Mikeprod
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+# Counters of each stage, by stage name
+Stages = dict[str, dict[str, float]]
+
+# Number of functions listed in the profile section of the report
+PROFILE_TOP = 30
+
+
+class Metrics:
+    """Wall time and counters, such as bytes, segments or cues, of each stage of a run.
+
+    Stages can be recorded from several threads. Worker processes record their own stages, which are returned with
+    their results and merged in the parent process, see `run_measured`.
+    """
+
+    def __init__(self) -> None:
+        """Create empty metrics.
+
+        :return: None
+        """
+        self.started = time.perf_counter()
+        self.stages: Stages = {}
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        """Drop the recorded stages and restart the run clock."""
+        with self._lock:
+            self.started = time.perf_counter()
+            self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str, **counters: int) -> Iterator[None]:
+        """Add the wall time of a block, and optional counters, to a stage.
+
+        :param name: stage name
+        :type name: str
+        :param counters: values added to the stage counters
+        :return: None
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(name, seconds=time.perf_counter() - start, calls=1, **counters)
+
+    def count(self, name: str, **counters: float) -> None:
+        """Add values to the counters of a stage.
+
+        :param name: stage name
+        :type name: str
+        :param counters: values added to the stage counters
+        :return: None
+        """
+        with self._lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            for counter, value in counters.items():
+                stage[counter] = stage.get(counter, 0) + value
+
+    def merge(self, stages: Stages) -> None:
+        """Add the stages recorded by another process.
+
+        :param stages: counters of each stage
+        :type stages: Stages
+        :return: None
+        """
+        for name, counters in stages.items():
+            self.count(name, **counters)
+
+    def report(self) -> dict[str, Any]:
+        """Build the report of the run, with the throughput of each counter of the stages.
+
+        :return: total wall time and, for each stage, its wall time, counters and throughput per second
+        :rtype: dict[str, Any]
+        """
+        with self._lock:
+            recorded = {name: dict(counters) for name, counters in self.stages.items()}
+        stages = {}
+        for name, counters in recorded.items():
+            stage = dict(counters)
+            seconds = counters["seconds"]
+            for counter, value in counters.items():
+                if counter not in ("seconds", "calls") and seconds > 0:
+                    stage[f"{counter}_per_second"] = value / seconds
+            stages[name] = stage
+        return {"wall_seconds": time.perf_counter() - self.started, "stages": stages}
+
+
+# Metrics of the current run
+METRICS = Metrics()
+
+
+def run_measured(function: Callable[[T], R], parent: int, argument: T) -> tuple[R, Stages]:
+    """Call a function, possibly in a worker process, and return the stages it recorded.
+
+    Called in the parent process, such as by a thread pool, the stages are recorded directly and none is returned.
+    Bound with `functools.partial`, it can be mapped by any executor.
+
+    :param function: function recording its stages in METRICS
+    :type function: Callable[[T], R]
+    :param parent: id of the process merging the stages
+    :type parent: int
+    :param argument: argument of the function
+    :type argument: T
+    :return: the function result, and the stages to merge in the parent process
+    :rtype: tuple[R, Stages]
+    """
+    if os.getpid() == parent:
+        return function(argument), {}
+    METRICS.reset()
+    result = function(argument)
+    return result, METRICS.stages
+
+
+def profile_report(profile: cProfile.Profile, top: int = PROFILE_TOP) -> list[dict[str, Any]]:
+    """Summarize a profile as the functions of highest cumulative time.
+
+    :param profile: profile of the run
+    :type profile: cProfile.Profile
+    :param top: number of functions reported, defaults to PROFILE_TOP
+    :type top: int, optional
+    :return: location, call count, own time and cumulative time of each function
+    :rtype: list[dict[str, Any]]
+    """
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [
+        {
+            "function": f"{path}:{line}({function})",
+            "calls": calls,
+            "own_seconds": own_time,
+            "cumulative_seconds": cumulative_time,
+        }
+        for (path, line, function), (_, calls, own_time, cumulative_time, _) in rows
+    ]
+
+
+def write_report(
+    command: Optional[str], path: Optional[Path], profile: Optional[cProfile.Profile] = None
+) -> Optional[str]:
+    """Write the report of the current run.
+
+    :param command: name of the command that was run
+    :type command: Optional[str]
+    :param path: JSON file receiving the report, the report is returned instead if None
+    :type path: Optional[Path]
+    :param profile: profile of the run, added to the report if given, defaults to None
+    :type profile: cProfile.Profile, optional
+    :return: the JSON report if it is not written to a file
+    :rtype: Optional[str]
+    """
+    report = {"command": command, **METRICS.report()}
+    if profile is not None:
+        report["profile"] = profile_report(profile)
+    content = json.dumps(report, indent=2)
+    if path is None:
+        return content
+    path.write_text(content, "utf-8")
+    return None
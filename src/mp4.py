@@ -1,251 +1,597 @@
 """Abstraction of the MP4 file format.
 
+The file content is parsed in place through a memoryview: boxes are only offsets over the file content, which is
+read once, or mapped in memory with `use_mmap`.
+
 Author: Mikeprod
 """
 
+import mmap
+import struct
+import sys
+from array import array
 from pathlib import Path
-from typing import Any, NamedTuple
-
-from src.utils import get_int
-
-
-class Block(NamedTuple):
-    """Block of data in an mp4 file."""
+from typing import IO, Any, Iterator, NamedTuple, Optional, Union
+
+BOX_HEADER = struct.Struct(">I4s")
+U64 = struct.Struct(">Q")
+U32 = struct.Struct(">I")
+U16 = struct.Struct(">H")
+I32 = struct.Struct(">i")
+# Reference of a sidx box: type and referenced size, subsegment duration, SAP fields
+SIDX_REFERENCE = struct.Struct(">III")
+# Optional fields of the tfhd box, in their order: flag, name, struct format
+TFHD_FIELDS = (
+    (0x000001, "base_data_offset", "Q"),
+    (0x000002, "sample_description_index", "I"),
+    (0x000008, "default_sample_duration", "I"),
+    (0x000010, "default_sample_size", "I"),
+    (0x000020, "default_sample_flags", "I"),
+)
+# Optional per sample fields of the trun box, in their order: flag, column name, array type code
+TRUN_SAMPLE_FIELDS = (
+    (0x000100, "sample_durations", "I"),
+    (0x000200, "sample_sizes", "I"),
+    (0x000400, "sample_flags", "I"),
+    (0x000800, "sample_composition_offsets", "I"),
+)
+# Timescale of the streams whose segments do not carry a sidx box
+DEFAULT_TIMESCALE = 1000
+
+
+class Box(NamedTuple):
+    """Box of an ISO base media file, located by its offsets in the file content."""
 
     name: str
-    content: bytes
-    size: int
-    next_block_size: int
-    cursor: int
-
-
-def read_4(content: bytes, cursor: int) -> bytes:
-    """Read 4 bytes from the content at the cursor position."""
-    return content[cursor : cursor + 4]
-
-
-def int_4(content: bytes, cursor: int) -> int:
-    """Read 4 bytes from the content at the cursor position and return the integer value."""
-    return get_int(read_4(content, cursor))
+    offset: int
+    start: int
+    end: int
+
+    @property
+    def size(self) -> int:
+        """Size of the box, header included."""
+        return self.end - self.offset
+
+
+class Fragment(NamedTuple):
+    """Movie fragment: a moof box and the mdat box holding its samples."""
+
+    moof: dict[str, Any]
+    mdat: dict[str, Any]
+    start_time: int
+    timescale: int
+
+
+class SegmentSpan(NamedTuple):
+    """Presentation interval of a segment, as given by its sidx box."""
+
+    start: int
+    duration: int
+    timescale: int
+
+    @property
+    def start_ms(self) -> int:
+        return self.start * 1000 // self.timescale
+
+    @property
+    def end_ms(self) -> int:
+        return (self.start + self.duration) * 1000 // self.timescale
+
+
+class SidxReference(NamedTuple):
+    """Reference of a sidx box to a subsegment, or to another sidx box."""
+
+    reference_type: int
+    referenced_size: int
+    subsegment_duration: int
+    starts_with_sap: bool
+    sap_type: int
+    sap_delta_time: int
+
+
+def decode_sidx(payload: Union[bytes, memoryview]) -> dict[str, Any]:
+    """Decode a sidx box and its reference table.
+
+    :param payload: content of the sidx box, following its header
+    :type payload: Union[bytes, memoryview]
+    :raises ValueError: if the box is shorter than its reference table
+    :return: version, flags, reference id, timescale, earliest presentation time, offset of the first referenced byte
+        after the box, and the references
+    :rtype: dict[str, Any]
+    """
+    version = payload[0]
+    reference_id, timescale = struct.unpack_from(">II", payload, 4)
+    if version == 0:
+        earliest_presentation_time, first_offset = struct.unpack_from(">II", payload, 12)
+        cursor = 20
+    else:
+        earliest_presentation_time, first_offset = struct.unpack_from(">QQ", payload, 12)
+        cursor = 28
+    reference_count = U16.unpack_from(payload, cursor + 2)[0]
+    cursor += 4
+    if len(payload) < cursor + SIDX_REFERENCE.size * reference_count:
+        raise ValueError(f"Truncated sidx box of {reference_count} references")
+    references = [
+        SidxReference(
+            reference_type=size >> 31,
+            referenced_size=size & 0x7FFFFFFF,
+            subsegment_duration=duration,
+            starts_with_sap=bool(sap >> 31),
+            sap_type=(sap >> 28) & 0x7,
+            sap_delta_time=sap & 0x0FFFFFFF,
+        )
+        for size, duration, sap in SIDX_REFERENCE.iter_unpack(
+            payload[cursor : cursor + SIDX_REFERENCE.size * reference_count]
+        )
+    ]
+    return {
+        "version": version,
+        "flags": int.from_bytes(payload[1:4], "big"),
+        "reference_id": reference_id,
+        "timescale": timescale,
+        "earliest_presentation_time": earliest_presentation_time,
+        "first_offset": first_offset,
+        "reference_count": reference_count,
+        "references": references,
+    }
+
+
+def sidx_span(payload: Union[bytes, memoryview]) -> SegmentSpan:
+    """Decode the presentation interval covered by a sidx box.
+
+    :param payload: content of the sidx box, following its header
+    :type payload: Union[bytes, memoryview]
+    :return: earliest presentation time, sum of the subsegment durations, and timescale
+    :rtype: SegmentSpan
+    """
+    sidx = decode_sidx(payload)
+    return SegmentSpan(
+        start=sidx["earliest_presentation_time"],
+        duration=sum(reference.subsegment_duration for reference in sidx["references"]),
+        timescale=sidx["timescale"],
+    )
+
+
+def decode_box_header(header: Union[bytes, memoryview], position: int, offset: int, stop: int) -> Box:
+    """Decode the header of a box, shared by the iterations over content in memory and over files.
+
+    Both the 64-bit box size (size == 1) and the box extending to the end of its parent (size == 0) are supported.
+
+    :param header: bytes holding the header
+    :type header: Union[bytes, memoryview]
+    :param position: position of the header in these bytes
+    :type position: int
+    :param offset: offset of the box in its file or content
+    :type offset: int
+    :param stop: offset of the end of the parent box, or of the file
+    :type stop: int
+    :raises ValueError: if the header is truncated or the box size is inconsistent
+    :return: the box, located by its offsets
+    :rtype: Box
+    """
+    available = min(len(header) - position, stop - offset)
+    if available < BOX_HEADER.size:
+        raise ValueError(f"Truncated box header at offset {offset}")
+    size, name = BOX_HEADER.unpack_from(header, position)
+    header_size = BOX_HEADER.size
+    if size == 1:
+        if available < header_size + U64.size:
+            raise ValueError(f"Truncated box header at offset {offset}")
+        size = U64.unpack_from(header, position + header_size)[0]
+        header_size += U64.size
+    elif size == 0:
+        size = stop - offset
+    if size < header_size or offset + size > stop:
+        raise ValueError(f"Invalid size {size} of the {name!r} box at offset {offset}")
+    return Box(name=name.decode("latin-1"), offset=offset, start=offset + header_size, end=offset + size)
+
+
+def iter_file_boxes(file: IO[bytes], start: int = 0, stop: Optional[int] = None) -> Iterator[Box]:
+    """Iterate over the consecutive boxes of a file, reading only their headers.
+
+    :param file: file holding the boxes, opened in binary mode
+    :type file: IO[bytes]
+    :param start: offset of the first box, defaults to 0
+    :type start: int, optional
+    :param stop: offset of the end of the last box, defaults to the end of the file
+    :type stop: int, optional
+    :raises ValueError: if a box size is inconsistent, e.g. for a truncated file
+    :return: the boxes, located by their offsets in the file
+    :rtype: Iterator[Box]
+    """
+    stop = file.seek(0, 2) if stop is None else stop
+    offset = start
+    while offset < stop:
+        file.seek(offset)
+        box = decode_box_header(file.read(min(BOX_HEADER.size + U64.size, stop - offset)), 0, offset, stop)
+        yield box
+        offset = box.end
+
+
+def read_sidx_span(file: IO[bytes], start: int = 0, stop: Optional[int] = None) -> Optional[SegmentSpan]:
+    """Read the presentation interval of a segment from its sidx box, without reading its fragments.
+
+    Only the headers of the top-level boxes preceding the sidx box are read.
+
+    :param file: file holding the segment, opened in binary mode
+    :type file: IO[bytes]
+    :param start: offset of the segment in the file, defaults to 0
+    :type start: int, optional
+    :param stop: offset of the end of the segment, defaults to the end of the file
+    :type stop: int, optional
+    :raises ValueError: if a box size is inconsistent
+    :return: the interval, None if the segment has no sidx box before its first fragment
+    :rtype: Optional[SegmentSpan]
+    """
+    for box in iter_file_boxes(file, start, stop):
+        if box.name == "sidx":
+            file.seek(box.start)
+            return sidx_span(file.read(box.end - box.start))
+        if box.name in ("moof", "mdat"):
+            return None
+    return None
+
+
+class SegmentHeaders(NamedTuple):
+    """Metadata of a segment, read without its samples."""
+
+    boxes: list[Box]
+    sidx: Optional[SegmentSpan]
+    moofs: list[dict[str, Any]]
+
+
+def read_headers(file: IO[bytes], start: int = 0, stop: Optional[int] = None) -> SegmentHeaders:
+    """Read the metadata of a segment: the headers of its top-level boxes, its sidx box and its moof boxes.
+
+    The file is read by seeking from box to box, the mdat payloads are never read.
+
+    :param file: file holding the segment, opened in binary mode
+    :type file: IO[bytes]
+    :param start: offset of the segment in the file, defaults to 0
+    :type start: int, optional
+    :param stop: offset of the end of the segment, defaults to the end of the file
+    :type stop: int, optional
+    :raises ValueError: if a box size is inconsistent, or a sidx or moof box is malformed
+    :return: the top-level boxes, the sidx interval, from the first sidx box over the summed durations of every
+        sidx box, and the parsed moof boxes
+    :rtype: SegmentHeaders
+    """
+    boxes = list(iter_file_boxes(file, start, stop))
+    sidx = None
+    moofs = []
+    for box in boxes:
+        if box.name not in ("sidx", "moof"):
+            continue
+        file.seek(box.offset)
+        chunk = file.read(box.size)
+        try:
+            if box.name == "sidx":
+                span = sidx_span(memoryview(chunk)[box.start - box.offset :])
+                if sidx is None:
+                    sidx = span
+                else:
+                    # A later sidx box extends the interval of the first one, in the timescale of the first one
+                    sidx = sidx._replace(duration=sidx.duration + span.duration * sidx.timescale // span.timescale)
+            else:
+                parser = Mp4.from_bytes(chunk, analyse=False)
+                moof = parser.moof_content(box._replace(offset=0, start=box.start - box.offset, end=box.size))
+                moof["offset"] = box.offset - start
+                moofs.append(moof)
+        except (struct.error, KeyError, IndexError, StopIteration, ZeroDivisionError) as error:
+            # A damaged child box is read out of its bounds, or misses a mandatory box
+            raise ValueError(f"Malformed {box.name} box at offset {box.offset}: {error!r}") from error
+    return SegmentHeaders(boxes=boxes, sidx=sidx, moofs=moofs)
+
+
+def iter_boxes(content: memoryview, start: int = 0, stop: Optional[int] = None) -> Iterator[Box]:
+    """Iterate over the consecutive boxes of the content.
+
+    Both the 64-bit box size (size == 1) and the box extending to the end of its parent (size == 0) are supported.
+
+    :param content: content holding the boxes
+    :type content: memoryview
+    :param start: offset of the first box, defaults to 0
+    :type start: int, optional
+    :param stop: offset of the end of the last box, defaults to the end of the content
+    :type stop: int, optional
+    :raises ValueError: if a box size is inconsistent, e.g. for a truncated file
+    :return: the boxes, in the content order
+    :rtype: Iterator[Box]
+    """
+    stop = len(content) if stop is None else stop
+    while start < stop:
+        box = decode_box_header(content, start, start, stop)
+        yield box
+        start = box.end
 
 
 class Mp4:
     """MP4 file class."""
 
-    def __init__(self, path: Path, load: bool) -> None:
+    def __init__(self, path: Path, load: bool, use_mmap: bool = False) -> None:
         """Create an Mp4 object.
 
         :param path: path to the mp4 file
         :type path: Path
-        :param load:  whether to load the file content in memory at creation
+        :param load:  whether to load the file content in memory at creation and parse every fragment
         :type load: bool
+        :param use_mmap: whether to map the file in memory instead of reading it, defaults to False
+        :type use_mmap: bool, optional
         :return: None
         """
         if not path.is_file():
             raise FileNotFoundError(f"File {path} not found")
         self.path = path.absolute()
-        self.content = None
-        self._blocks_for_analysis = {}
+        self.use_mmap = use_mmap
+        self.content: Optional[memoryview] = None
+        self._buffer: Union[bytes, mmap.mmap, None] = None
+        self.blocks = {}
+        self.fragments: Optional[list[Fragment]] = None
+        self.span: Optional[SegmentSpan] = None
         if load:
             self._analyse_blocks()
 
+    @classmethod
+    def from_bytes(cls, content: bytes, analyse: bool = True, span: Optional[SegmentSpan] = None) -> "Mp4":
+        """Create an Mp4 object from content already in memory, such as a downloaded segment.
+
+        :param content: content of the mp4 file
+        :type content: bytes
+        :param analyse: whether to parse every fragment at creation, defaults to True
+        :type analyse: bool, optional
+        :param span: presentation interval of a subsegment without sidx box, as given by the sidx box indexing it
+            in its file, defaults to the decode time of the fragments
+        :type span: SegmentSpan, optional
+        :return: the Mp4 object
+        :rtype: Mp4
+        """
+        mp4 = cls.__new__(cls)
+        mp4.path = None
+        mp4.use_mmap = False
+        mp4._buffer = content
+        mp4.content = memoryview(content)
+        mp4.blocks = {}
+        mp4.fragments = None
+        mp4.span = span
+        if analyse:
+            mp4._analyse_blocks()
+        return mp4
+
+    def __enter__(self) -> "Mp4":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.release()
+
     def load(self) -> None:
         """Load the file content in memory."""
         with self.path.open("rb") as f:
-            self.content = f.read()
+            if self.use_mmap and self.path.stat().st_size:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = f.read()
+        self.content = memoryview(self._buffer)
+
+    def release(self) -> None:
+        """Drop the file content and the parsed boxes, once the subtitles have been extracted."""
+        self.blocks = {}
+        self.fragments = None
+        if self.content is not None:
+            self.content.release()
+            self.content = None
+        if isinstance(self._buffer, mmap.mmap):
+            try:
+                self._buffer.close()
+            except BufferError:
+                # Views over the mapping are still referenced by the caller, it is closed when they are collected
+                pass
+        self._buffer = None
 
     def _analyse_blocks(self) -> None:
-        self.blocks = self.read_blocks()
-        self.blocks["sidx"] = self.sidx_content()
-        if "styp" in self.blocks:
-            self.blocks["moof"] = self.moof_content()
-            self.blocks["mdat"] = self.mdat_content()
-
-    def read_blocks(self, start: int = 0, stop: int = 0) -> dict[str, Any]:
-        """Read the file content and return a list of blocks.
-
-        :param start: start cursor position, defaults to 0
-        :type start: int, optional
-        :param stop: stop cursor position, defaults to 0
-        :type stop: int, optional
-        :return: dictionary of blocks
-        :rtype: dict[str, Block]
+        self.fragments = list(self._parse_fragments())
+        for box in self.boxes():
+            self.blocks.setdefault(box.name, self.content[box.start : box.end])
+        if self.fragments:
+            self.blocks["moof"] = self.fragments[0].moof
+            self.blocks["mdat"] = self.fragments[0].mdat
+        sidx = next(self.boxes("sidx"), None)
+        if sidx is not None:
+            self.blocks["sidx"] = self.sidx_content(sidx)
+
+    def boxes(self, name: Optional[str] = None, parent: Optional[Box] = None) -> Iterator[Box]:
+        """Iterate over the top level boxes of the file, or over the children of a box.
+
+        :param name: only yield the boxes with this name, defaults to None
+        :type name: str, optional
+        :param parent: box whose children are iterated, defaults to None
+        :type parent: Box, optional
+        :return: the boxes, in the file order
+        :rtype: Iterator[Box]
         """
-        if not self.content:
+        if self.content is None:
             self.load()
-            stop = len(self.content)
-
-        blocks = {}
-        while start < stop:
-            block = self._read_block(start)
-            blocks[block.name] = block.content
-            self._blocks_for_analysis[block.name] = block
-            start = block.cursor
-        return blocks
-
-    def _read_block(self, cursor: int = 0) -> Block:
-        """Read a block from the file content.
-
-        :param cursor: cursor position, defaults to 0
-        :type cursor: int, optional
-        :return: block
-        :rtype: Block
-        """
-        until_next_block = int_4(self.content, cursor)
-        cursor += 4
-        block_size = until_next_block - 4
-        content_size = block_size - 4
-        block_name = read_4(self.content, cursor).decode("utf-8")
-        cursor += 4
-        block_content = self.content[cursor : cursor + content_size]
-        cursor += content_size
-        next_block_size = int_4(self.content, cursor) if read_4(self.content, cursor) != b"" else 0
-        return Block(
-            name=block_name, content=block_content, size=block_size, next_block_size=next_block_size, cursor=cursor
-        )
+        boxes = iter_boxes(self.content) if parent is None else iter_boxes(self.content, parent.start, parent.end)
+        return boxes if name is None else (box for box in boxes if box.name == name)
 
-    def sidx_content(self) -> dict[str, int]:
-        """Parse the sidx block and return its content.
+    def iter_fragments(self) -> Iterator[Fragment]:
+        """Iterate over the fragments of the file.
 
-        :return: Dictionary of the sidx block content
+        The fragments parsed at creation are reused, otherwise the file is parsed lazily in a single pass, so that a
+        large concatenated file can be processed as a stream.
+
+        :return: the fragments, in the file order
+        :rtype: Iterator[Fragment]
         """
-        block = self._blocks_for_analysis["sidx"]
-        cursor = 0
-        t0 = get_int(block.content[cursor : cursor + 4])  # or something else not reported ?
-        cursor += 4
-        ref_id = get_int(block.content[cursor : cursor + 4])
-        cursor += 4
-        timescale = get_int(block.content[cursor : cursor + 4])
-        cursor += 4
-        time_in_stream = get_int(block.content[cursor : cursor + 4])
-        cursor += 4
-        t1 = get_int(block.content[cursor : cursor + 4])
-        cursor += 4
-        earliest_presentation_time = get_int(block.content[cursor : cursor + 4])
-        cursor += 4
-        first_offset = get_int(block.content[cursor : cursor + 4])
-        cursor += 4
-        reserved = get_int(block.content[cursor : cursor + 2])
-        cursor += 2
-        reference_count = get_int(block.content[cursor : cursor + 2])
-        return {
-            "t0": t0,
-            "ref_id": ref_id,
-            "timescale": timescale,
-            "time_in_stream": time_in_stream,
-            "t1": t1,
-            "earliest_presentation_time": earliest_presentation_time,
-            "first_offset": first_offset,
-            "reserved": reserved,
-            "reference_count": reference_count,
-            "content": block.content,
-        }
+        if self.fragments is not None:
+            return iter(self.fragments)
+        return self._parse_fragments()
+
+    def _parse_fragments(self) -> Iterator[Fragment]:
+        # The first fragment following a sidx box starts at its presentation time, the next ones follow each other.
+        # Without sidx box, the interval given for a subsegment or the decode time of the fragment is used.
+        start_time = None if self.span is None else self.span.start
+        timescale = DEFAULT_TIMESCALE if self.span is None else self.span.timescale
+        moof = None
+        for box in self.boxes():
+            if box.name == "sidx":
+                sidx = self.sidx_content(box)
+                start_time, timescale = sidx["earliest_presentation_time"], sidx["timescale"]
+            elif box.name == "moof":
+                moof = self.moof_content(box)
+            elif box.name == "mdat" and moof is not None:
+                trun = moof["traf"]["trun"]
+                if start_time is None:
+                    start_time = moof["traf"]["tfdt"]["base_media_decode_time"]
+                yield Fragment(moof=moof, mdat=self.mdat_content(box, moof), start_time=start_time, timescale=timescale)
+                start_time += sum(trun["sample_durations"])
+                moof = None
+
+    def sidx_content(self, box: Box) -> dict[str, Any]:
+        """Parse the sidx box and return its content.
+
+        :param box: the sidx box
+        :type box: Box
+        :return: Dictionary of the sidx box content, with its reference table
+        """
+        content = self.content[box.start : box.end]
+        return {**decode_sidx(content), "content": content}
 
-    def moof_content(self) -> dict[str, Any]:
-        """Parse the moof block and return its content.
+    def moof_content(self, box: Box) -> dict[str, Any]:
+        """Parse the moof box and return its content.
 
-        :return: Dictionary of the moof block content
+        :param box: the moof box
+        :type box: Box
+        :return: Dictionary of the moof box content
         """
-        block = self._blocks_for_analysis["moof"]
-        cursor = block.cursor - block.size + 4
-        self.read_blocks(cursor, block.cursor)
-        return {"mfhd": self.mfhd_content(), "traf": self.traf_content(), "content": block.content}
+        trafs = [self.traf_content(traf) for traf in self.boxes("traf", box)]
+        return {
+            "mfhd": self.mfhd_content(next(self.boxes("mfhd", box))),
+            "traf": trafs[0],
+            "trafs": trafs,
+            "offset": box.offset,
+            "content": self.content[box.start : box.end],
+        }
 
-    def mfhd_content(self) -> dict[str, int]:
-        """Parse the mfhd block and return its content.
+    def mfhd_content(self, box: Box) -> dict[str, int]:
+        """Parse the mfhd box and return its content.
 
-        :return: Dictionary of the mfhd block content
+        :param box: the mfhd box
+        :type box: Box
+        :return: Dictionary of the mfhd box content
         """
-        mfhd_block = self._blocks_for_analysis["mfhd"]
-        return {"sequence_number": get_int(mfhd_block.content), "content": mfhd_block.content}
+        content = self.content[box.start : box.end]
+        return {"sequence_number": U32.unpack_from(content, 4)[0], "content": content}
 
-    def traf_content(self) -> dict[str, int]:
-        """Parse the traf block and return its content.
+    def traf_content(self, box: Box) -> dict[str, Any]:
+        """Parse the traf box and return its content.
 
-        :return: Dictionary of the traf block content
+        :param box: the traf box
+        :type box: Box
+        :return: Dictionary of the traf box content
         """
-        block = self._blocks_for_analysis["traf"]
-        cursor = block.cursor - block.size + 4
-        self.read_blocks(cursor, block.cursor)
+        children = {}
+        for child in self.boxes(parent=box):
+            children.setdefault(child.name, child)
+        tfhd = self.tfhd_content(children["tfhd"])
         return {
-            "tfhd": self.tfhd_content(),
-            "tfdt": self.tfdt_content(),
-            "trun": self.trun_content(),
-            "content": block.content,
+            "tfhd": tfhd,
+            "tfdt": self.tfdt_content(children["tfdt"]) if "tfdt" in children else {"base_media_decode_time": 0},
+            "trun": self.trun_content(children["trun"], tfhd),
+            "content": self.content[box.start : box.end],
         }
 
-    def tfhd_content(self) -> dict[str, int]:
-        """Parse the tfhd block and return its content.
+    def tfhd_content(self, box: Box) -> dict[str, int]:
+        """Parse the tfhd box and return its content.
 
-        :return: Dictionary of the tfhd block content
+        :param box: the tfhd box
+        :type box: Box
+        :return: Dictionary of the tfhd box content, the optional fields are only present when set
         """
-        tfhd_block = self._blocks_for_analysis["tfhd"]
-        output = {
-            "data_source": get_int(tfhd_block.content[0:2]),
-            "length": get_int(tfhd_block.content[2:4]),
-            "track_id": get_int(tfhd_block.content[4:8]),
-            "sample_number": get_int(tfhd_block.content[8:12]),
-            "content": tfhd_block.content,
-        }
-        if tfhd_block.size - 4 > 12:
-            if tfhd_block.size - 4 >= 14:
-                output["bytes_per_compression"] = (get_int(tfhd_block.content[12:14]),)
-
-            if tfhd_block.size - 4 >= 16:
-                output["samples_per_compression"] = get_int(tfhd_block.content[14:16])
+        content = self.content[box.start : box.end]
+        version_flags, track_id = struct.unpack_from(">2I", content)
+        flags = version_flags & 0xFFFFFF
+        output = {"version": version_flags >> 24, "flags": flags, "track_id": track_id, "content": content}
+        cursor = 8
+        for flag, name, field_format in TFHD_FIELDS:
+            if flags & flag:
+                output[name] = struct.unpack_from(f">{field_format}", content, cursor)[0]
+                cursor += struct.calcsize(field_format)
         return output
 
-    def tfdt_content(self) -> dict[str, int]:
-        """Parse the tfdt block and return its content.
+    def tfdt_content(self, box: Box) -> dict[str, int]:
+        """Parse the tfdt box and return its content.
 
-        :return: Dictionary of the tfdt block content
+        :param box: the tfdt box
+        :type box: Box
+        :return: Dictionary of the tfdt box content
         """
-        tfdt_block = self._blocks_for_analysis["tfdt"]
-        version = get_int(tfdt_block.content[:1])
-        base_media_decode_time = get_int(tfdt_block.content[1:])
-        return {"version": version, "base_media_decode_time": base_media_decode_time, "content": tfdt_block.content}
-
-    def trun_content(self) -> dict[str, int]:
-        """Parse the trun block and return its content.
-
-        :return: Dictionary of the trun block content
+        content = self.content[box.start : box.end]
+        version = content[0]
+        base_media_decode_time = (U64 if version == 1 else U32).unpack_from(content, 4)[0]
+        return {"version": version, "base_media_decode_time": base_media_decode_time, "content": content}
+
+    def trun_content(self, box: Box, tfhd: Optional[dict[str, int]] = None) -> dict[str, Any]:
+        """Parse the trun box and return its content.
+
+        The per sample fields announced by the box flags are decoded in bulk, as one array per field. The durations
+        and sizes absent from the box are filled with the defaults of the tfhd box.
+
+        :param box: the trun box
+        :type box: Box
+        :param tfhd: content of the tfhd box of the same traf box, defaults to None
+        :type tfhd: dict[str, int], optional
+        :return: Dictionary of the trun box content
         """
-        trun_block = self._blocks_for_analysis["trun"]
-        flags = trun_block.content[:4]  # to be discovered later
-        cursor = 4
-        samples_count = get_int(trun_block.content[cursor : cursor + 4])
-        cursor += 4
-        data_offset = get_int(trun_block.content[cursor : cursor + 4])
-        cursor += 4
-        samples = []
-        for _ in range((len(trun_block.content) - cursor) // 8):
-            samples.append(
-                {
-                    "sample_duration": get_int(trun_block.content[cursor : cursor + 4]),
-                    "sample_flag": trun_block.content[cursor + 4 : cursor + 8],
-                }
-            )
-            cursor += 8
-        return {
-            "flags": flags,
-            "samples": samples,
-            "samples_count": samples_count,
-            "data_offset": data_offset,
-            "content": trun_block.content,
-        }
+        tfhd = tfhd or {}
+        content = self.content[box.start : box.end]
+        version_flags, samples_count = struct.unpack_from(">2I", content)
+        flags = version_flags & 0xFFFFFF
+        output = {"version": version_flags >> 24, "flags": flags, "samples_count": samples_count, "content": content}
+        cursor = 8
+        if flags & 0x000001:
+            output["data_offset"] = I32.unpack_from(content, cursor)[0]
+            cursor += 4
+        if flags & 0x000004:
+            output["first_sample_flags"] = U32.unpack_from(content, cursor)[0]
+            cursor += 4
+
+        fields = [name for flag, name, _ in TRUN_SAMPLE_FIELDS if flags & flag]
+        values = array("I")
+        values.frombytes(content[cursor : cursor + 4 * len(fields) * samples_count])
+        if sys.byteorder == "little":
+            values.byteswap()
+        for position, name in enumerate(fields):
+            output[name] = values[position :: len(fields)]
+        if output["version"] == 1 and "sample_composition_offsets" in output:
+            output["sample_composition_offsets"] = array("i", output["sample_composition_offsets"].tobytes())
+
+        if "sample_durations" not in output:
+            output["sample_durations"] = array("I", [tfhd.get("default_sample_duration", 0)]) * samples_count
+        if "sample_sizes" not in output:
+            output["sample_sizes"] = array("I", [tfhd.get("default_sample_size", 0)]) * samples_count
+        return output
+
+    def mdat_content(self, box: Box, moof: dict[str, Any]) -> dict[str, Any]:
+        """Parse the mdat box and return its content.
 
-    def mdat_content(self):
-        """Parse the mdat block and return its content.
+        The samples are addressed directly: the first one starts at the trun data offset, relative to the moof box
+        unless the tfhd box sets a base data offset, and each one is as long as its size in the trun box.
 
-        :return: Dictionary of the mdat block content
+        :param box: the mdat box
+        :type box: Box
+        :param moof: content of the moof box describing the samples of the mdat box
+        :type moof: dict[str, Any]
+        :raises ValueError: if a sample is out of the mdat box
+        :return: Dictionary of the mdat box content, samples_content holds a view over each sample
         """
-        block = self._blocks_for_analysis["mdat"]
-        samples = self.blocks["moof"]["traf"]["trun"]["samples"]
-        cursor = 0
+        tfhd, trun = moof["traf"]["tfhd"], moof["traf"]["trun"]
+        base_data_offset = tfhd.get("base_data_offset", moof["offset"])
+        cursor = base_data_offset + trun["data_offset"] if "data_offset" in trun else box.start
         samples_content = []
-        for sample in samples:
-            content_start = block.content.index(sample["sample_flag"], cursor) + 4
-            cursor = content_start + get_int(sample["sample_flag"]) - 4
-            samples_content.append(block.content[content_start:cursor])
+        for sample_size in trun["sample_sizes"]:
+            if cursor < box.start or cursor + sample_size > box.end:
+                raise ValueError(f"Sample of {sample_size} bytes at offset {cursor} is out of the mdat box")
+            samples_content.append(self.content[cursor : cursor + sample_size])
+            cursor += sample_size
 
-        return {"content": block.content, "samples_content": samples_content}
+        return {"content": self.content[box.start : box.end], "samples_content": samples_content}
@@ -0,0 +1,309 @@
+"""Enumerate the subtitle segments of a dash stream from its MPD manifest.
+
+Author: Mikeprod
+"""
+
+import math
+import re
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+from urllib.parse import urljoin, urlparse
+from urllib.request import urlopen
+from xml.etree import ElementTree
+
+NAMESPACE = "{urn:mpeg:dash:schema:mpd:2011}"
+TEMPLATE_IDENTIFIER = re.compile(r"\$(RepresentationID|Number|Time|Bandwidth)(%0(\d+)d)?\$|\$\$")
+ISO_DURATION = re.compile(
+    r"P(?:(?P<days>[\d.]+)D)?(?:T(?:(?P<hours>[\d.]+)H)?(?:(?P<minutes>[\d.]+)M)?(?:(?P<seconds>[\d.]+)S)?)?"
+)
+
+
+class Track(NamedTuple):
+    """Subtitle representation of a manifest, with the url of each of its segments in the stream order.
+
+    A track described by SegmentBase is a single file, whose sidx box is located by the index range: its start and
+    end offsets, the end being excluded.
+    """
+
+    id: str
+    language: str
+    codecs: str
+    mime_type: str
+    segments: list[str]
+    index_range: Optional[tuple[int, int]] = None
+
+    def describe(self) -> str:
+        return f"{self.id} ({self.language or 'unknown language'}, {self.codecs or self.mime_type})"
+
+
+def is_mpd(source: str) -> bool:
+    """Check if a stream source is a MPD manifest, given by url or by path.
+
+    :param source: stream url or manifest path
+    :type source: str
+    :return: True if the source is a MPD manifest
+    :rtype: bool
+    """
+    return urlparse(source).path.lower().endswith(".mpd")
+
+
+def parse_duration(duration: str) -> float:
+    """Parse an ISO 8601 duration, as used by the MPD attributes.
+
+    :param duration: duration such as PT1H2M3.5S
+    :type duration: str
+    :raises ValueError: if the duration is not valid
+    :return: the duration in seconds
+    :rtype: float
+    """
+    match = ISO_DURATION.fullmatch(duration.strip())
+    if match is None:
+        raise ValueError(f"Invalid duration {duration!r}")
+    parts = {name: float(value) for name, value in match.groupdict().items() if value}
+    hours = parts.get("days", 0) * 24 + parts.get("hours", 0)
+    return (hours * 60 + parts.get("minutes", 0)) * 60 + parts.get("seconds", 0)
+
+
+def fill_template(template: str, representation: ElementTree.Element, number: int, time: int) -> str:
+    """Build a segment url from a SegmentTemplate url template.
+
+    :param template: media template, such as sub-$Number%05d$.dash
+    :type template: str
+    :param representation: Representation element of the segment
+    :type representation: ElementTree.Element
+    :param number: number of the segment
+    :type number: int
+    :param time: start time of the segment, in the template timescale
+    :type time: int
+    :return: the segment url, relative to the base url
+    :rtype: str
+    """
+    values = {
+        "RepresentationID": representation.get("id", ""),
+        "Number": number,
+        "Time": time,
+        "Bandwidth": representation.get("bandwidth", "0"),
+    }
+
+    def replace(match: re.Match) -> str:
+        if match.group(1) is None:
+            return "$"
+        value = values[match.group(1)]
+        return f"{int(value):0{match.group(3)}d}" if match.group(3) else str(value)
+
+    return TEMPLATE_IDENTIFIER.sub(replace, template)
+
+
+def iter_timeline(
+    timeline: ElementTree.Element, start_number: int, end_time: Optional[int]
+) -> Iterator[tuple[int, int]]:
+    """Expand a SegmentTimeline into the number and start time of each segment.
+
+    :param timeline: SegmentTimeline element
+    :type timeline: ElementTree.Element
+    :param start_number: number of the first segment
+    :type start_number: int
+    :param end_time: end of the period in the timeline timescale, needed by an open ended repeat, None if unknown
+    :type end_time: Optional[int]
+    :raises ValueError: if a repeat is open ended and the end of the period is unknown
+    :return: the number and start time of each segment
+    :rtype: Iterator[tuple[int, int]]
+    """
+    entries = timeline.findall(f"{NAMESPACE}S")
+    time, number = 0, start_number
+    for position, entry in enumerate(entries):
+        time = int(entry.get("t", time))
+        duration = int(entry.get("d"))
+        repeat = int(entry.get("r", 0))
+        if repeat < 0:
+            following = entries[position + 1].get("t") if position + 1 < len(entries) else None
+            end = int(following) if following is not None else end_time
+            if end is None:
+                raise ValueError("The timeline repeats until the end of a period of unknown duration")
+            repeat = math.ceil((end - time) / duration) - 1
+        for _ in range(repeat + 1):
+            yield number, time
+            time += duration
+            number += 1
+
+
+def template_segments(
+    templates: list[ElementTree.Element],
+    representation: ElementTree.Element,
+    base_url: str,
+    period_duration: Optional[float],
+) -> list[str]:
+    """List the segment urls of a representation described by SegmentTemplate elements.
+
+    :param templates: SegmentTemplate elements, from the period level to the representation level
+    :type templates: list[ElementTree.Element]
+    :param representation: Representation element
+    :type representation: ElementTree.Element
+    :param base_url: base url of the representation
+    :type base_url: str
+    :param period_duration: duration of the period in seconds, None if unknown
+    :type period_duration: Optional[float]
+    :raises ValueError: if the number of segments cannot be known
+    :return: the segment urls
+    :rtype: list[str]
+    """
+    attributes = {}
+    timeline = None
+    for template in templates:
+        attributes.update(template.attrib)
+        if template.find(f"{NAMESPACE}SegmentTimeline") is not None:
+            timeline = template.find(f"{NAMESPACE}SegmentTimeline")
+    media = attributes["media"]
+    start_number = int(attributes.get("startNumber", 1))
+    timescale = int(attributes.get("timescale", 1))
+    offset = int(attributes.get("presentationTimeOffset", 0))
+    end_time = None if period_duration is None else offset + round(period_duration * timescale)
+
+    if timeline is not None:
+        numbers = iter_timeline(timeline, start_number, end_time)
+    else:
+        if "duration" not in attributes or period_duration is None:
+            raise ValueError("The segment count of the template is unknown, the period has no duration")
+        duration = int(attributes["duration"])
+        count = math.ceil(period_duration * timescale / duration)
+        numbers = ((start_number + i, offset + i * duration) for i in range(count))
+    return [urljoin(base_url, fill_template(media, representation, number, time)) for number, time in numbers]
+
+
+def child_base_url(element: ElementTree.Element, base_url: str) -> str:
+    """Resolve the BaseURL child of an element against the base url of its parent.
+
+    :param element: MPD, Period, AdaptationSet or Representation element
+    :type element: ElementTree.Element
+    :param base_url: base url of the parent element
+    :type base_url: str
+    :return: the base url of the element
+    :rtype: str
+    """
+    base = element.find(f"{NAMESPACE}BaseURL")
+    return urljoin(base_url, base.text.strip()) if base is not None and base.text else base_url
+
+
+def subtitle_tracks(content: bytes, manifest_url: str) -> list[Track]:
+    """List the subtitle tracks of a MPD manifest and their segments.
+
+    Segments are described by SegmentTemplate, with or without SegmentTimeline, by SegmentList, or by a single
+    BaseURL file, possibly with the SegmentBase index range of its sidx box. Tracks spanning several periods list the
+    segments of every period.
+
+    :param content: MPD manifest
+    :type content: bytes
+    :param manifest_url: url of the manifest, relative urls are resolved against it
+    :type manifest_url: str
+    :raises ValueError: if the segments of a subtitle track cannot be listed
+    :return: the subtitle tracks, in the manifest order
+    :rtype: list[Track]
+    """
+    mpd = ElementTree.fromstring(content)
+    mpd_url = child_base_url(mpd, manifest_url)
+    total_duration = mpd.get("mediaPresentationDuration")
+    tracks: dict[str, Track] = {}
+    periods = mpd.findall(f"{NAMESPACE}Period")
+    for position, period in enumerate(periods):
+        period_url = child_base_url(period, mpd_url)
+        period_duration = None
+        if period.get("duration"):
+            period_duration = parse_duration(period.get("duration"))
+        elif total_duration and len(periods) == 1:
+            period_duration = parse_duration(total_duration) - parse_duration(period.get("start", "PT0S"))
+
+        for adaptation in period.findall(f"{NAMESPACE}AdaptationSet"):
+            adaptation_url = child_base_url(adaptation, period_url)
+            for representation in adaptation.findall(f"{NAMESPACE}Representation"):
+                mime_type = representation.get("mimeType", adaptation.get("mimeType", ""))
+                content_type = adaptation.get("contentType", mime_type.split("/")[0])
+                codecs = representation.get("codecs", adaptation.get("codecs", ""))
+                if content_type != "text" and "wvtt" not in codecs and mime_type != "text/vtt":
+                    continue
+                representation_url = child_base_url(representation, adaptation_url)
+                levels = (period, adaptation, representation)
+                templates = [element for level in levels for element in level.findall(f"{NAMESPACE}SegmentTemplate")]
+                segment_list = representation.find(f"{NAMESPACE}SegmentList")
+                index_range = None
+                if templates:
+                    segments = template_segments(templates, representation, representation_url, period_duration)
+                elif segment_list is not None:
+                    segments = [
+                        urljoin(representation_url, url.get("media"))
+                        for url in segment_list.findall(f"{NAMESPACE}SegmentURL")
+                    ]
+                else:
+                    segments = [representation_url]
+                    segment_base = representation.find(f"{NAMESPACE}SegmentBase")
+                    if segment_base is None:
+                        segment_base = adaptation.find(f"{NAMESPACE}SegmentBase")
+                    if segment_base is not None and segment_base.get("indexRange"):
+                        first, last = segment_base.get("indexRange").split("-")
+                        index_range = (int(first), int(last) + 1)
+
+                track_id = representation.get("id", f"{position}-{len(tracks)}")
+                language = representation.get("lang", adaptation.get("lang", ""))
+                previous = tracks.get(track_id)
+                if previous is not None:
+                    segments = previous.segments + segments
+                tracks[track_id] = Track(track_id, language, codecs, mime_type, segments, index_range)
+    return list(tracks.values())
+
+
+def select_track(tracks: list[Track], language: Optional[str] = None, track_id: Optional[str] = None) -> Track:
+    """Select a subtitle track by id or language, wvtt tracks being preferred.
+
+    :param tracks: subtitle tracks of a manifest
+    :type tracks: list[Track]
+    :param language: language of the track, matching its prefix such as en for en-US, defaults to None
+    :type language: str, optional
+    :param track_id: representation id of the track, defaults to None
+    :type track_id: str, optional
+    :raises ValueError: if no track matches
+    :return: the first matching track
+    :rtype: Track
+    """
+    candidates = [
+        track
+        for track in tracks
+        if (track_id is None or track.id == track_id)
+        and (language is None or track.language.lower().split("-")[0] == language.lower().split("-")[0])
+    ]
+    candidates.sort(key=lambda track: "wvtt" not in track.codecs)
+    if not candidates:
+        available = ", ".join(track.describe() for track in tracks) or "none"
+        raise ValueError(f"No subtitle track matches, available tracks: {available}")
+    return candidates[0]
+
+
+def read_manifest(source: str) -> tuple[bytes, str]:
+    """Read a MPD manifest.
+
+    :param source: manifest url or path
+    :type source: str
+    :return: the manifest content and the url relative urls are resolved against
+    :rtype: tuple[bytes, str]
+    """
+    if Path(source).is_file():
+        return Path(source).read_bytes(), Path(source).absolute().as_uri()
+    with urlopen(source) as response:
+        return response.read(), response.geturl()
+
+
+def manifest_segments(
+    source: str, language: Optional[str] = None, track_id: Optional[str] = None
+) -> tuple[Track, list[tuple[int, str]]]:
+    """List the segments of a subtitle track of a MPD manifest, without any probe request.
+
+    :param source: manifest url or path
+    :type source: str
+    :param language: language of the track, defaults to None
+    :type language: str, optional
+    :param track_id: representation id of the track, defaults to None
+    :type track_id: str, optional
+    :return: the selected track, and the position and url of each of its segments
+    :rtype: tuple[Track, list[tuple[int, str]]]
+    """
+    content, manifest_url = read_manifest(source)
+    track = select_track(subtitle_tracks(content, manifest_url), language, track_id)
+    return track, list(enumerate(track.segments))
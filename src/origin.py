@@ -0,0 +1,239 @@
+"""Serve a synthetic dash subtitle stream over HTTP, standing in for a remote origin in tests and benchmarks.
+
+Author: Mikeprod
+Usage: python -m src.origin --segments 500 --latency 0.05
+"""
+
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import click
+
+from src.synthetic import generate_segment
+
+SEGMENT_PATH = re.compile(r"/subtitles/qsm=\d+-(\d+)\.dash")
+BYTE_RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+@lru_cache(maxsize=4096)
+def origin_segment(position: int, cue_count: int = 10, fragment_count: int = 1) -> bytes:
+    """Generate the segment at a position of the stream, each one being generated once.
+
+    :param position: position of the segment in the stream
+    :type position: int
+    :param cue_count: number of cues of the segment, defaults to 10
+    :type cue_count: int, optional
+    :param fragment_count: number of fragments indexed by the sidx box of the segment, defaults to 1
+    :type fragment_count: int, optional
+    :return: the segment
+    :rtype: bytes
+    """
+    return generate_segment(position, cue_count=cue_count, fragment_count=fragment_count)
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    """Answer the segment requests of a MockOrigin."""
+
+    server: "MockOrigin"
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent separately, Nagle's algorithm would delay every kept-alive response
+    disable_nagle_algorithm = True
+
+    def do_HEAD(self) -> None:
+        self._answer(send_body=False)
+
+    def do_GET(self) -> None:
+        self._answer(send_body=True)
+
+    def log_message(self, *_) -> None:
+        # Thousands of requests per run, the origin counters summarize them
+        pass
+
+    def _answer(self, send_body: bool) -> None:
+        origin = self.server
+        origin.record(self.command, "range" in {key.lower() for key in self.headers})
+        origin.wait()
+        match = SEGMENT_PATH.fullmatch(self.path.split("?")[0])
+        index = int(match.group(1)) if match else -1
+        if index < 0 or index % origin.segment_step or index > origin.last_index:
+            self._send_status(404)
+            return
+        if send_body and origin.fails():
+            self._send_status(503)
+            return
+
+        segment = origin_segment(index // origin.segment_step, origin.cue_count, origin.fragment_count)
+        status, data, headers = 200, segment, {"Content-Type": "video/mp4"}
+        byte_range = BYTE_RANGE.fullmatch(self.headers.get("Range", ""))
+        if origin.byte_ranges:
+            headers["Accept-Ranges"] = "bytes"
+        if byte_range and origin.byte_ranges:
+            first = int(byte_range.group(1))
+            last = min(int(byte_range.group(2) or len(segment) - 1), len(segment) - 1)
+            if first >= len(segment):
+                self._send_status(416)
+                return
+            status, data = 206, segment[first : last + 1]
+            headers["Content-Range"] = f"bytes {first}-{last}/{len(segment)}"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+            origin.record_bytes(len(data))
+
+    def _send_status(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class MockOrigin(ThreadingHTTPServer):
+    """Local HTTP server publishing a synthetic subtitle stream of numbered `-N.dash` segments.
+
+    Each request waits for the configured latency plus a random jitter, and a share of the segment downloads fail
+    with a 503 status while probes are always answered, so that the downloader can be load tested without network.
+    Requests are counted by kind.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        segment_count: int,
+        segment_step: int = 10000,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        port: int = 0,
+        cue_count: int = 10,
+        fragment_count: int = 1,
+        byte_ranges: bool = True,
+    ) -> None:
+        """Create the origin, listening on the local interface.
+
+        :param segment_count: number of published segments, the last index being (segment_count - 1) * segment_step
+        :type segment_count: int
+        :param segment_step: step between the index of two segments, defaults to 10000
+        :type segment_step: int, optional
+        :param latency: seconds waited before answering each request, defaults to 0.0
+        :type latency: float, optional
+        :param jitter: maximum random seconds added to the latency, defaults to 0.0
+        :type jitter: float, optional
+        :param error_rate: share of the segment downloads failing with a 503 status, defaults to 0.0
+        :type error_rate: float, optional
+        :param seed: seed of the jitter and of the failures, defaults to 0
+        :type seed: int, optional
+        :param port: listened port, defaults to a free port
+        :type port: int, optional
+        :param cue_count: number of cues of each segment, defaults to 10
+        :type cue_count: int, optional
+        :param fragment_count: number of fragments of each segment, a single segment of many fragments standing in
+            for a SegmentBase file read by byte ranges, defaults to 1
+        :type fragment_count: int, optional
+        :param byte_ranges: whether byte range requests are supported, the whole segment being sent otherwise,
+            defaults to True
+        :type byte_ranges: bool, optional
+        :return: None
+        """
+        super().__init__(("127.0.0.1", port), OriginHandler)
+        self.segment_step = segment_step
+        self.last_index = (segment_count - 1) * segment_step
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.cue_count = cue_count
+        self.fragment_count = fragment_count
+        self.byte_ranges = byte_ranges
+        self.counters = {"head": 0, "get": 0, "range": 0, "errors": 0, "bytes": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Url of the first segment, as given to the downloader."""
+        return f"http://127.0.0.1:{self.server_address[1]}/subtitles/qsm=1000-0.dash"
+
+    def __enter__(self) -> "MockOrigin":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def record(self, method: str, byte_range: bool) -> None:
+        """Count a request.
+
+        :param method: HTTP method
+        :type method: str
+        :param byte_range: whether the request is a byte range request
+        :type byte_range: bool
+        :return: None
+        """
+        with self._lock:
+            self.counters["range" if byte_range else method.lower()] += 1
+
+    def record_bytes(self, size: int) -> None:
+        """Count the bytes of a response body.
+
+        :param size: body size
+        :type size: int
+        :return: None
+        """
+        with self._lock:
+            self.counters["bytes"] += size
+
+    def wait(self) -> None:
+        """Wait for the latency of a request."""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def fails(self) -> bool:
+        """Draw whether a segment request fails.
+
+        :return: True if the request must fail
+        :rtype: bool
+        """
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            self.counters["errors"] += failed
+        return failed
+
+    def reset_counters(self) -> None:
+        """Reset the request counters, such as between two benchmark runs."""
+        with self._lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+
+
+@click.command()
+@click.option("--segments", default=100, help="Number of published segments. Defaults to 100.")
+@click.option("--step", default=10000, help="Segment step of the stream. Defaults to 10000.")
+@click.option("--latency", default=0.0, help="Seconds waited before each answer. Defaults to 0.")
+@click.option("--jitter", default=0.0, help="Maximum random seconds added to the latency. Defaults to 0.")
+@click.option("--error-rate", default=0.0, help="Share of the segment downloads failing with 503. Defaults to 0.")
+@click.option("--port", default=8000, help="Listened port. Defaults to 8000.")
+@click.help_option("--help", "-h")
+def serve(segments: int, step: int, latency: float, jitter: float, error_rate: float, port: int):
+    with MockOrigin(segments, step, latency, jitter, error_rate, port=port) as origin:
+        click.echo(f"Serving {segments} segments from {origin.url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            click.echo(f"Stopped, requests: {origin.counters}")
+
+
+if __name__ == "__main__":
+    serve()
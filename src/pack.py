@@ -0,0 +1,181 @@
+"""Store the segments of a dash folder in a single append-only file, instead of one file per segment.
+
+Author: Mikeprod
+"""
+
+import hashlib
+import mmap
+import struct
+import threading
+from pathlib import Path
+from typing import IO, NamedTuple, Optional
+
+PACK_DATA_NAME = ".dashvtt-segments.pack"
+PACK_INDEX_NAME = ".dashvtt-segments.index"
+# Segment index, offset and size in the data file, sha256 digest of the segment
+INDEX_RECORD = struct.Struct(">qQQ32s")
+
+
+class PackEntry(NamedTuple):
+    """Location of a segment in the data file of a pack."""
+
+    index: int
+    offset: int
+    size: int
+    sha256: bytes
+
+
+class SegmentPack:
+    """Segments appended to a data file, located by an index file of fixed size records.
+
+    A record is appended to the index once its segment is completely written, so an interrupted append is
+    discarded when the pack is opened again. A segment appended twice is located by its last record.
+    """
+
+    def __init__(self, folder: Path, writable: bool = False) -> None:
+        """Open the pack of a folder, creating it if writable.
+
+        :param folder: dash folder holding the pack
+        :type folder: Path
+        :param writable: whether segments are appended to the pack, defaults to False
+        :type writable: bool, optional
+        :raises FileNotFoundError: if the pack does not exist and is not writable
+        :return: None
+        """
+        self.data_path = folder / PACK_DATA_NAME
+        self.index_path = folder / PACK_INDEX_NAME
+        if not writable and not self.exists(folder):
+            raise FileNotFoundError(f"No segment pack in {folder}")
+        self.entries: dict[int, PackEntry] = {}
+        self._lock = threading.Lock()
+        self._data: Optional[IO[bytes]] = None
+        self._index: Optional[IO[bytes]] = None
+        self._map: Optional[mmap.mmap] = None
+
+        index = self.index_path.read_bytes() if self.index_path.is_file() else b""
+        complete = len(index) - len(index) % INDEX_RECORD.size
+        data_end = 0
+        for fields in INDEX_RECORD.iter_unpack(index[:complete]):
+            entry = PackEntry(*fields)
+            self.entries[entry.index] = entry
+            data_end = max(data_end, entry.offset + entry.size)
+
+        if writable:
+            folder.mkdir(parents=True, exist_ok=True)
+            self._data = self.data_path.open("r+b" if self.data_path.is_file() else "w+b")
+            self._data.truncate(data_end)
+            self._data.seek(data_end)
+            self._index = self.index_path.open("r+b" if self.index_path.is_file() else "w+b")
+            self._index.truncate(complete)
+            self._index.seek(complete)
+
+    @staticmethod
+    def exists(folder: Path) -> bool:
+        """Check if a folder holds a segment pack.
+
+        :param folder: dash folder
+        :type folder: Path
+        :return: True if the folder holds a pack
+        :rtype: bool
+        """
+        return (folder / PACK_INDEX_NAME).is_file() and (folder / PACK_DATA_NAME).is_file()
+
+    def __enter__(self) -> "SegmentPack":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def append(self, index: int, data: bytes, digest: Optional[bytes] = None) -> PackEntry:
+        """Append a segment, possibly from several threads.
+
+        :param index: segment index
+        :type index: int
+        :param data: segment content
+        :type data: bytes
+        :param digest: sha256 digest of the content if already computed by the caller, defaults to None
+        :type digest: bytes, optional
+        :return: the location of the segment
+        :rtype: PackEntry
+        """
+        if digest is None:
+            digest = hashlib.sha256(data).digest()
+        with self._lock:
+            entry = PackEntry(index, self._data.tell(), len(data), digest)
+            self._data.write(data)
+            self._data.flush()
+            self._index.write(INDEX_RECORD.pack(*entry))
+            self._index.flush()
+            self.entries[index] = entry
+        return entry
+
+    def ordered(self) -> list[PackEntry]:
+        """List the segments in the stream order, given by their index.
+
+        :return: the location of each segment
+        :rtype: list[PackEntry]
+        """
+        return sorted(self.entries.values())
+
+    def read(self, entry: PackEntry) -> memoryview:
+        """Get the content of a segment, from the data file mapped in memory.
+
+        :param entry: location of the segment
+        :type entry: PackEntry
+        :return: the segment content, valid until the pack is closed
+        :rtype: memoryview
+        """
+        if entry.size == 0:
+            return memoryview(b"")
+        if self._map is None or len(self._map) < entry.offset + entry.size:
+            if self._data is not None:
+                self._data.flush()
+            self._close_map()
+            with self.data_path.open("rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)[entry.offset : entry.offset + entry.size]
+
+    def verify(self, entry: PackEntry) -> None:
+        """Check a segment against the digest recorded when it was appended.
+
+        :param entry: location of the segment
+        :type entry: PackEntry
+        :raises ValueError: if the segment content changed
+        :return: None
+        """
+        if hashlib.sha256(self.read(entry)).digest() != entry.sha256:
+            raise ValueError(f"Segment {entry.index} does not match its recorded sha256 digest")
+
+    def close(self) -> None:
+        """Close the data and index files."""
+        for file in (self._data, self._index):
+            if file is not None:
+                file.close()
+        self._data = self._index = None
+        self._close_map()
+
+    def _close_map(self) -> None:
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Segment views are still referenced by the caller, the mapping is closed when they are collected
+                pass
+            self._map = None
+
+
+def read_packed_segment(location: tuple[Path, int, int]) -> bytes:
+    """Read a segment from the data file of a pack, such as in a worker process.
+
+    :param location: data file, offset and size of the segment
+    :type location: tuple[Path, int, int]
+    :return: the segment content
+    :rtype: bytes
+    """
+    path, offset, size = location
+    with path.open("rb") as f:
+        f.seek(offset)
+        return f.read(size)
@@ -0,0 +1,298 @@
+"""Convert a dash stream to a vtt file in memory, without writing the segments to disk.
+
+Author: Mikeprod
+Usage: python src/pipeline.py -u "https://.../qsm=1000-0.dash" -o "subs/subtitle.vtt"
+"""
+
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from logging import getLogger
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+import click
+from tqdm import tqdm
+
+from src.byte_range import RemoteFile, Subsegment, fetch_subsegment, read_index
+from src.create_vtt_subs import vtt_output_path
+from src.download import stream_segments
+from src.http_pool import ConnectionPool
+from src.metrics import METRICS
+from src.mp4 import Mp4
+from src.mpd import is_mpd, manifest_segments
+from src.utils import parse_timestamp, write_atomic
+from src.vtt import clip_cues, iter_cues
+from src.window import select_window
+from src.writers import SubtitleWriter, VttWriter
+
+LOGGER = getLogger(__name__)
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@click.command()
+@click.option(
+    "--url",
+    "-u",
+    prompt="Dash URL",
+    help="URL of the first dash file, ending with -0.dash, or URL or path of the MPD manifest.",
+    metavar="URL",
+)
+@click.option("--output", "-o", prompt="Output name", help="Output vtt file", metavar="FILE")
+@click.option("--step", help="Segment step for each Dash file? Defaults to 10000.", default=10000)
+@click.option("--workers", "-w", help="Number of segments downloaded in parallel. Defaults to 8.", default=8)
+@click.option(
+    "--queue-size", help="Maximum number of downloaded segments waiting to be parsed. Defaults to 32.", default=32
+)
+@click.option("--keep", help="Also write the downloaded segments in this folder.", metavar="PATH", default=None)
+@click.option("--lang", help="Language of the subtitle track of a MPD manifest, e.g. en.", default=None)
+@click.option("--track", help="Representation id of the subtitle track of a MPD manifest.", default=None)
+@click.option(
+    "--byte-range",
+    is_flag=True,
+    help="The url is a single fragmented MP4 file indexed by a sidx box, read by byte range requests.",
+)
+@click.option("--start", help="Start of the extracted window, as seconds or HH:MM:SS.mmm.", default=None)
+@click.option("--end", help="End of the extracted window, as seconds or HH:MM:SS.mmm.", default=None)
+@click.help_option("--help", "-h")
+def convert_url(
+    url: str,
+    output: str,
+    step: int,
+    workers: int,
+    queue_size: int,
+    keep: Optional[str],
+    lang: Optional[str],
+    track: Optional[str],
+    byte_range: bool,
+    start: Optional[str],
+    end: Optional[str],
+):
+    output_path = vtt_output_path(output)
+    window = None
+    if start is not None or end is not None:
+        try:
+            window = (parse_timestamp(start) if start else 0, parse_timestamp(end) if end else None)
+        except ValueError as error:
+            raise click.BadParameter(str(error))
+    click.echo(f"Extracting {output_path.absolute()} from {url}")
+    try:
+        convert_url_to_vtt(
+            url,
+            output_path,
+            step,
+            workers=workers,
+            queue_size=queue_size,
+            keep=Path(keep) if keep else None,
+            language=lang,
+            track_id=track,
+            byte_range=byte_range,
+            window=window,
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+
+
+def iter_ordered(
+    executor: Optional[Executor], function: Callable[[T], R], items: Iterable[T], queue_size: int = 32
+) -> Iterator[R]:
+    """Apply a function to items in an executor and yield the results in the order of the items.
+
+    Unlike Executor.map, items are consumed lazily: at most `queue_size` of them are running or waiting to be
+    consumed, so memory does not grow with the length of the stream and the consumer work overlaps the executor one.
+
+    :param executor: executor running the function, the items are processed one by one in the caller if None
+    :type executor: Optional[Executor]
+    :param function: function applied to each item
+    :type function: Callable[[T], R]
+    :param items: items to process
+    :type items: Iterable[T]
+    :param queue_size: maximum number of items in flight, defaults to 32
+    :type queue_size: int, optional
+    :return: the result of each item
+    :rtype: Iterator[R]
+    """
+    if executor is None:
+        yield from map(function, items)
+        return
+    in_flight = deque()
+    try:
+        for item in items:
+            in_flight.append(executor.submit(function, item))
+            if len(in_flight) >= queue_size:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def iter_downloaded(
+    segments: Iterable[tuple[int, str]], pool: ConnectionPool, workers: int = 8, queue_size: int = 32
+) -> Iterator[tuple[int, bytes]]:
+    """Download segments in parallel and yield their content in the stream order.
+
+    :param segments: index and url of each segment
+    :type segments: Iterable[tuple[int, str]]
+    :param pool: keep-alive connections used for the downloads
+    :type pool: ConnectionPool
+    :param workers: number of segments downloaded at the same time, defaults to 8
+    :type workers: int, optional
+    :param queue_size: maximum number of segments in flight, defaults to 32
+    :type queue_size: int, optional
+    :return: index and content of each segment
+    :rtype: Iterator[tuple[int, bytes]]
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from iter_ordered(executor, partial(download_indexed, pool), segments, max(queue_size, workers))
+
+
+def download_indexed(pool: ConnectionPool, segment: tuple[int, str]) -> tuple[int, bytes]:
+    """Download a segment, keeping its index.
+
+    :param pool: keep-alive connections used for the download
+    :type pool: ConnectionPool
+    :param segment: index and url of the segment
+    :type segment: tuple[int, str]
+    :return: index and content of the segment
+    :rtype: tuple[int, bytes]
+    """
+    index, url = segment
+    return index, pool.get(url)
+
+
+def convert_url_to_vtt(
+    url: str,
+    output: Path,
+    segment_step: int = 10000,
+    segment_size: int = 1000,
+    workers: int = 8,
+    queue_size: int = 32,
+    keep: Optional[Path] = None,
+    language: Optional[str] = None,
+    track_id: Optional[str] = None,
+    byte_range: bool = False,
+    window: Optional[tuple[int, Optional[int]]] = None,
+) -> None:
+    """Download a dash stream and convert it to a vtt file, the segments are parsed straight from memory.
+
+    A track made of a single file indexed by a sidx box, such as a SegmentBase track of a MPD manifest, is read by
+    byte range requests: only the subsegments overlapping the time window are downloaded.
+
+    :param url: url of the first dash file, ending with -0.dash, or url or path of the MPD manifest
+    :type url: str
+    :param output: the output VTT file
+    :type output: Path
+    :param segment_step: step between each segment, defaults to 10000
+    :type segment_step: int, optional
+    :param segment_size: size of the segment, defaults to 1000
+    :type segment_size: int, optional
+    :param workers: number of segments downloaded at the same time, defaults to 8
+    :type workers: int, optional
+    :param queue_size: maximum number of downloaded segments waiting to be parsed, defaults to 32
+    :type queue_size: int, optional
+    :param keep: folder where the downloaded segments are also written, defaults to None
+    :type keep: Path, optional
+    :param language: language of the subtitle track of a MPD manifest, defaults to None
+    :type language: str, optional
+    :param track_id: representation id of the subtitle track of a MPD manifest, defaults to None
+    :type track_id: str, optional
+    :param byte_range: whether the url is a single file read by byte range requests, which is detected for the
+        SegmentBase tracks of a MPD manifest, defaults to False
+    :type byte_range: bool, optional
+    :param window: start and end of the extracted window in milliseconds, the end being None for the end of the
+        stream, defaults to the whole stream
+    :type window: tuple[int, Optional[int]], optional
+    :raises ValueError: if the segments cannot be read by byte ranges
+    :return: None
+    """
+    index_range = None
+    if is_mpd(url):
+        track, segments = manifest_segments(url, language, track_id)
+        LOGGER.info(f"Subtitle track {track.describe()}: {len(segments)} segments")
+        if track.index_range is not None and len(segments) == 1:
+            byte_range, index_range = True, track.index_range
+    else:
+        segments = [(0, url)] if byte_range else stream_segments(url, segment_step, segment_size)
+
+    if byte_range:
+        if keep is not None:
+            raise ValueError("The subsegments read by byte ranges cannot be kept, they have no sidx box")
+        if len(segments) != 1:
+            raise ValueError(f"Byte range requests need a track made of a single file, not {len(segments)} segments")
+        with ConnectionPool() as pool, VttWriter(output) as writer:
+            convert_byte_ranges(segments[0][1], writer, pool, workers, queue_size, index_range, window)
+        return
+
+    if keep is not None:
+        keep.mkdir(parents=True, exist_ok=True)
+    LOGGER.info(f"Converting {len(segments)} segments")
+    with ConnectionPool() as pool, VttWriter(output) as writer:
+        for index, data in tqdm(iter_downloaded(segments, pool, workers, queue_size), total=len(segments)):
+            if keep is not None:
+                write_atomic(keep / f"{index:08d}.mp4", data)
+            with Mp4.from_bytes(data) as mp4:
+                cues = iter_cues(mp4)
+                writer.write_all(cues if window is None else clip_cues(cues, *window))
+
+
+def convert_byte_ranges(
+    url: str,
+    writer: SubtitleWriter,
+    pool: ConnectionPool,
+    workers: int = 8,
+    queue_size: int = 32,
+    index_range: Optional[tuple[int, int]] = None,
+    window: Optional[tuple[int, Optional[int]]] = None,
+) -> int:
+    """Convert a single fragmented file indexed by a sidx box, downloading its subsegments by byte ranges.
+
+    The sidx box is read first, then the subsegments overlapping the window are downloaded in parallel and parsed
+    in the file order, each one being timed by its sidx reference.
+
+    :param url: url of the file
+    :type url: str
+    :param writer: the output writer
+    :type writer: SubtitleWriter
+    :param pool: keep-alive connections used for the requests
+    :type pool: ConnectionPool
+    :param workers: number of subsegments downloaded at the same time, defaults to 8
+    :type workers: int, optional
+    :param queue_size: maximum number of downloaded subsegments waiting to be parsed, defaults to 32
+    :type queue_size: int, optional
+    :param index_range: start and end offsets of the sidx box, such as the SegmentBase index range, defaults to
+        a walk over the box headers from the start of the file
+    :type index_range: tuple[int, int], optional
+    :param window: start and end of the extracted window in milliseconds, defaults to the whole file
+    :type window: tuple[int, Optional[int]], optional
+    :raises ValueError: if the file has no sidx box
+    :return: the number of downloaded subsegments
+    :rtype: int
+    """
+    file = RemoteFile(pool, url)
+    with METRICS.stage("index"):
+        subsegments: list[Subsegment] = read_index(file, *(index_range or (0, None)))
+    METRICS.count("index", requests=file.requests, subsegments=len(subsegments))
+    if window is not None:
+        subsegments = select_window(subsegments, lambda subsegment: subsegment.span, *window)
+    LOGGER.info(f"Converting {len(subsegments)} subsegments, the index was read in {file.requests} requests")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        contents = iter_ordered(executor, partial(fetch_subsegment, file), subsegments, max(queue_size, workers))
+        for subsegment in tqdm(subsegments):
+            # Waiting for the next subsegment, the downloads of the following ones overlap the parsing
+            with METRICS.stage("download"):
+                data = next(contents)
+            METRICS.count("download", segments=1, bytes=len(data))
+            with METRICS.stage("parse"):
+                mp4 = Mp4.from_bytes(data, span=subsegment.span)
+            with mp4, METRICS.stage("write"):
+                cues = iter_cues(mp4)
+                writer.write_all(cues if window is None else clip_cues(cues, *window))
+    return len(subsegments)
+
+
+if __name__ == "__main__":
+    convert_url()
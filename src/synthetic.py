@@ -0,0 +1,228 @@
+"""Generate synthetic wvtt dash segments, for tests and benchmarks.
+
+Author: Mikeprod
+"""
+
+import random
+import struct
+from pathlib import Path
+from typing import Optional, Sequence
+
+from src.utils import write_atomic
+
+WORDS = (
+    "the web is always changing and way we access it subtitles stream segment caption line speaker music "
+    "night river voice city light window door road time again never always maybe here there"
+).split()
+SAMPLE_DURATION = 2000
+
+
+def box(name: str, payload: bytes = b"") -> bytes:
+    """Build a box.
+
+    :param name: 4 characters box name
+    :type name: str
+    :param payload: content of the box, defaults to b""
+    :type payload: bytes, optional
+    :return: the box
+    :rtype: bytes
+    """
+    return struct.pack(">I4s", 8 + len(payload), name.encode("latin-1")) + payload
+
+
+def full_box(name: str, version: int, flags: int, payload: bytes = b"") -> bytes:
+    """Build a box starting with a version and flags.
+
+    :param name: 4 characters box name
+    :type name: str
+    :param version: box version
+    :type version: int
+    :param flags: box flags
+    :type flags: int
+    :param payload: content of the box following the version and flags, defaults to b""
+    :type payload: bytes, optional
+    :return: the box
+    :rtype: bytes
+    """
+    return box(name, struct.pack(">I", (version << 24) | flags) + payload)
+
+
+def vtt_sample(text: Optional[str], settings: str = "line:90%") -> bytes:
+    """Build a wvtt sample.
+
+    :param text: text of the cue, None for an empty sample
+    :type text: Optional[str]
+    :param settings: cue settings, defaults to "line:90%"
+    :type settings: str, optional
+    :return: a vttc box, or a vtte box without text
+    :rtype: bytes
+    """
+    if text is None:
+        return box("vtte")
+    settings_box = box("sttg", settings.encode("utf-8")) if settings else b""
+    return box("vttc", settings_box + box("payl", text.encode("utf-8")))
+
+
+def build_fragment(start_time: int, samples: Sequence[tuple[int, bytes]], sequence_number: int) -> bytes:
+    """Build a moof and mdat pair.
+
+    :param start_time: decode time of the first sample
+    :type start_time: int
+    :param samples: duration and content of each sample
+    :type samples: Sequence[tuple[int, bytes]]
+    :param sequence_number: fragment sequence number
+    :type sequence_number: int
+    :return: the moof and mdat boxes
+    :rtype: bytes
+    """
+    mfhd = full_box("mfhd", 0, 0, struct.pack(">I", sequence_number))
+    tfhd = full_box("tfhd", 0, 0x020000, struct.pack(">I", 1))
+    tfdt = full_box("tfdt", 1, 0, struct.pack(">Q", start_time))
+    entries = b"".join(struct.pack(">II", duration, len(content)) for duration, content in samples)
+
+    def moof(data_offset: int) -> bytes:
+        trun = full_box("trun", 0, 0x000301, struct.pack(">Ii", len(samples), data_offset) + entries)
+        return box("moof", mfhd + box("traf", tfhd + tfdt + trun))
+
+    moof_size = len(moof(0))
+    return moof(moof_size + 8) + box("mdat", b"".join(content for _, content in samples))
+
+
+def build_segment(
+    start_time: int,
+    cues: Sequence[tuple[int, Optional[str]]],
+    sequence_number: int = 1,
+    timescale: int = 1000,
+    fragment_count: int = 1,
+) -> bytes:
+    """Build a dash subtitle segment: styp, sidx, then moof and mdat pairs.
+
+    :param start_time: presentation time of the segment, in timescale units
+    :type start_time: int
+    :param cues: duration in timescale units and text of each sample, None for an empty sample
+    :type cues: Sequence[tuple[int, Optional[str]]]
+    :param sequence_number: sequence number of the first fragment, defaults to 1
+    :type sequence_number: int, optional
+    :param timescale: number of time units per second, defaults to 1000
+    :type timescale: int, optional
+    :param fragment_count: number of moof and mdat pairs the samples are split into, defaults to 1
+    :type fragment_count: int, optional
+    :return: the segment
+    :rtype: bytes
+    """
+    samples = [(duration, vtt_sample(text)) for duration, text in cues]
+    per_fragment = max(1, -(-len(samples) // fragment_count))
+    fragments = []
+    references = []
+    time = start_time
+    for number, first in enumerate(range(0, len(samples), per_fragment)):
+        fragment_samples = samples[first : first + per_fragment]
+        fragment = build_fragment(time, fragment_samples, sequence_number + number)
+        duration = sum(duration for duration, _ in fragment_samples)
+        fragments.append(fragment)
+        references.append(struct.pack(">III", len(fragment), duration, 0x90000000))
+        time += duration
+
+    styp = box("styp", b"msdh\x00\x00\x00\x00msdhmsix")
+    sidx = full_box(
+        "sidx", 0, 0, struct.pack(">IIIIHH", 1, timescale, start_time, 0, 0, len(references)) + b"".join(references)
+    )
+    return styp + sidx + b"".join(fragments)
+
+
+def generate_cues(
+    cue_count: int, text_size: int = 32, seed: int = 0, previous: Optional[str] = None
+) -> list[tuple[int, Optional[str]]]:
+    """Generate the samples of a segment: cues separated by empty samples.
+
+    :param cue_count: number of cues
+    :type cue_count: int
+    :param text_size: approximate number of characters of each cue, defaults to 32
+    :type text_size: int, optional
+    :param seed: seed of the generated text, defaults to 0
+    :type seed: int, optional
+    :param previous: text repeated by the first cue, as a cue crossing a segment boundary, defaults to None
+    :type previous: Optional[str], optional
+    :return: duration and text of each sample, None for an empty sample
+    :rtype: list[tuple[int, Optional[str]]]
+    """
+    generator = random.Random(seed)
+    samples = []
+    for number in range(cue_count):
+        if number == 0 and previous is not None:
+            samples.append((SAMPLE_DURATION, previous))
+            continue
+        if number == cue_count - 1:
+            # The last cue is repeated by the next segment, which only knows the seed of this one
+            generator = random.Random(f"{seed}-last")
+        words = []
+        while sum(map(len, words)) + len(words) < text_size:
+            words.append(generator.choice(WORDS))
+        text = " ".join(words)
+        samples.append((SAMPLE_DURATION, f"<c.yellow>{text}</c>" if number % 5 == 0 else text))
+        if number % 3 == 2:
+            samples.append((SAMPLE_DURATION // 4, None))
+    return samples
+
+
+def generate_segment(index: int, cue_count: int = 10, text_size: int = 32, fragment_count: int = 1) -> bytes:
+    """Generate the segment of a stream.
+
+    The first cue of each segment but the first one repeats the last cue of the previous segment, as a cue crossing
+    a segment boundary.
+
+    :param index: segment number in the stream
+    :type index: int
+    :param cue_count: number of cues of the segment, defaults to 10
+    :type cue_count: int, optional
+    :param text_size: approximate number of characters of each cue, defaults to 32
+    :type text_size: int, optional
+    :param fragment_count: number of moof and mdat pairs, defaults to 1
+    :type fragment_count: int, optional
+    :return: the segment
+    :rtype: bytes
+    """
+    previous = None
+    if index and cue_count > 1:
+        # The text of the last cue only depends on the seed, not on the cue repeated from the segment before
+        previous = [text for _, text in generate_cues(cue_count, text_size, seed=index - 1) if text is not None][-1]
+    cues = generate_cues(cue_count, text_size, seed=index, previous=previous)
+    return build_segment(
+        segment_time(index, cue_count), cues, index * fragment_count + 1, fragment_count=fragment_count
+    )
+
+
+def segment_time(index: int, cue_count: int = 10) -> int:
+    """Presentation time of a generated segment, in milliseconds.
+
+    :param index: segment number in the stream
+    :type index: int
+    :param cue_count: number of cues of each segment, defaults to 10
+    :type cue_count: int, optional
+    :return: the presentation time of the segment
+    :rtype: int
+    """
+    return index * (cue_count * SAMPLE_DURATION + cue_count // 3 * (SAMPLE_DURATION // 4))
+
+
+def write_dash_folder(
+    folder: Path, segment_count: int, cue_count: int = 10, text_size: int = 32, fragment_count: int = 1
+) -> None:
+    """Write a stream of generated segments, named like the downloaded ones.
+
+    :param folder: destination folder
+    :type folder: Path
+    :param segment_count: number of segments
+    :type segment_count: int
+    :param cue_count: number of cues of each segment, defaults to 10
+    :type cue_count: int, optional
+    :param text_size: approximate number of characters of each cue, defaults to 32
+    :type text_size: int, optional
+    :param fragment_count: number of moof and mdat pairs of each segment, defaults to 1
+    :type fragment_count: int, optional
+    :return: None
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    for index in range(segment_count):
+        data = generate_segment(index, cue_count, text_size, fragment_count)
+        write_atomic(folder / f"{segment_time(index, cue_count):08d}.mp4", data)
@@ -1,5 +1,9 @@
 import math
+import os
+import tempfile
 from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
 from typing import Iterable, Union
 
 
@@ -11,18 +15,124 @@ def order_alphabetically(unsorted_list: Iterable[str]) -> Iterable[str]:
     :return: list of strings ordered alphabetically
     :rtype: List[str]
     """
-    return sorted(unsorted_list, key=lambda x: int(x.split("=")[-1].split("-")[-1].split(".")[0]))
+    return sorted(unsorted_list, key=segment_number)
 
 
-def get_int(value: bytes) -> int:
-    """Convert a bytes value to an integer.
+def segment_number(name: str) -> int:
+    """Get the number ordering a segment in the stream, such as its time or index.
+
+    :param name: segment name, e.g. 00010000.mp4 or sub-10000.dash
+    :type name: str
+    :return: the segment number
+    :rtype: int
+    """
+    return int(name.split("=")[-1].split("-")[-1].split(".")[0])
+
+
+def list_segments(folder: Path) -> list[str]:
+    """List the segment names of a dash folder in the stream order.
+
+    Hidden files, such as the download manifest or unfinished temporary files, are not segments.
+
+    :param folder: dash folder
+    :type folder: Path
+    :return: ordered segment names
+    :rtype: list[str]
+    """
+    return order_alphabetically(
+        path.name for path in folder.iterdir() if path.is_file() and not path.name.startswith(".")
+    )
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Write a file atomically.
+
+    The data is written to a hidden temporary file of the same folder, then renamed over the destination, so that
+    readers never see a partially written file.
+
+    :param path: destination file
+    :type path: Path
+    :param data: content of the file
+    :type data: bytes
+    :return: None
+    """
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as writer:
+            writer.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def get_int(value: Union[bytes, memoryview]) -> int:
+    """Convert a big-endian bytes value to an integer.
 
     :param value: bytes value to convert
-    :type value: bytes
+    :type value: Union[bytes, memoryview]
     :return: integer value
     :rtype: int
     """
-    return int(value.hex(), 16)
+    return int.from_bytes(value, "big")
+
+
+def to_milliseconds(time: int, timescale: int) -> int:
+    """Convert a time expressed in a stream timescale to milliseconds.
+
+    :param time: time in timescale units
+    :type time: int
+    :param timescale: number of units per second
+    :type timescale: int
+    :return: time in milliseconds, rounded down
+    :rtype: int
+    """
+    return time * 1000 // timescale
+
+
+def parse_timestamp(timestamp: str) -> int:
+    """Parse a timestamp given as seconds, MM:SS or HH:MM:SS, with optional decimals.
+
+    The leading field is not bounded, such as 2400 seconds or 90:00 minutes, the following ones are below 60.
+
+    :param timestamp: timestamp such as 2400, 40:00 or 00:40:00.500
+    :type timestamp: str
+    :raises ValueError: if the timestamp is not valid, negative, or has minutes or seconds out of range
+    :return: the timestamp in milliseconds
+    :rtype: int
+    """
+    parts = timestamp.strip().split(":")
+    seconds, _, decimals = parts[-1].partition(".")
+    fields = parts[:-1] + [seconds]
+    # Only digits, which also rejects signs, spaces and underscores accepted by int
+    if len(parts) > 3 or not all(field.isascii() and field.isdigit() for field in fields):
+        raise ValueError(f"Invalid timestamp {timestamp!r}")
+    if decimals and not (decimals.isascii() and decimals.isdigit()):
+        raise ValueError(f"Invalid timestamp {timestamp!r}")
+    if any(int(field) >= 60 for field in fields[1:]):
+        raise ValueError(f"Invalid timestamp {timestamp!r}, minutes and seconds must be below 60")
+    milliseconds = int(decimals.ljust(3, "0")[:3]) if decimals else 0
+    for position, value in enumerate(reversed(fields)):
+        milliseconds += int(value) * 1000 * 60**position
+    return milliseconds
+
+
+@lru_cache(maxsize=4096)
+def format_timestamp(milliseconds: int) -> str:
+    """Format a time as a VTT timestamp, HH:MM:SS.mmm.
+
+    Only integer arithmetic is used and hours keep counting after a day. Results are cached, as the end of a cue is
+    usually the start of the next one.
+
+    :param milliseconds: time in milliseconds
+    :type milliseconds: int
+    :return: the timestamp
+    :rtype: str
+    """
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
 
 
 class timedelta_new(timedelta):
@@ -1,62 +1,165 @@
+import re
+from array import array
+from itertools import accumulate
 from logging import getLogger
-from re import findall
-from typing import Any
+from typing import Iterable, Iterator, NamedTuple, Optional, Sequence
 
-from src.mp4 import Mp4
-from src.utils import get_int, timedelta_new
+from src.mp4 import Mp4, iter_boxes
+from src.utils import format_timestamp, to_milliseconds
 
 LOGGER = getLogger(__name__)
 VTT_HEADER = "WEBVTT\n"
+TIMING_LINE = re.compile(r"(\d+):(\d+):(\d+)\.(\d+) --> (\d+):(\d+):(\d+)\.(\d+) ?(.*)")
 
 
-def extract_text(text: bytes) -> dict[str, str]:
-    """Extract the text from the mp4 subtitles.
+class CuePayload(NamedTuple):
+    """Content of a vttc box of a wvtt sample."""
 
-    It also extracts the style for the subtitles as well
+    identifier: str
+    style: str
+    text: str
 
-    :param text: text to extract
-    :type text: bytes
-    :return: extracted text and style
-    :rtype: dict
+
+class Cue(NamedTuple):
+    """Subtitle cue, timed in milliseconds."""
+
+    start_ms: int
+    end_ms: int
+    style: str
+    text: str
+
+
+def decode_vtt_sample(sample: memoryview) -> list[CuePayload]:
+    """Decode the cues of a wvtt sample.
+
+    A sample is a sequence of vttc boxes, one per cue, or a single vtte box when no cue is displayed. The children of
+    each vttc box are read by size: iden, sttg and payl hold the cue identifier, settings and text, while vsid and
+    ctim do not change the rendered cue. Only the text and settings are decoded from UTF-8.
+
+    :param sample: sample content, starting with the size of its first box
+    :type sample: memoryview
+    :raises ValueError: if the sample holds an unexpected box
+    :return: the cues of the sample, empty for a vtte box
+    :rtype: list[CuePayload]
+    """
+    cues = []
+    for box in iter_boxes(sample):
+        if box.name == "vttc":
+            fields = {}
+            for child in iter_boxes(sample, box.start, box.end):
+                if child.name in ("iden", "sttg", "payl"):
+                    fields[child.name] = str(sample[child.start : child.end], "utf-8")
+            cues.append(
+                CuePayload(identifier=fields.get("iden", ""), style=fields.get("sttg", ""), text=fields.get("payl", ""))
+            )
+        elif box.name not in ("vtte", "vtta"):
+            raise ValueError(f"Unexpected {box.name!r} box in the subtitle")
+    return cues
+
+
+def merge_cues(previous: Cue, cue: Cue) -> Optional[Cue]:
+    """Merge a cue into the previous one when it repeats the same subtitle.
+
+    A cue crossing a segment boundary is repeated in both segments, the repetitions touching or overlapping the
+    previous cue are merged into a single cue.
+
+    :param previous: previous cue of the stream
+    :type previous: Cue
+    :param cue: next cue of the stream
+    :type cue: Cue
+    :return: the merged cue, None if the cues are distinct
+    :rtype: Optional[Cue]
     """
-    if text[:4] == b"vtte":
-        return {"text": "", "style": ""}
-    else:
-        if text[:4] == b"vttc":
-            return parse_vtt_cue(text)
-        raise ValueError("Unexpected value in the subtitle")
+    if cue.text == previous.text and cue.style == previous.style and cue.start_ms <= previous.end_ms:
+        return previous._replace(end_ms=max(previous.end_ms, cue.end_ms))
+    return None
+
+
+def deduplicate_cues(cues: Iterable[Cue]) -> Iterator[Cue]:
+    """Merge the consecutive cues repeating the same subtitle.
 
+    Only the previous cue is kept in memory.
 
-def parse_vtt_cue(cue: bytes) -> dict[str, str]:
-    """Parse the content that starts with vttc.
+    :param cues: cues in the stream order
+    :type cues: Iterable[Cue]
+    :return: deduplicated cues
+    :rtype: Iterator[Cue]
+    """
+    previous = None
+    for cue in cues:
+        merged = merge_cues(previous, cue) if previous is not None else None
+        if merged is not None:
+            previous = merged
+            continue
+        if previous is not None:
+            yield previous
+        previous = cue
+    if previous is not None:
+        yield previous
+
+
+def clip_cues(cues: Iterable[Cue], start_ms: int, end_ms: Optional[int]) -> Iterator[Cue]:
+    """Keep the cues displayed within a time window, clipped to it.
+
+    :param cues: cues in the stream order
+    :type cues: Iterable[Cue]
+    :param start_ms: start of the window
+    :type start_ms: int
+    :param end_ms: end of the window, None for the end of the stream
+    :type end_ms: Optional[int]
+    :return: the cues overlapping the window, clipped to it
+    :rtype: Iterator[Cue]
+    """
+    for cue in cues:
+        if cue.end_ms <= start_ms or (end_ms is not None and cue.start_ms >= end_ms):
+            continue
+        if cue.start_ms < start_ms or (end_ms is not None and cue.end_ms > end_ms):
+            cue = cue._replace(
+                start_ms=max(cue.start_ms, start_ms), end_ms=cue.end_ms if end_ms is None else min(cue.end_ms, end_ms)
+            )
+        yield cue
+
+
+def format_cue(cue: Cue) -> str:
+    """Render a cue in the VTT format.
+
+    :param cue: cue to render
+    :type cue: Cue
+    :return: the VTT cue, preceded by a blank line
+    :rtype: str
+    """
+    settings = f" {cue.style}" if cue.style else ""
+    return f"\n{format_timestamp(cue.start_ms)} --> {format_timestamp(cue.end_ms)}{settings}\n{cue.text}\n"
+
+
+def render_vtt(cues: Iterable[Cue]) -> str:
+    """Render cues as the content of a VTT file.
+
+    :param cues: cues to render
+    :type cues: Iterable[Cue]
+    :return: content of the VTT file
+    :rtype: str
+    """
+    return VTT_HEADER + "".join(map(format_cue, cues))
 
-    vttc stands for VTT Cue.
 
-    :param cue: The content retrieved from the mp4 data
-    :type cue: bytes
-    :return: the text and style of the VTT Cue
+def parse_vtt(subtitles: str) -> Iterator[Cue]:
+    """Parse the cues of a VTT content.
 
+    :param subtitles: content of a VTT file
+    :type subtitles: str
+    :return: the cues of the content
+    :rtype: Iterator[Cue]
     """
-    header_start = 8
-    cue_header_size = get_int(cue[4:header_start])
-    decoded_style = cue[header_start : header_start + cue_header_size - 4].decode("utf-8").replace("sttg", "")
-
-    payload_tag = cue.index(b"payl")
-    payload_size = get_int(cue[payload_tag - 4 : payload_tag])
-    cursor = payload_tag + 4
-    payload = cue[cursor : cursor + payload_size]
-    if payload[-4:] == b"vsid":
-        payload = payload[:-8]
-    payload_cpy = bytes(reversed(payload))
-    closing = 0
-    try:
-        closing = payload_cpy.index(b"\x3e")
-    except ValueError:
-        pass
-    if closing > 0:
-        return {"text": payload[:-closing].decode("utf-8"), "style": decoded_style}
-    else:
-        return {"text": payload.decode("utf-8"), "style": decoded_style}
+    for block in subtitles.split("\n\n"):
+        timing, _, text = block.strip("\n").partition("\n")
+        match = TIMING_LINE.fullmatch(timing)
+        if match is None:
+            continue
+        fields = [int(value) for value in match.groups()[:8]]
+        start_ms = ((fields[0] * 60 + fields[1]) * 60 + fields[2]) * 1000 + fields[3]
+        end_ms = ((fields[4] * 60 + fields[5]) * 60 + fields[6]) * 1000 + fields[7]
+        yield Cue(start_ms=start_ms, end_ms=end_ms, style=match.group(9), text=text)
 
 
 def deduplicate_subtitles(subtitles: str) -> str:
@@ -67,52 +170,58 @@ def deduplicate_subtitles(subtitles: str) -> str:
     :return: deduplicated subtitles
     :rtype: str
     """
-    subs = subtitles.split(" --> ")
-    subtitle_entries = []
-    for i in range(1, len(subs)):
-        start_date = findall(r"\d+:\d+:\d+.\d+", subs[i - 1])  # handle days ?!
-        end_date = findall(r"\d+:\d+:\d+.\d+", subs[i])  # handle days ?!
-        text = ""
-        try:
-            start_text = subs[i].index(f"{end_date[0]}") + len(f"{end_date[0]}")
-            if len(end_date) == 2:
-                text = subs[i][start_text : subs[i].index(f"\n\n{end_date[1]}")]
-            else:
-                text = subs[i][start_text:]
-
-        except ValueError:
-            LOGGER.error("Split issue in deduplication")
-        subtitle_entries.append((start_date[0] if len(start_date) == 1 else start_date[1], end_date[0], text))
-
-    cleaned_entries = []
-    for i in range(1, len(subtitle_entries)):
-        cleaned_entries.append(subtitle_entries[i - 1])
-        if subtitle_entries[i - 1][-1] == subtitle_entries[i][-1]:
-            cleaned_entries.remove(subtitle_entries[i - 1])
-
-    subtitles_text = VTT_HEADER
-    for start, end, text in cleaned_entries:
-        subtitles_text += f"\n{start} --> {end}{text}\n"
-    return subtitles_text
-
-
-def generate_timeline(samples: list[dict[str, Any]], time_in_stream: int) -> list[str]:
+    return render_vtt(deduplicate_cues(parse_vtt(subtitles)))
+
+
+def generate_timeline(durations: Sequence[int], time_in_stream: int, timescale: int = 1000) -> tuple[array, array]:
     """Generate the timeline for the subtitles.
 
-    :param samples: Every element of the subtitle timeline
-    :type samples: list[dict[str, Any]]
-    :param time_in_stream: time in the stream
+    :param durations: duration of every sample of the subtitle timeline, in timescale units
+    :type durations: Sequence[int]
+    :param time_in_stream: time in the stream of the first sample, in timescale units
     :type time_in_stream: int
-    :return: The timeline, a list of start and end times
-    :rtype: list[str]
+    :param timescale: number of time units per second, defaults to 1000
+    :type timescale: int, optional
+    :return: The timeline, the start and end times of each sample in milliseconds
+    :rtype: tuple[array, array]
+    """
+    times = accumulate(durations, initial=time_in_stream)
+    if timescale != 1000:
+        times = (to_milliseconds(time, timescale) for time in times)
+    times = array("q", times)
+    return times[:-1], times[1:]
+
+
+def iter_cues(mp4: Mp4) -> Iterator[Cue]:
+    """Extract the subtitle cues from a Dash file, lazily.
+
+    Every fragment of the file is converted, so a single file made of many fragments is supported. Empty samples,
+    which only mark the gaps between subtitles, do not produce any cue.
+
+    :param mp4: Dash file to extract the subtitles from
+    :type mp4: Mp4
+    :return: the cues, in the stream order
+    :rtype: Iterator[Cue]
+    """
+    for fragment in mp4.iter_fragments():
+        starts, ends = generate_timeline(
+            fragment.moof["traf"]["trun"]["sample_durations"], fragment.start_time, fragment.timescale
+        )
+        for start_ms, end_ms, content in zip(starts, ends, fragment.mdat["samples_content"]):
+            for payload in decode_vtt_sample(content):
+                if payload.text:
+                    yield Cue(start_ms=start_ms, end_ms=end_ms, style=payload.style, text=payload.text)
+
+
+def cues_from_mp4(mp4: Mp4) -> list[Cue]:
+    """Extract the subtitle cues from a Dash file.
+
+    :param mp4: Dash file to extract the subtitles from
+    :type mp4: Mp4
+    :return: the cues, in the stream order
+    :rtype: list[Cue]
     """
-    timeline = []
-    current_time = time_in_stream
-    for sample in samples:
-        start = str(timedelta_new(milliseconds=current_time))
-        end = str(timedelta_new(milliseconds=(current_time := current_time + sample["sample_duration"])))
-        timeline.append(f"{start} --> {end}")
-    return timeline
+    return list(iter_cues(mp4))
 
 
 def vtt_from_mp4(mp4: Mp4) -> str:
@@ -123,10 +232,4 @@ def vtt_from_mp4(mp4: Mp4) -> str:
     :return: The content of the subtitle file
     :rtype: str
     """
-    subs = [extract_text(text) for text in mp4.blocks["mdat"]["samples_content"]]
-    timeline = generate_timeline(mp4.blocks["moof"]["traf"]["trun"]["samples"], mp4.blocks["sidx"]["time_in_stream"])
-    subtitles = ""
-    for i in range(len(subs)):
-        if subs[i] != "":
-            subtitles += f"\n{timeline[i]} {subs[i]['style']}\n{subs[i]['text']}\n"
-    return subtitles
+    return "".join(map(format_cue, cues_from_mp4(mp4)))
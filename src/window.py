@@ -0,0 +1,78 @@
+"""Select the segments overlapping a time window from their sidx boxes.
+
+Author: Mikeprod
+"""
+
+from logging import getLogger
+from pathlib import Path
+from typing import Callable, Optional, Sequence, TypeVar
+
+from src.mp4 import SegmentSpan, read_sidx_span
+
+LOGGER = getLogger(__name__)
+T = TypeVar("T")
+
+
+def read_file_span(path: Path) -> Optional[SegmentSpan]:
+    """Read the presentation interval of a segment file from its sidx box.
+
+    :param path: segment file
+    :type path: Path
+    :return: the interval, None if the segment has no sidx box
+    :rtype: Optional[SegmentSpan]
+    """
+    with path.open("rb") as f:
+        return read_sidx_span(f)
+
+
+def select_window(
+    segments: Sequence[T], read_span: Callable[[T], Optional[SegmentSpan]], start_ms: int, end_ms: Optional[int]
+) -> list[T]:
+    """Select the segments overlapping a time window.
+
+    Segments are in the stream order, so the first overlapping segment is found by a binary search over their
+    intervals, then the next ones are taken until one starts after the window. Intervals are read lazily: only
+    O(log n) segments outside of the window have their sidx box read. If a probed segment has no sidx box, every
+    segment is selected.
+
+    :param segments: segments in the stream order
+    :type segments: Sequence[T]
+    :param read_span: function reading the interval of a segment from its sidx box
+    :type read_span: Callable[[T], Optional[SegmentSpan]]
+    :param start_ms: start of the window
+    :type start_ms: int
+    :param end_ms: end of the window, None for the end of the stream
+    :type end_ms: Optional[int]
+    :return: the segments overlapping the window
+    :rtype: list[T]
+    """
+    spans: dict[int, Optional[SegmentSpan]] = {}
+
+    def span(position: int) -> Optional[SegmentSpan]:
+        if position not in spans:
+            spans[position] = read_span(segments[position])
+        return spans[position]
+
+    low, high = 0, len(segments)
+    while low < high:
+        middle = (low + high) // 2
+        middle_span = span(middle)
+        if middle_span is None:
+            LOGGER.warning("Segments without sidx box, the whole stream is parsed to extract the time window")
+            return list(segments)
+        if middle_span.end_ms <= start_ms:
+            low = middle + 1
+        else:
+            high = middle
+
+    selected = []
+    for position in range(low, len(segments)):
+        position_span = span(position)
+        if position_span is None:
+            LOGGER.warning("Segments without sidx box, the whole stream is parsed to extract the time window")
+            return list(segments)
+        if end_ms is not None and position_span.start_ms >= end_ms:
+            break
+        selected.append(segments[position])
+    LOGGER.info(f"{len(selected)} segments overlap the window, {len(spans)} sidx boxes read")
+    return selected
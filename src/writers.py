@@ -0,0 +1,338 @@
+"""Write subtitle cues to a file as they are extracted.
+
+Author: Mikeprod
+"""
+
+import json
+import re
+from abc import ABC, abstractmethod
+from html import escape
+from pathlib import Path
+from typing import IO, Iterable, Optional, Sequence
+
+from src.utils import format_timestamp
+from src.vtt import TIMING_LINE, VTT_HEADER, Cue, format_cue, merge_cues, parse_vtt
+
+# Number of bytes read at the end of an existing file to find its last cue
+TAIL_SIZE = 65536
+# WebVTT tags without equivalent in the other formats: class spans, voices, languages and ruby annotations
+VTT_TAG = re.compile(r"</?(?:c|v|lang|ruby|rt)(?:\.[^\s>]*)?(?:\s[^>]*)?>")
+# WebVTT italic, bold and underline tags, written as styled spans in TTML
+STYLE_TAG = re.compile(r"<(/?)([ibu])(?:\.[^\s>]*)?>")
+TTML_STYLES = {
+    "i": 'tts:fontStyle="italic"',
+    "b": 'tts:fontWeight="bold"',
+    "u": 'tts:textDecoration="underline"',
+}
+
+
+class SubtitleWriter(ABC):
+    """Incremental subtitle file writer.
+
+    Cues are written as soon as they are known to be distinct from the next one: only the last cue is kept in memory
+    to merge its repetitions, so memory does not grow with the length of the stream. Subclasses define the file
+    header and footer, and how a cue is formatted.
+    """
+
+    header = ""
+    footer = ""
+
+    def __init__(self, path: Path) -> None:
+        """Create a writer.
+
+        :param path: output file
+        :type path: Path
+        :return: None
+        """
+        self.path = path
+        self.cue_count = 0
+        self._file: Optional[IO[str]] = None
+        self._previous: Optional[Cue] = None
+
+    def __enter__(self) -> "SubtitleWriter":
+        self.open()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """Create the output file and write the header."""
+        self._file = self.path.open("w", encoding="utf-8", newline="")
+        self._file.write(self.header)
+
+    def write(self, cue: Cue) -> None:
+        """Add a cue to the file.
+
+        :param cue: next cue of the stream
+        :type cue: Cue
+        :return: None
+        """
+        if self._previous is not None:
+            merged = merge_cues(self._previous, cue)
+            if merged is not None:
+                self._previous = merged
+                return
+            self._emit(self._previous)
+        self._previous = cue
+
+    def write_all(self, cues: Iterable[Cue]) -> None:
+        """Add cues to the file.
+
+        :param cues: next cues of the stream
+        :type cues: Iterable[Cue]
+        :return: None
+        """
+        for cue in cues:
+            self.write(cue)
+
+    def close(self) -> None:
+        """Write the last cue and the footer, and close the file."""
+        if self._file is None:
+            return
+        if self._previous is not None:
+            self._emit(self._previous)
+            self._previous = None
+        self._file.write(self.footer)
+        self._file.close()
+        self._file = None
+
+    @abstractmethod
+    def format_cue(self, cue: Cue) -> str:
+        """Format a deduplicated cue.
+
+        :param cue: cue to format
+        :type cue: Cue
+        :return: the cue as written in the file
+        :rtype: str
+        """
+
+    def _emit(self, cue: Cue) -> None:
+        self.cue_count += 1
+        self._file.write(self.format_cue(cue))
+
+
+class VttWriter(SubtitleWriter):
+    """Incremental VTT file writer."""
+
+    header = VTT_HEADER
+
+    def format_cue(self, cue: Cue) -> str:
+        return format_cue(cue)
+
+
+class SrtWriter(SubtitleWriter):
+    """Incremental SRT file writer: cues are numbered, use a comma before the milliseconds and have no settings."""
+
+    def format_cue(self, cue: Cue) -> str:
+        start = format_timestamp(cue.start_ms).replace(".", ",")
+        end = format_timestamp(cue.end_ms).replace(".", ",")
+        return f"{self.cue_count}\n{start} --> {end}\n{strip_vtt_tags(cue.text)}\n\n"
+
+
+class TtmlWriter(SubtitleWriter):
+    """Incremental TTML file writer, each cue being a paragraph of the body."""
+
+    header = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<tt xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling">\n<body>\n<div>\n'
+    )
+    footer = "</div>\n</body>\n</tt>\n"
+
+    def format_cue(self, cue: Cue) -> str:
+        text = ttml_text(strip_vtt_tags(cue.text))
+        return f'<p begin="{format_timestamp(cue.start_ms)}" end="{format_timestamp(cue.end_ms)}">{text}</p>\n'
+
+
+class JsonWriter(SubtitleWriter):
+    """Incremental JSON file writer, the file holding an array of cue objects."""
+
+    header = "["
+    footer = "\n]\n"
+
+    def format_cue(self, cue: Cue) -> str:
+        content = json.dumps(
+            {
+                "start": format_timestamp(cue.start_ms),
+                "end": format_timestamp(cue.end_ms),
+                "start_ms": cue.start_ms,
+                "end_ms": cue.end_ms,
+                "settings": cue.style,
+                "text": cue.text,
+            },
+            ensure_ascii=False,
+        )
+        return f"{',' if self.cue_count > 1 else ''}\n  {content}"
+
+
+class FanOutWriter(SubtitleWriter):
+    """Writer streaming the same cues to several writers, the cues being deduplicated once for all of them."""
+
+    def __init__(self, writers: Sequence[SubtitleWriter]) -> None:
+        """Create a writer.
+
+        :param writers: writers of each output
+        :type writers: Sequence[SubtitleWriter]
+        :return: None
+        """
+        super().__init__(writers[0].path)
+        self.writers = list(writers)
+
+    def open(self) -> None:
+        """Open every output."""
+        for writer in self.writers:
+            writer.open()
+
+    def close(self) -> None:
+        """Write the last cue and close every output."""
+        if self._previous is not None:
+            self._emit(self._previous)
+            self._previous = None
+        for writer in self.writers:
+            writer.close()
+
+    def format_cue(self, cue: Cue) -> str:
+        """Format a cue as the first output does, each output formatting the cues it writes."""
+        return self.writers[0].format_cue(cue)
+
+    def _emit(self, cue: Cue) -> None:
+        self.cue_count += 1
+        for writer in self.writers:
+            writer._emit(cue)
+
+
+# Writer of each output format
+WRITERS: dict[str, type[SubtitleWriter]] = {"vtt": VttWriter, "srt": SrtWriter, "ttml": TtmlWriter, "json": JsonWriter}
+
+
+def strip_vtt_tags(text: str) -> str:
+    """Remove the WebVTT class, voice and language tags, which other formats do not support.
+
+    :param text: cue text
+    :type text: str
+    :return: the text without these tags, the italic, bold and underline tags are kept
+    :rtype: str
+    """
+    return VTT_TAG.sub("", text)
+
+
+def ttml_text(text: str) -> str:
+    """Convert cue text to TTML, the italic, bold and underline tags becoming styled spans.
+
+    Spans left open at the end of the cue are closed and unmatched closing tags are dropped, so the paragraph is
+    always well-formed.
+
+    :param text: cue text, without the WebVTT tags stripped by strip_vtt_tags
+    :type text: str
+    :return: the escaped text, lines being separated by br elements
+    :rtype: str
+    """
+    parts = []
+    position = depth = 0
+    for match in STYLE_TAG.finditer(text):
+        parts.append(escape(text[position : match.start()]))
+        if not match.group(1):
+            parts.append(f"<span {TTML_STYLES[match.group(2)]}>")
+            depth += 1
+        elif depth:
+            parts.append("</span>")
+            depth -= 1
+        position = match.end()
+    parts.append(escape(text[position:]))
+    parts.append("</span>" * depth)
+    return "".join(parts).replace("\n", "<br/>")
+
+
+def create_writer(outputs: Sequence[tuple[str, Path]]) -> SubtitleWriter:
+    """Create the writer of one or several outputs.
+
+    :param outputs: format and file of each output
+    :type outputs: Sequence[tuple[str, Path]]
+    :raises ValueError: if a format is not supported
+    :return: the writer of the only output, or a writer streaming to every output
+    :rtype: SubtitleWriter
+    """
+    writers = []
+    for output_format, path in outputs:
+        if output_format not in WRITERS:
+            raise ValueError(f"Unsupported format {output_format!r}, expected one of {', '.join(WRITERS)}")
+        writers.append(WRITERS[output_format](path))
+    return writers[0] if len(writers) == 1 else FanOutWriter(writers)
+
+
+class AppendingVttWriter(VttWriter):
+    """VTT writer appending to an existing file, for streams converted while they are published.
+
+    Each cue reaches the file as soon as it is written. A repetition of the last written cue, as found at a segment
+    boundary, extends it: the file is truncated at the start of that cue and the merged cue is written again. Cues
+    starting before the last cue of the existing file were already written by a previous run and are skipped.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Create a writer.
+
+        :param path: output file, created if missing
+        :type path: Path
+        :return: None
+        """
+        super().__init__(path)
+        self._binary: Optional[IO[bytes]] = None
+        self._last_offset = 0
+        self._resume_ms: Optional[int] = None
+
+    def open(self) -> None:
+        """Open the output file, writing the VTT header if it is new, and find its last cue."""
+        if not self.path.is_file() or self.path.stat().st_size == 0:
+            self._binary = self.path.open("wb")
+            self._binary.write(VTT_HEADER.encode("utf-8"))
+            return
+        self._binary = self.path.open("r+b")
+        size = self._binary.seek(0, 2)
+        tail_start = max(0, size - TAIL_SIZE)
+        self._binary.seek(tail_start)
+        tail = self._binary.read()
+        # Every cue starts with an empty line, the last one followed by a timing line starts the last cue
+        separator = tail.rfind(b"\n\n")
+        while separator >= 0:
+            timing = tail[separator + 2 :].split(b"\n", 1)[0].decode("utf-8", errors="replace")
+            if TIMING_LINE.fullmatch(timing):
+                self._previous = next(parse_vtt(tail[separator + 2 :].decode("utf-8")))
+                self._last_offset = tail_start + separator + 1
+                self._resume_ms = self._previous.start_ms
+                break
+            separator = tail.rfind(b"\n\n", 0, separator)
+        self._binary.seek(size)
+
+    def write(self, cue: Cue) -> None:
+        """Append a cue to the file, or extend the last written cue if the cue repeats it.
+
+        :param cue: next cue of the stream
+        :type cue: Cue
+        :return: None
+        """
+        if self._resume_ms is not None and cue.start_ms < self._resume_ms:
+            return
+        if self._previous is not None:
+            merged = merge_cues(self._previous, cue)
+            if merged is not None:
+                if merged != self._previous:
+                    self._binary.seek(self._last_offset)
+                    self._binary.truncate()
+                    self._binary.write(format_cue(merged).encode("utf-8"))
+                    self._previous = merged
+                return
+        self._last_offset = self._binary.tell()
+        self._binary.write(format_cue(cue).encode("utf-8"))
+        self._previous = cue
+        self.cue_count += 1
+
+    def flush(self) -> None:
+        """Make the written cues visible to the readers of the file."""
+        self._binary.flush()
+
+    def close(self) -> None:
+        """Close the file, every cue is already written."""
+        if self._binary is None:
+            return
+        self._binary.close()
+        self._binary = None
@@ -0,0 +1,22 @@
+from src.batch import read_job_file, run_jobs
+from src.synthetic import write_dash_folder
+
+
+def test_read_job_file_skips_comments_and_quotes_paths(tmp_path):
+    job_file = tmp_path / "jobs.txt"
+    job_file.write_text('# title, language\nhttps://host/qsm=1000-0.dash en.vtt\n\n"dash folder" "subs/fr"\n')
+    jobs = read_job_file(job_file)
+    assert [(job.source, job.output.as_posix(), job.is_url) for job in jobs] == [
+        ("https://host/qsm=1000-0.dash", "en.vtt", True),
+        ("dash folder", "subs/fr.vtt", False),
+    ]
+
+
+def test_run_jobs_isolates_failures(tmp_path):
+    write_dash_folder(tmp_path / "dash", 3)
+    job_file = tmp_path / "jobs.txt"
+    job_file.write_text(f"{tmp_path / 'missing'} {tmp_path / 'a.vtt'}\n{tmp_path / 'dash'} {tmp_path / 'b.vtt'}\n")
+    missing, converted = run_jobs(read_job_file(job_file), parallel=2)
+    assert missing.error.startswith("FileNotFoundError")
+    assert converted.error is None and converted.cues > 0
+    assert (tmp_path / "b.vtt").read_text().startswith("WEBVTT")
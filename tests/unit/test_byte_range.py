@@ -0,0 +1,46 @@
+import struct
+
+from src.http_pool import ConnectionPool
+from src.mp4 import Mp4, SidxReference, decode_sidx
+from src.origin import MockOrigin, origin_segment
+from src.pipeline import convert_byte_ranges
+from src.vtt import clip_cues, cues_from_mp4
+from src.writers import VttWriter
+
+
+def test_decode_sidx_references():
+    payload = struct.pack(">B3sIIQQHH", 1, b"\x00\x00\x00", 1, 1000, 2**33, 12, 0, 2) + struct.pack(
+        ">IIIIII", 0x80000100, 4000, 0x90000000, 500, 3000, 0x2000000A
+    )
+    sidx = decode_sidx(payload)
+    assert (sidx["earliest_presentation_time"], sidx["first_offset"], sidx["reference_count"]) == (2**33, 12, 2)
+    assert sidx["references"] == [
+        SidxReference(1, 256, 4000, True, 1, 0),
+        SidxReference(0, 500, 3000, False, 2, 10),
+    ]
+
+
+def test_convert_byte_ranges_downloads_only_the_window(tmp_path):
+    window = (100000, 160000)
+    expected = list(clip_cues(cues_from_mp4(Mp4.from_bytes(origin_segment(0, 300, 30))), *window))
+    with MockOrigin(1, cue_count=300, fragment_count=30) as origin, ConnectionPool() as pool:
+        with VttWriter(tmp_path / "window.vtt") as writer:
+            subsegments = convert_byte_ranges(origin.url, writer, pool, workers=4, window=window)
+        assert origin.counters["get"] == 0
+        assert origin.counters["range"] == subsegments + 1
+    assert subsegments < 10
+    with VttWriter(tmp_path / "expected.vtt") as writer:
+        writer.write_all(expected)
+    assert (tmp_path / "window.vtt").read_text() == (tmp_path / "expected.vtt").read_text()
+
+
+def test_convert_byte_ranges_downloads_once_without_range_support(tmp_path):
+    with MockOrigin(1, cue_count=300, fragment_count=30, byte_ranges=False) as origin, ConnectionPool() as pool:
+        with VttWriter(tmp_path / "whole.vtt") as writer:
+            subsegments = convert_byte_ranges(origin.url, writer, pool, workers=4)
+        assert subsegments > 1
+        assert origin.counters["range"] == 1
+        assert origin.counters["bytes"] == len(origin_segment(0, 300, 30))
+    with VttWriter(tmp_path / "expected.vtt") as writer:
+        writer.write_all(cues_from_mp4(Mp4.from_bytes(origin_segment(0, 300, 30))))
+    assert (tmp_path / "whole.vtt").read_text() == (tmp_path / "expected.vtt").read_text()
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from src.cache import CACHE_NAME, ParseCache, open_cache, pack_cues, unpack_cues
+from src.create_vtt_subs import extract_vtt_from_dash
+from src.synthetic import write_dash_folder
+from src.vtt import Cue
+
+CUES = [Cue(0, 1500, "line:90% align:start", "première ligne\n<i>日本語</i>"), Cue(2000, 2500, "", "")]
+
+
+def test_pack_cues_round_trip():
+    assert unpack_cues(pack_cues(CUES)) == CUES
+    assert unpack_cues(pack_cues([])) == []
+
+
+def test_changed_segment_is_a_miss(tmp_path):
+    segment = tmp_path / "00000000.mp4"
+    segment.write_bytes(b"segment")
+    with ParseCache(tmp_path / CACHE_NAME) as cache:
+        cache.put(segment, CUES)
+        assert cache.get(segment) == CUES
+        stat = segment.stat()
+        os.utime(segment, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert cache.get(segment) is None
+        cache.put(segment, CUES)
+        segment.write_bytes(b"longer segment")
+        os.utime(segment, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert cache.get(segment) is None
+        assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_other_version_drops_the_entries(tmp_path):
+    segment = tmp_path / "00000000.mp4"
+    segment.write_bytes(b"segment")
+    with ParseCache(tmp_path / CACHE_NAME) as cache:
+        cache.put(segment, CUES)
+    connection = sqlite3.connect(tmp_path / CACHE_NAME)
+    connection.execute("PRAGMA user_version = 0")
+    connection.close()
+    with ParseCache(tmp_path / CACHE_NAME) as cache:
+        assert cache.stats()["entries"] == 0
+        assert cache.get(segment) is None
+
+
+def test_extract_vtt_from_dash_reuses_the_cache(tmp_path):
+    folder = tmp_path / "dash"
+    write_dash_folder(folder, 12)
+    with open_cache(folder) as cache:
+        extract_vtt_from_dash(folder, tmp_path / "first.vtt", cache=cache)
+        assert cache.stats() == {"hits": 0, "misses": 12, "entries": 12}
+    with open_cache(folder) as cache:
+        extract_vtt_from_dash(folder, tmp_path / "second.vtt", cache=cache)
+        assert cache.stats() == {"hits": 12, "misses": 0, "entries": 12}
+    assert (tmp_path / "second.vtt").read_bytes() == (tmp_path / "first.vtt").read_bytes()
+
+
+def test_cache_is_shared_by_threads(tmp_path):
+    segments = []
+    for index in range(8):
+        segments.append(tmp_path / f"{index:08d}.mp4")
+        segments[-1].write_bytes(b"segment")
+    with ParseCache(tmp_path / CACHE_NAME) as cache, ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda segment: cache.put(segment, CUES), segments))
+        assert list(executor.map(cache.get, segments)) == [CUES] * len(segments)
+    with ParseCache(tmp_path / CACHE_NAME) as cache:
+        assert cache.stats()["entries"] == len(segments)
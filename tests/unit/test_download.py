@@ -0,0 +1,69 @@
+from urllib.error import HTTPError
+
+import pytest
+
+from src import download
+from src.download import define_segment_range, download_dashed_vtt, download_segments
+from src.metrics import METRICS
+from src.origin import MockOrigin
+from src.synthetic import generate_segment
+
+URL = "https://example.com/subtitles/qsm=1000-0.dash"
+
+
+def _fake_origin(monkeypatch, last_index):
+    probed = []
+
+    def is_url_available(url):
+        probed.append(url)
+        return int(url.split("-")[-1].split(".")[0]) <= last_index
+
+    monkeypatch.setattr(download, "is_url_available", is_url_available)
+    return probed
+
+
+def test_define_segment_range(monkeypatch):
+    probed = _fake_origin(monkeypatch, last_index=7230000)
+    assert define_segment_range(URL, 10000) == (0, 7240000)
+    assert len(probed) < 25
+
+
+def test_define_segment_range_no_segment(monkeypatch):
+    _fake_origin(monkeypatch, last_index=-1)
+    assert define_segment_range(URL, 10000) == (0, 0)
+
+
+def test_define_segment_range_probe_cache(monkeypatch):
+    probed = _fake_origin(monkeypatch, last_index=50000)
+    cache = {}
+    define_segment_range(URL, 10000, cache)
+    probe_count = len(probed)
+    assert define_segment_range(URL, 10000, cache) == (0, 60000)
+    assert len(probed) == probe_count
+
+
+def test_download_from_mock_origin(tmp_path):
+    with MockOrigin(40, latency=0.001) as origin:
+        download_dashed_vtt(origin.url, tmp_path, workers=4)
+        assert origin.counters["get"] == 40
+        assert origin.counters["head"] < 20
+    assert sorted(path.name for path in tmp_path.glob("*.mp4")) == [f"{i * 10000:08d}.mp4" for i in range(40)]
+    assert (tmp_path / "00010000.mp4").read_bytes() == generate_segment(1)
+
+
+def test_download_retries_server_errors(tmp_path):
+    with MockOrigin(30, error_rate=0.3) as origin:
+        segments = [(index, origin.url.replace("-0.dash", f"-{index}.dash")) for index in range(0, 300000, 10000)]
+        METRICS.reset()
+        download_segments(segments, tmp_path, workers=4, retries=10, backoff=0.0)
+        assert origin.counters["errors"] > 0
+        assert origin.counters["get"] == 30 + origin.counters["errors"]
+    assert METRICS.report()["stages"]["download"]["retries"] == origin.counters["errors"]
+    assert len(list(tmp_path.glob("*.mp4"))) == 30
+
+
+def test_download_gives_up_after_the_retries(tmp_path):
+    with MockOrigin(1, error_rate=1.0) as origin:
+        with pytest.raises(HTTPError):
+            download_segments([(0, origin.url)], tmp_path, retries=2, backoff=0.0)
+        assert origin.counters["get"] == 3
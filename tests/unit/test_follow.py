@@ -0,0 +1,39 @@
+import json
+
+from src.create_vtt_subs import extract_vtt_from_dash
+from src.follow import follow_folder
+from src.synthetic import write_dash_folder
+
+
+def test_follow_folder_appends_only_new_cues(tmp_path):
+    write_dash_folder(tmp_path / "full", 5)
+    extract_vtt_from_dash(tmp_path / "full", tmp_path / "expected.vtt")
+
+    live = tmp_path / "live"
+    write_dash_folder(live, 3)
+    first = follow_folder(live, tmp_path / "live.vtt", interval=0.01, idle_timeout=0.05)
+    write_dash_folder(tmp_path / "next", 5)
+    for segment in sorted((tmp_path / "next").iterdir())[3:]:
+        segment.rename(live / segment.name)
+    second = follow_folder(live, tmp_path / "live.vtt", interval=0.01, idle_timeout=0.05)
+
+    assert first > 0 and second > 0
+    assert (tmp_path / "live.vtt").read_bytes() == (tmp_path / "expected.vtt").read_bytes()
+
+
+def test_follow_folder_appends_late_segments(tmp_path):
+    write_dash_folder(tmp_path / "full", 4)
+    segments = sorted((tmp_path / "full").iterdir())
+    live = tmp_path / "live"
+    live.mkdir()
+    for segment in (segments[0], segments[2]):
+        segment.rename(live / segment.name)
+    first = follow_folder(live, tmp_path / "live.vtt", interval=0.01, idle_timeout=0.05)
+    for segment in (segments[1], segments[3]):
+        segment.rename(live / segment.name)
+    second = follow_folder(live, tmp_path / "live.vtt", interval=0.01, idle_timeout=0.05)
+    third = follow_folder(live, tmp_path / "live.vtt", interval=0.01, idle_timeout=0.05)
+
+    assert first > 0 and second > 0 and third == 0
+    state = json.loads((tmp_path / ".live.vtt.follow.json").read_text("utf-8"))
+    assert sorted(state["appended"]) == [segment.name for segment in segments]
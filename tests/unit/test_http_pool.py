@@ -0,0 +1,32 @@
+import socket
+
+from src.http_pool import ConnectionPool
+from src.origin import MockOrigin, origin_segment
+
+
+def test_pool_reuses_its_connection():
+    with MockOrigin(2) as origin, ConnectionPool() as pool:
+        first = pool.get(origin.url)
+        second = pool.get(origin.url.replace("-0.dash", "-10000.dash"))
+        assert (first, second) == (origin_segment(0), origin_segment(1))
+        assert len(pool._opened) == 1
+
+
+def test_pool_retries_a_dropped_connection():
+    with MockOrigin(1) as origin, ConnectionPool() as pool:
+        pool.get(origin.url)
+        (dropped,) = pool._opened
+        dropped.sock.shutdown(socket.SHUT_RDWR)
+        assert pool.get(origin.url) == origin_segment(0)
+        assert len(pool._opened) == 1 and dropped not in pool._opened
+        assert origin.counters["get"] == 2
+
+
+def test_pool_close_drops_every_connection():
+    with MockOrigin(1) as origin, ConnectionPool() as pool:
+        pool.get(origin.url)
+        (closed,) = pool._opened
+        pool.close()
+        assert not pool._opened and closed.sock is None
+        assert pool.get(origin.url) == origin_segment(0)
+        assert len(pool._opened) == 1 and closed not in pool._opened
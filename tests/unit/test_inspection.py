@@ -0,0 +1,69 @@
+import io
+
+from src.inspection import inspect_folder
+from src.mp4 import read_headers
+from src.synthetic import generate_segment, segment_time, write_dash_folder
+
+
+class CountingReader(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.read_bytes = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.read_bytes += len(data)
+        return data
+
+
+def test_read_headers_skips_the_samples():
+    segment = generate_segment(3, cue_count=200, fragment_count=2)
+    reader = CountingReader(segment)
+    headers = read_headers(reader)
+    mdat_payload = sum(box.end - box.start for box in headers.boxes if box.name == "mdat")
+    assert [box.name for box in headers.boxes] == ["styp", "sidx", "moof", "mdat", "moof", "mdat"]
+    assert sum(traf["trun"]["samples_count"] for moof in headers.moofs for traf in moof["trafs"]) > 200
+    assert reader.read_bytes <= len(segment) - mdat_payload + 16 * len(headers.boxes)
+
+
+def test_inspect_folder_reports_gaps_and_discontinuities(tmp_path):
+    write_dash_folder(tmp_path, 6)
+    removed = sorted(tmp_path.iterdir())[3]
+    removed.unlink()
+    report = inspect_folder(tmp_path)
+    assert report["segments"] == 5
+    assert [gap["previous"] for gap in report["gaps"]] == [sorted(tmp_path.iterdir())[2].name]
+    assert [(issue["from"], issue["to"]) for issue in report["sequence_discontinuities"]] == [(3, 5)]
+    assert report["overlaps"] == [] and report["errors"] == []
+
+
+def test_inspect_concatenated_file_checks_each_segment(tmp_path):
+    path = tmp_path / "stream.mp4"
+    path.write_bytes(b"".join(generate_segment(index) for index in (0, 1, 2, 4, 5)))
+    report = inspect_folder(path)
+    assert report["segments"] == 5
+    assert report["start_ms"] == 0
+    assert report["end_ms"] == segment_time(6)
+    assert [gap["segment"] for gap in report["gaps"]] == ["stream.mp4#3"]
+    assert [(issue["from"], issue["to"]) for issue in report["sequence_discontinuities"]] == [(3, 5)]
+
+
+def test_inspect_folder_reports_a_corrupted_mfhd(tmp_path):
+    write_dash_folder(tmp_path, 3)
+    damaged = sorted(tmp_path.iterdir())[1]
+    data = bytearray(damaged.read_bytes())
+    mfhd = data.index(b"mfhd") - 4
+    data[mfhd : mfhd + 4] = (8).to_bytes(4, "big")
+    damaged.write_bytes(data)
+    report = inspect_folder(tmp_path)
+    assert report["segments"] == 2
+    assert [error["segment"] for error in report["errors"]] == [damaged.name]
+    assert "moof" in report["errors"][0]["error"]
+
+
+def test_inspect_truncated_concatenated_file(tmp_path):
+    path = tmp_path / "stream.mp4"
+    path.write_bytes(b"".join(generate_segment(index) for index in range(3))[:-10])
+    report = inspect_folder(path)
+    assert report["segments"] == 0
+    assert [error["segment"] for error in report["errors"]] == ["stream.mp4"]
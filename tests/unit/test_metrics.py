@@ -0,0 +1,30 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from src.create_vtt_subs import convert_segment_bytes
+from src.metrics import METRICS, Metrics, run_measured
+from src.synthetic import generate_segment
+
+
+def test_metrics_report_throughput_per_counter():
+    metrics = Metrics()
+    with metrics.stage("read", bytes=100):
+        pass
+    metrics.count("read", seconds=1.0, segments=2)
+    stage = metrics.report()["stages"]["read"]
+    assert stage["calls"] == 1
+    assert stage["bytes"] == 100 and stage["segments"] == 2
+    assert stage["segments_per_second"] == 2 / stage["seconds"]
+    assert "calls_per_second" not in stage
+
+
+def test_stages_of_worker_processes_are_merged():
+    segment = generate_segment(0)
+    METRICS.reset()
+    cues, stages = run_measured(convert_segment_bytes, os.getpid(), segment)
+    assert stages == {} and METRICS.report()["stages"]["decode"]["cues"] == len(cues)
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        _, stages = executor.submit(run_measured, convert_segment_bytes, os.getpid(), segment).result()
+    METRICS.merge(stages)
+    decode = METRICS.report()["stages"]["decode"]
+    assert decode["calls"] == 2 and decode["cues"] == 2 * len(cues)
@@ -0,0 +1,43 @@
+import struct
+
+import pytest
+
+from src.mp4 import Box, Mp4, iter_boxes
+from src.synthetic import build_segment, generate_segment
+from src.vtt import cues_from_mp4
+
+
+def test_iter_boxes_size_forms():
+    content = struct.pack(">I4sQ", 1, b"free", 20) + b"abcd" + struct.pack(">I4s", 0, b"mdat") + b"tail"
+    assert list(iter_boxes(memoryview(content))) == [Box("free", 0, 16, 20), Box("mdat", 20, 28, 32)]
+
+
+def test_iter_boxes_truncated():
+    with pytest.raises(ValueError):
+        list(iter_boxes(memoryview(struct.pack(">I4s", 16, b"free") + b"abc")))
+
+
+def test_mp4_several_fragments():
+    cues = [(1000, "one"), (500, None), (1000, "two"), (1000, "three")]
+    mp4 = Mp4.from_bytes(build_segment(4000, cues, fragment_count=2))
+    assert [fragment.start_time for fragment in mp4.fragments] == [4000, 5500]
+    assert [(cue.start_ms, cue.end_ms, cue.text) for cue in cues_from_mp4(mp4)] == [
+        (4000, 5000, "one"),
+        (5500, 6500, "two"),
+        (6500, 7500, "three"),
+    ]
+
+
+def test_mp4_mdat_until_end_of_file():
+    segment = bytearray(generate_segment(0))
+    mdat = list(iter_boxes(memoryview(bytes(segment))))[-1]
+    segment[mdat.offset : mdat.offset + 4] = bytes(4)
+    assert cues_from_mp4(Mp4.from_bytes(bytes(segment))) == cues_from_mp4(Mp4.from_bytes(generate_segment(0)))
+
+
+@pytest.mark.parametrize("index", [1, 2, 3, 4])
+def test_generated_segment_repeats_the_previous_last_cue(index):
+    previous = cues_from_mp4(Mp4.from_bytes(generate_segment(index - 1)))
+    cues = cues_from_mp4(Mp4.from_bytes(generate_segment(index)))
+    assert cues[0].text == previous[-1].text
+    assert cues[0].start_ms == previous[-1].end_ms
@@ -0,0 +1,41 @@
+import pytest
+
+from src.mpd import parse_duration, select_track, subtitle_tracks
+
+MANIFEST = b"""<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT0H0M10S">
+  <BaseURL>subs/</BaseURL>
+  <Period>
+    <AdaptationSet contentType="video" mimeType="video/mp4"><Representation id="video" codecs="avc1"/></AdaptationSet>
+    <AdaptationSet contentType="text" mimeType="application/mp4" lang="fr">
+      <Representation id="fr" codecs="wvtt" bandwidth="500">
+        <SegmentTemplate media="$RepresentationID$/$Number%03d$.m4s" startNumber="0" timescale="10" duration="40"/>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="text" mimeType="application/mp4" lang="en-US">
+      <SegmentTemplate timescale="1000" media="en/$Time$.m4s">
+        <SegmentTimeline><S t="1000" d="2000" r="1"/><S d="3000" r="-1"/></SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="en" codecs="wvtt"/>
+    </AdaptationSet>
+  </Period>
+</MPD>"""
+
+
+def test_subtitle_tracks_from_templates():
+    tracks = subtitle_tracks(MANIFEST, "https://host/stream/manifest.mpd")
+    assert [(track.id, track.language) for track in tracks] == [("fr", "fr"), ("en", "en-US")]
+    assert tracks[0].segments == [f"https://host/stream/subs/fr/{number:03d}.m4s" for number in range(3)]
+    assert tracks[1].segments == [f"https://host/stream/subs/en/{time}.m4s" for time in (1000, 3000, 5000, 8000)]
+
+
+def test_select_track_by_language_prefix():
+    tracks = subtitle_tracks(MANIFEST, "https://host/manifest.mpd")
+    assert select_track(tracks, language="en").id == "en"
+    with pytest.raises(ValueError, match="available tracks: fr"):
+        select_track(tracks, language="de")
+
+
+def test_parse_duration():
+    assert parse_duration("PT1H2M3.5S") == 3723.5
+    assert parse_duration("P1DT1S") == 86401
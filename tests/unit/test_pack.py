@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.create_vtt_subs import extract_vtt_from_dash
+from src.inspection import inspect_folder
+from src.pack import PACK_DATA_NAME, PACK_INDEX_NAME, SegmentPack
+from src.synthetic import generate_segment, write_dash_folder
+
+
+def test_pack_converts_like_the_segment_files(tmp_path):
+    write_dash_folder(tmp_path / "files", 6)
+    extract_vtt_from_dash(tmp_path / "files", tmp_path / "files.vtt")
+    with SegmentPack(tmp_path / "packed", writable=True) as pack:
+        for index in (3, 0, 5, 1, 4, 2):
+            pack.append(index, generate_segment(index))
+
+    extract_vtt_from_dash(tmp_path / "packed", tmp_path / "packed.vtt")
+    with ThreadPoolExecutor(2) as executor:
+        extract_vtt_from_dash(tmp_path / "packed", tmp_path / "parallel.vtt", jobs=2, executor=executor)
+    assert (tmp_path / "packed.vtt").read_bytes() == (tmp_path / "files.vtt").read_bytes()
+    assert (tmp_path / "parallel.vtt").read_bytes() == (tmp_path / "files.vtt").read_bytes()
+
+
+def test_pack_discards_an_interrupted_append(tmp_path):
+    with SegmentPack(tmp_path, writable=True) as pack:
+        pack.append(0, b"first")
+        pack.append(1, b"second")
+    with (tmp_path / PACK_DATA_NAME).open("ab") as data, (tmp_path / PACK_INDEX_NAME).open("ab") as index:
+        data.write(b"partial")
+        index.write(b"\x00" * 10)
+
+    with SegmentPack(tmp_path, writable=True) as pack:
+        assert [entry.index for entry in pack.ordered()] == [0, 1]
+        pack.append(2, b"third")
+    with SegmentPack(tmp_path) as pack:
+        assert [bytes(pack.read(entry)) for entry in pack.ordered()] == [b"first", b"second", b"third"]
+
+
+def test_inspect_reports_a_corrupted_packed_segment(tmp_path):
+    with SegmentPack(tmp_path, writable=True) as pack:
+        for index in range(3):
+            pack.append(index, generate_segment(index))
+        damaged = pack.entries[1]
+    with (tmp_path / PACK_DATA_NAME).open("r+b") as data:
+        data.seek(damaged.offset + damaged.size - 1)
+        data.write(b"\xff")
+
+    with SegmentPack(tmp_path) as pack:
+        pack.verify(pack.entries[0])
+        with pytest.raises(ValueError, match="sha256"):
+            pack.verify(pack.entries[1])
+    report = inspect_folder(tmp_path)
+    assert report["segments"] == 2
+    assert [error["segment"] for error in report["errors"]] == ["1"]
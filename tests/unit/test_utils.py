@@ -1,6 +1,11 @@
 from datetime import timedelta
 
-from src.utils import timedelta_new
+import pytest
+from click.testing import CliRunner
+
+from src.create_vtt_subs import create_vtt
+
+from src.utils import format_timestamp, list_segments, parse_timestamp, timedelta_new, to_milliseconds, write_atomic
 
 
 def test_timedelta_days_float():
@@ -15,3 +20,37 @@ def test_timedelta_weeks_days_microseconds_float():
     assert timedelta_new(weeks=1.5, days=1.6357, microseconds=8888888888888.5698432) == timedelta(
         days=115, seconds=1413, microseconds=368889
     )
+
+
+def test_list_segments_skips_hidden_files(tmp_path):
+    for name in ("00020000.mp4", "00000000.mp4", "00010000.mp4"):
+        write_atomic(tmp_path / name, b"segment")
+    write_atomic(tmp_path / ".dashvtt-manifest.json", b"{}")
+    assert list_segments(tmp_path) == ["00000000.mp4", "00010000.mp4", "00020000.mp4"]
+
+
+def test_format_timestamp_after_a_day():
+    assert format_timestamp(0) == "00:00:00.000"
+    assert format_timestamp(90061001) == "25:01:01.001"
+
+
+def test_to_milliseconds_timescale():
+    assert to_milliseconds(180000, 90000) == 2000
+    assert to_milliseconds(1001, 1000) == 1001
+
+
+def test_parse_timestamp_forms():
+    assert parse_timestamp("2400") == parse_timestamp("40:00") == parse_timestamp("00:40:00.000") == 2400000
+    assert parse_timestamp("1:02:03.5") == 3723500
+
+
+@pytest.mark.parametrize("timestamp", ["-5", "1:-5", "00:60", "1:60:00", "1:00:75.5", "1.-5", "1::2", "1 0"])
+def test_parse_timestamp_rejects_out_of_range_values(timestamp):
+    with pytest.raises(ValueError):
+        parse_timestamp(timestamp)
+
+
+def test_create_vtt_rejects_an_invalid_window(tmp_path):
+    result = CliRunner().invoke(create_vtt, ["-i", str(tmp_path), "-o", str(tmp_path / "out.vtt"), "--end", "00:61"])
+    assert result.exit_code == 2
+    assert "below 60" in result.output
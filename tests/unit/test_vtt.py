@@ -0,0 +1,40 @@
+import struct
+
+from src.vtt import Cue, CuePayload, decode_vtt_sample, deduplicate_cues, deduplicate_subtitles
+
+
+def _box(name, payload):
+    return struct.pack(">I4s", 8 + len(payload), name.encode()) + payload
+
+
+def test_deduplicate_cues_merges_repeated_cues():
+    cues = [
+        Cue(0, 1500, "", "first"),
+        Cue(2000, 4000, "line:90%", "across segments"),
+        Cue(4000, 5500, "line:90%", "across segments"),
+        Cue(6000, 7000, "", "first"),
+        Cue(8000, 9000, "", "first"),
+    ]
+    assert list(deduplicate_cues(cues)) == [
+        Cue(0, 1500, "", "first"),
+        Cue(2000, 5500, "line:90%", "across segments"),
+        Cue(6000, 7000, "", "first"),
+        Cue(8000, 9000, "", "first"),
+    ]
+
+
+def test_deduplicate_subtitles_text_with_arrow():
+    subtitles = "WEBVTT\n\n0:00:01.000 --> 0:00:02.000\nA --> B\n\n0:00:02.000 --> 0:00:03.000\nA --> B\n"
+    assert deduplicate_subtitles(subtitles) == "WEBVTT\n\n00:00:01.000 --> 00:00:03.000\nA --> B\n"
+
+
+def test_decode_vtt_sample_with_several_cues():
+    sample = _box("vttc", _box("payl", "première".encode())) + _box(
+        "vttc",
+        _box("iden", b"2") + _box("sttg", b"line:90%") + _box("payl", b"a --> b") + _box("vsid", b"\x00\x00\x00\x01"),
+    )
+    assert decode_vtt_sample(memoryview(sample)) == [
+        CuePayload(identifier="", style="", text="première"),
+        CuePayload(identifier="2", style="line:90%", text="a --> b"),
+    ]
+    assert decode_vtt_sample(memoryview(_box("vtte", b""))) == []
@@ -0,0 +1,28 @@
+from src.create_vtt_subs import extract_vtt_from_dash
+from src.vtt import clip_cues, parse_vtt, render_vtt
+from src.synthetic import segment_time, write_dash_folder
+from src.window import read_file_span, select_window
+
+
+def test_select_window_reads_few_sidx_boxes(tmp_path):
+    write_dash_folder(tmp_path, 64)
+    paths = sorted(tmp_path.iterdir())
+    read = []
+
+    def read_span(path):
+        read.append(path)
+        return read_file_span(path)
+
+    selected = select_window(paths, read_span, segment_time(40) + 1, segment_time(42))
+    assert selected == paths[40:42]
+    assert len(read) < 12
+
+
+def test_window_extraction_clips_the_cues(tmp_path):
+    write_dash_folder(tmp_path / "dash", 20)
+    extract_vtt_from_dash(tmp_path / "dash", tmp_path / "full.vtt")
+    window = (segment_time(7) + 500, segment_time(9) + 3000)
+    extract_vtt_from_dash(tmp_path / "dash", tmp_path / "window.vtt", window=window)
+
+    expected = render_vtt(clip_cues(parse_vtt((tmp_path / "full.vtt").read_text()), *window))
+    assert (tmp_path / "window.vtt").read_text() == expected
@@ -0,0 +1,34 @@
+import json
+
+from src.vtt import Cue
+from src.writers import create_writer
+
+
+def test_fan_out_writes_every_format_from_one_stream(tmp_path):
+    cues = [
+        Cue(0, 1500, "line:90%", "<c.yellow>first</c> & <i>second</i>"),
+        Cue(1500, 3000, "line:90%", "<c.yellow>first</c> & <i>second</i>"),
+        Cue(4000, 5000, "", "two\nlines"),
+    ]
+    outputs = [(output_format, tmp_path / f"out.{output_format}") for output_format in ("vtt", "srt", "ttml", "json")]
+    with create_writer(outputs) as writer:
+        writer.write_all(cues)
+    assert writer.cue_count == 2
+
+    assert (
+        (tmp_path / "out.vtt")
+        .read_text("utf-8")
+        .endswith(
+            "\n00:00:00.000 --> 00:00:03.000 line:90%\n<c.yellow>first</c> & <i>second</i>\n"
+            "\n00:00:04.000 --> 00:00:05.000\ntwo\nlines\n"
+        )
+    )
+    assert (tmp_path / "out.srt").read_text("utf-8") == (
+        "1\n00:00:00,000 --> 00:00:03,000\nfirst & <i>second</i>\n\n2\n00:00:04,000 --> 00:00:05,000\ntwo\nlines\n\n"
+    )
+    ttml = (tmp_path / "out.ttml").read_text("utf-8")
+    assert (
+        '<p begin="00:00:00.000" end="00:00:03.000">first &amp; <span tts:fontStyle="italic">second</span></p>' in ttml
+    )
+    assert '<p begin="00:00:04.000" end="00:00:05.000">two<br/>lines</p>' in ttml
+    assert [cue["end_ms"] for cue in json.loads((tmp_path / "out.json").read_text("utf-8"))] == [3000, 5000]